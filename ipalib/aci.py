@@ -17,7 +17,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import shlex
 import re
 
 # The Python re module doesn't do nested parenthesis
@@ -31,6 +30,24 @@ PermPat = re.compile(r'(\w+)\s*\((.*)\)\s+(.*)', re.UNICODE)
 # Break the bind rule out
 BindPat = re.compile(r'([a-zA-Z0-9;\.]+)\s*(\!?=)\s*(.*)', re.UNICODE)
 
+# Tokens of the target part of an ACI. This splits the string the same way
+# as a non-POSIX shlex.shlex with '.' added to the word characters:
+# comments are skipped, words may contain quotes and comments, quoted
+# strings keep their quotes, any other character is a token of its own.
+TokenPat = re.compile(r"""
+    [ \t\r\n]+ |                                 # whitespace
+    \#[^\n]*\n? |                                 # comment
+    (?P<word>[a-zA-Z0-9_.](?:[a-zA-Z0-9_.'"]|\#[^\n]*\n?)*) |
+    (?P<quoted>"[^"]*"|'[^']*') |
+    (?P<unclosed>["']) |
+    (?P<char>.)
+""", re.VERBOSE | re.DOTALL)
+
+CommentPat = re.compile(r'#[^\n]*\n?')
+
+# Separator of the attributes in targetattr
+TargetAttrSepPat = re.compile(r'[^a-zA-Z0-9;\*]+')
+
 ACTIONS = ["allow", "deny"]
 
 PERMISSIONS = ["read", "write", "add", "delete", "search", "compare",
@@ -93,34 +110,60 @@ class ACI:
             s = s[:-1]
         return s
 
-    def _parse_target(self, aci):
-        lexer = shlex.shlex(aci.encode('utf-8'))
-        lexer.wordchars = lexer.wordchars + "."
-
-        l = []
+    def _tokenize_target(self, aci):
+        tokens = []
+        for match in TokenPat.finditer(aci.encode('utf-8')):
+            kind = match.lastgroup
+            if kind is None:
+                continue
+            token = match.group(kind)
+            if kind == 'word' and '#' in token:
+                token = CommentPat.sub('', token)
+            elif kind == 'unclosed':
+                raise SyntaxError("No closing quotation in target")
+            tokens.append(token)
+        return tokens
 
-        var = False
-        op = "="
-        for token in lexer:
+    def _parse_target(self, aci):
+        tokens = self._tokenize_target(aci)
+        ntokens = len(tokens)
+
+        var = None
+        i = 0
+        while i < ntokens:
+            token = tokens[i]
+            i += 1
             # We should have the form (a = b)(a = b)...
-            if token == "(":
-                var = lexer.next().strip()
-                operator = lexer.next()
+            if token != "(":
+                if var is None:
+                    raise SyntaxError("Unexpected '%s' in target" % token)
+                # Anything between the targets is ignored
+                continue
+
+            # ( var operator value ) or ( var ! = value )
+            if i + 4 > ntokens:
+                raise SyntaxError("Incomplete target")
+            var = tokens[i].strip()
+            operator = tokens[i + 1]
+            i += 2
+            if operator != "=" and operator != "!=":
+                # Peek at the next char before giving up
+                operator = operator + tokens[i]
+                i += 1
                 if operator != "=" and operator != "!=":
-                    # Peek at the next char before giving up
-                    operator = operator + lexer.next()
-                    if operator != "=" and operator != "!=":
-                        raise SyntaxError("No operator in target, got '%s'" % operator)
-                op = operator
-                val = lexer.next().strip()
-                val = self._remove_quotes(val)
-                end = lexer.next()
-                if end != ")":
-                    raise SyntaxError('No end parenthesis in target, got %s' % end)
+                    raise SyntaxError("No operator in target, got '%s'" % operator)
+                if i + 2 > ntokens:
+                    raise SyntaxError("Incomplete target")
+            op = operator
+            val = self._remove_quotes(tokens[i].strip())
+            end = tokens[i + 1]
+            i += 2
+            if end != ")":
+                raise SyntaxError('No end parenthesis in target, got %s' % end)
 
             if var == 'targetattr':
                 # Make a string of the form attr || attr || ... into a list
-                t = re.split('[^a-zA-Z0-9;\*]+', val)
+                t = TargetAttrSepPat.split(val)
                 self.target[var] = {}
                 self.target[var]['operator'] = op
                 self.target[var]['expression'] = t
@@ -257,3 +300,96 @@ class ACI:
 
     def __ne__(self, b):
         return not self == b
+
+
+# Parsed ACIs by ACI string. The cache is cleared when it grows over
+# MAX_PARSED_ACIS entries.
+MAX_PARSED_ACIS = 10000
+_parsed_acis = {}
+
+# ACIIndex objects by location DN
+_aci_indexes = {}
+
+
+def parse_aci(acistr):
+    """
+    Return the parsed `ACI` for ``acistr``, raise SyntaxError if it is
+    malformed.
+
+    The ACI objects are cached and shared by all callers, they must not be
+    modified. Use ``ACI(acistr)`` to get an ACI which can be modified.
+    """
+    try:
+        aci = _parsed_acis[acistr]
+    except KeyError:
+        try:
+            aci = ACI(acistr)
+        except SyntaxError, e:
+            aci = e
+        if len(_parsed_acis) >= MAX_PARSED_ACIS:
+            _parsed_acis.clear()
+        _parsed_acis[acistr] = aci
+
+    if isinstance(aci, SyntaxError):
+        raise aci
+    return aci
+
+
+class ACIIndex(object):
+    """
+    The parsed ACIs of an entry, indexed by ACI name.
+
+    Unparseable ACIs are skipped, their ACI strings and errors are stored in
+    the ``unparseable`` list.
+    """
+    def __init__(self, acistrs):
+        self.acistrs = tuple(acistrs)
+        self.acis = []
+        self.unparseable = []
+        self.__by_name = {}
+        for acistr in self.acistrs:
+            try:
+                aci = parse_aci(acistr)
+            except SyntaxError, e:
+                self.unparseable.append((acistr, e))
+                continue
+            self.acis.append((acistr, aci))
+            self.__by_name.setdefault(aci.name.lower(), []).append(
+                (acistr, aci))
+
+    def find(self, name, ignore_case=False):
+        """
+        Return the (ACI string, ACI) pairs of the ACIs named ``name``.
+        """
+        candidates = self.__by_name.get(name.lower(), [])
+        if ignore_case:
+            return list(candidates)
+        return [(s, a) for (s, a) in candidates if a.name == name]
+
+
+def get_aci_index(location, acistrs):
+    """
+    Return the `ACIIndex` of the ACIs ``acistrs`` of the entry ``location``.
+
+    The index is kept until the ACIs of the entry change or
+    `invalidate_aci_index` is called for the location.
+    """
+    key = str(location).lower()
+    acistrs = tuple(acistrs)
+    index = _aci_indexes.get(key)
+    if index is None or index.acistrs != acistrs:
+        index = ACIIndex(acistrs)
+        _aci_indexes[key] = index
+    return index
+
+
+def invalidate_aci_index(location=None):
+    """
+    Drop the cached `ACIIndex` of the entry ``location``, or all indexes.
+
+    Call this after modifying the ACIs of an entry.
+    """
+    if location is None:
+        _aci_indexes.clear()
+    else:
+        _aci_indexes.pop(str(location).lower(), None)
@@ -44,6 +44,7 @@ except ImportError:
 import frontend
 import backend
 import plugable
+import clicache
 from errors import (PublicError, CommandError, HelpError, InternalError,
                     NoSuchNamespaceError, ValidationError, NotFound,
                     NotConfiguredError, PromptFailed)
@@ -1334,8 +1335,18 @@ def run(api):
         (options, argv) = api.bootstrap_with_global_options(context='cli')
         for klass in cli_plugins:
             api.register(klass)
-        api.load_plugins()
-        api.finalize()
+        cached = None
+        if api.env.cli_cache and argv:
+            cached = clicache.load_command(api, from_cli(argv[0]))
+        if cached is not None:
+            api.register(cached)
+            api.load_plugin_modules(clicache.CLIENT_PLUGIN_MODULES)
+            api.finalize()
+        else:
+            api.load_plugins()
+            api.finalize()
+            if api.env.cli_cache:
+                clicache.update_cache(api)
         if not 'config_loaded' in api.env and not 'help' in argv:
             raise NotConfiguredError()
         sys.exit(api.Backend.cli.run(argv))
@@ -0,0 +1,279 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Cache of finalized command metadata for the command line interface.
+
+Importing all plugin modules and finalizing them is the most expensive part
+of an ``ipa`` invocation, although only a single command is forwarded to the
+server. The metadata the CLI needs to parse the arguments, prompt for
+values, forward the call and print the result (params, outputs and output
+params) is stored per user in ``~/.ipa/cli_cache``. When the command being
+run is found in the cache, `ipalib.cli.run` registers a stand-in `Command`
+created from the cached metadata instead of loading the plugins.
+
+Only commands which use the generic client side behavior of `Command` can be
+cached, commands with custom client side code (for example a custom
+``output_for_cli`` or ``forward``) or params that cannot be reconstructed
+are always run with all the plugins loaded.
+
+The cache is keyed by the API version, the locale and the size and
+modification time of the ipalib modules and of the plugin modules, so it is
+rebuilt whenever any of them changes.
+"""
+
+import os
+import sys
+import json
+import hashlib
+
+from ipalib import frontend, output, parameters
+from ipalib.text import LazyText, ConcatenatedLazyText
+from ipapython.version import API_VERSION
+
+CACHE_FORMAT = 1
+CACHE_DIR = 'cli_cache'
+
+# Plugin modules which are loaded even when the command comes from the cache
+CLIENT_PLUGIN_MODULES = ('ipalib.plugins.rpcclient',)
+
+# Methods of Command used on the client; commands overriding any of them
+# cannot be run from the cache
+CLIENT_METHODS = (
+    '__call__', 'run', 'forward', 'output_for_cli', 'args_options_2_params',
+    'params_2_args_options', 'normalize', 'convert', 'validate',
+    'get_default', 'get_default_of', 'prompt_param',
+)
+
+# Param keyword arguments which are not needed on the client
+IGNORED_KWARGS = ('normalizer', 'include', 'exclude')
+
+
+class NotCacheable(Exception):
+    pass
+
+
+def get_cache_key(api):
+    """
+    Return the key identifying cache data valid for this client.
+    """
+    key = hashlib.sha1()
+    key.update('%d %s\n' % (CACHE_FORMAT, API_VERSION))
+    for name in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
+        key.update('%s=%s\n' % (name, os.environ.get(name, '')))
+    key.update('rpc_protocol=%s\n' % api.env.rpc_protocol)
+
+    for package in api.packages:
+        package = package.replace(os.path.sep, '.')
+        __import__(package)
+        package_dir = os.path.dirname(sys.modules[package].__file__)
+        for src_dir in (package_dir, os.path.join(package_dir, 'plugins')):
+            try:
+                names = sorted(os.listdir(src_dir))
+            except OSError:
+                continue
+            for name in names:
+                if not name.endswith('.py'):
+                    continue
+                st = os.stat(os.path.join(src_dir, name))
+                key.update('%s/%s %d %d\n' % (
+                    src_dir, name, st.st_size, st.st_mtime))
+
+    return key.hexdigest()
+
+
+def get_cache_file(api, key):
+    return os.path.join(api.env.dot_ipa, CACHE_DIR, '%s.json' % key)
+
+
+def _dump_value(value):
+    if isinstance(value, (LazyText, ConcatenatedLazyText)):
+        return unicode(value)
+    if value is None or isinstance(value, (bool, int, long, float, basestring)):
+        return value
+    if isinstance(value, (tuple, list, frozenset, set)):
+        return [_dump_value(v) for v in value]
+    raise NotCacheable(repr(value))
+
+
+def _load_value(value, kind):
+    if value is None:
+        return value
+    if kind is str:
+        return str(value)
+    if kind is tuple:
+        return tuple(value)
+    if kind is frozenset:
+        return frozenset(value)
+    return value
+
+
+def dump_param(param):
+    """
+    Return the metadata needed to recreate ``param`` on the client.
+
+    Raises `NotCacheable` if the param cannot be recreated.
+    """
+    cls = type(param)
+    if getattr(parameters, cls.__name__, None) is not cls:
+        raise NotCacheable('%s is not a standard param' % param.name)
+    if param.default_from is not None:
+        raise NotCacheable('%s has default_from' % param.name)
+
+    kw = {}
+    for (key, kind, default) in param.kwargs:
+        if key in IGNORED_KWARGS or key == 'default_from':
+            continue
+        value = getattr(param, key)
+        if value != default:
+            kw[key] = _dump_value(value)
+
+    return dict(cls=cls.__name__, name=param.name, kw=kw)
+
+
+def load_param(data):
+    """
+    Recreate a param from the data returned by `dump_param`.
+    """
+    cls = getattr(parameters, data['cls'])
+    kinds = dict((key, kind) for (key, kind, default) in cls.kwargs)
+    if data['kw'].get('multivalue', False):
+        kinds['default'] = tuple
+    else:
+        kinds['default'] = cls.type
+
+    kw = {}
+    for key, value in data['kw'].iteritems():
+        kw[str(key)] = _load_value(value, kinds[key])
+
+    return cls(str(data['name']), **kw)
+
+
+def dump_output(o):
+    cls = type(o)
+    if getattr(output, cls.__name__, None) is not cls:
+        raise NotCacheable('%s is not a standard output' % o.name)
+
+    return dict(cls=cls.__name__, name=o.name, doc=_dump_value(o.doc),
+                flags=_dump_value(o.flags))
+
+
+def load_output(data):
+    cls = getattr(output, data['cls'])
+    return cls(str(data['name']), doc=data['doc'], flags=data['flags'])
+
+
+def dump_command(cmd):
+    """
+    Return the metadata needed to run ``cmd`` from the CLI.
+
+    Raises `NotCacheable` if the command has custom client side behavior.
+    """
+    if cmd.NO_CLI or isinstance(cmd, (frontend.Local, frontend.LocalOrRemote)):
+        raise NotCacheable('%s is not forwarded' % cmd.name)
+
+    for name in CLIENT_METHODS:
+        method = getattr(type(cmd), name)
+        if getattr(method, 'im_func', method) is not \
+                getattr(frontend.Command, name).im_func:
+            raise NotCacheable('%s overrides %s' % (cmd.name, name))
+
+    if hasattr(cmd, 'get_callbacks'):
+        for callback in cmd.get_callbacks('interactive_prompt'):
+            callback = getattr(callback, 'im_func', callback)
+            # Only the no-op defaults of the LDAP commands are allowed
+            if callback.__module__ != 'ipalib.plugins.baseldap':
+                raise NotCacheable('%s has interactive prompt callbacks' %
+                                   cmd.name)
+
+    return dict(
+        doc=unicode(cmd.doc),
+        args=[dump_param(p) for p in cmd.args()],
+        options=[dump_param(p) for p in cmd.options()],
+        output=[dump_output(o) for o in cmd.output()],
+        output_params=[
+            dict(name=p.name, label=_dump_value(p.label),
+                 flags=_dump_value(p.flags))
+            for p in cmd.output_params()
+        ],
+    )
+
+
+def create_command(name, data):
+    """
+    Create a `Command` subclass from the data returned by `dump_command`.
+    """
+    def get_options(self):
+        return self._get_param_iterable('options')
+
+    def get_output_params(self):
+        return self._get_param_iterable('output_params', verb='has')
+
+    return type(str(name), (frontend.Command,), dict(
+        __doc__=data['doc'],
+        __module__=__name__,
+        takes_args=tuple(load_param(p) for p in data['args']),
+        takes_options=tuple(load_param(p) for p in data['options']),
+        has_output=tuple(load_output(o) for o in data['output']),
+        has_output_params=tuple(
+            parameters.Str(str(p['name']), label=p['label'],
+                           flags=p['flags'])
+            for p in data['output_params']
+        ),
+        get_options=get_options,
+        get_output_params=get_output_params,
+        # The server validates the output, the stand-in is only used for
+        # printing it
+        use_output_validation=False,
+    ))
+
+
+def load_command(api, name):
+    """
+    Return a stand-in `Command` class for the command ``name`` if it is
+    present in a valid cache, otherwise None.
+    """
+    try:
+        with open(get_cache_file(api, get_cache_key(api))) as f:
+            data = json.load(f)['commands'][name]
+    except (IOError, OSError, ValueError, KeyError, TypeError):
+        return None
+
+    try:
+        return create_command(name, data)
+    except Exception, e:
+        api.log.debug('cannot create cached command %s: %s', name, e)
+        return None
+
+
+def update_cache(api):
+    """
+    Store the metadata of all cacheable commands of the finalized ``api``
+    unless the cache is already up to date.
+    """
+    key = get_cache_key(api)
+    filename = get_cache_file(api, key)
+    if os.path.exists(filename):
+        return
+
+    commands = {}
+    for cmd in api.Command():
+        try:
+            commands[cmd.name] = dump_command(cmd)
+        except NotCacheable, e:
+            api.log.debug('not caching command: %s', e)
+
+    cache_dir = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        # Remove caches built for other versions
+        for name in os.listdir(cache_dir):
+            os.unlink(os.path.join(cache_dir, name))
+        tmpname = '%s.%d' % (filename, os.getpid())
+        with open(tmpname, 'w') as f:
+            json.dump(dict(commands=commands), f)
+        os.rename(tmpname, filename)
+    except (IOError, OSError), e:
+        api.log.debug('cannot write CLI cache %s: %s', filename, e)
@@ -135,6 +135,18 @@ DEFAULT_CONFIG = (
     # Time to wait for a service to start, in seconds
     ('startup_timeout', 300),
 
+    # Time to cache the ranking of the IPA servers by responsiveness, in
+    # seconds, 0 to probe the servers on every connection
+    ('server_ranking_ttl', 300),
+
+    # Keep idle RPC connections open for reuse by later connections of the
+    # same process
+    ('rpc_connection_pool', False),
+
+    # Time to cache the trust configuration and trusted domain object
+    # lookups on the server, in seconds, 0 to disable the cache
+    ('trust_cache_ttl', 300),
+
     # Web Application mount points
     ('mount_ipa', '/ipa/'),
 
@@ -155,6 +167,13 @@ DEFAULT_CONFIG = (
     ('mode', 'production'),
     ('wait_for_dns', 0),
 
+    # Audit log:
+    # Path of a file the server appends a JSON record to for every executed
+    # command, None disables it.
+    ('audit_log', None),
+    # Record the LDAP operations performed by every command in the audit log
+    ('ldap_trace', False),
+
     # CA plugin:
     ('ca_host', FQDN),  # Set in Env._finalize_core()
     ('ca_port', 80),
@@ -174,6 +193,8 @@ DEFAULT_CONFIG = (
     ('interactive', True),
     ('fallback', True),
     ('delegate', False),
+    # Run commands from ~/.ipa/cli_cache without loading all plugins:
+    ('cli_cache', True),
 
     # Enable certain optional plugins:
     ('enable_ra', False),
@@ -22,6 +22,7 @@ Base classes for all front-end plugins.
 """
 
 import re
+import logging
 from distutils import version
 
 from ipapython.version import API_VERSION
@@ -35,6 +36,7 @@ from errors import (ZeroArgumentError, MaxArgumentError, OverlapError,
     VersionError, OptionError, InvocationError,
     ValidationError, ConversionError)
 from ipalib import messages
+from ipalib.request import set_command_params
 from textwrap import wrap
 
 
@@ -402,6 +404,11 @@ class Command(HasParam):
     options = Plugin.finalize_attr('options')
     params = Plugin.finalize_attr('params')
     params_by_default = Plugin.finalize_attr('params_by_default')
+    # Call plan precomputed in _on_finalize(), see _compile_call_plan()
+    _default_params = Plugin.finalize_attr('_default_params')
+    _default_deps = Plugin.finalize_attr('_default_deps')
+    _convert_params = Plugin.finalize_attr('_convert_params')
+    _output_names = Plugin.finalize_attr('_output_names')
     obj = None
 
     use_output_validation = True
@@ -428,17 +435,10 @@ class Command(HasParam):
             self.verify_client_version(unicode(options['version']))
         else:
             options['version'] = API_VERSION
-        params = self.args_options_2_params(*args, **options)
-        self.debug(
-            'raw: %s(%s)', self.name, ', '.join(self._repr_iter(**params))
-        )
-        params.update(self.get_default(**params))
-        params = self.normalize(**params)
-        params = self.convert(**params)
-        self.debug(
-            '%s(%s)', self.name, ', '.join(self._repr_iter(**params))
-        )
-        self.validate(**params)
+        params = self._prepare_params(args, options)
+        if self.api.env.in_server:
+            # Reused for the request log line by the RPC server
+            set_command_params(self.name, params)
         (args, options) = self.params_2_args_options(**params)
         ret = self.run(*args, **options)
         if (not version_provided and isinstance(ret, dict) and
@@ -457,6 +457,54 @@ class Command(HasParam):
             self.validate_output(ret, options['version'])
         return ret
 
+    def internal(self, *args, **options):
+        """
+        Execute the command on behalf of another command on the server.
+
+        Parameters are still normalized, converted and validated, but the
+        client version check, the version message and output validation are
+        skipped, as the caller is the server itself. Outside of the server
+        this is the same as calling the command.
+        """
+        if not self.api.env.in_server:
+            return self(*args, **options)
+        (args, options) = self._prepare_internal(args, options)
+        return self.execute(*args, **options)
+
+    def _prepare_internal(self, args, options):
+        self.ensure_finalized()
+        if 'version' not in options:
+            options['version'] = API_VERSION
+        params = self._prepare_params(args, options)
+        return self.params_2_args_options(**params)
+
+    def _prepare_params(self, args, options):
+        """
+        Merge args and options into params, fill in defaults and normalize,
+        convert and validate the values.
+
+        The call arguments are only formatted for the debug log when debug
+        logging is enabled.
+        """
+        params = self.args_options_2_params(*args, **options)
+        debug = self.log.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.debug(
+                'raw: %s(%s)', self.name, ', '.join(self._repr_iter(**params))
+            )
+        params.update(self.get_default(**params))
+        if self._convert_params is not None:
+            params = self.__normalize_and_convert(params)
+        else:
+            params = self.normalize(**params)
+            params = self.convert(**params)
+        if debug:
+            self.debug(
+                '%s(%s)', self.name, ', '.join(self._repr_iter(**params))
+            )
+        self.validate(**params)
+        return params
+
     def soft_validate(self, values):
         errors = dict()
         for p in self.params():
@@ -637,10 +685,19 @@ class Command(HasParam):
             (k, self.params[k].convert(v)) for (k, v) in kw.iteritems()
         )
 
-    def __convert_iter(self, kw):
-        for param in self.params():
-            if kw.get(param.name, None) is None:
-                continue
+    def __normalize_and_convert(self, kw):
+        """
+        Return a dictionary of normalized and converted values.
+
+        This does the same as `Command.normalize` followed by
+        `Command.convert` in a single pass. It is used by `Command.__call__`
+        unless a subclass overrides one of them.
+        """
+        params = self._convert_params
+        return dict(
+            (k, params[k].convert(params[k].normalize(v)))
+            for (k, v) in kw.iteritems()
+        )
 
     def get_default(self, **kw):
         """
@@ -659,7 +716,7 @@ class Command(HasParam):
         >>> c.get_default(color=u'Yellow')
         {}
         """
-        params = [p.name for p in self.params() if p.name not in kw and (p.required or p.autofill)]
+        params = [p.name for p in self._default_params if p.name not in kw]
         return dict(self.__get_default_iter(params, kw))
 
     def get_default_of(self, name, **kw):
@@ -676,12 +733,8 @@ class Command(HasParam):
         # Find out what additional parameters are needed to dynamically create
         # the default values with default_from.
         dep = set()
-        for param in reversed(self.params_by_default):
-            if param.name in params or param.name in dep:
-                if param.default_from is None:
-                    continue
-                for name in param.default_from.keys:
-                    dep.add(name)
+        for name in params:
+            dep.update(self._default_deps.get(name, ()))
 
         for param in self.params_by_default():
             default = None
@@ -709,6 +762,19 @@ class Command(HasParam):
                 if default is not None:
                     yield (param.name, default)
 
+    def __get_default_deps(self, params):
+        """
+        Return names of parameters needed to create defaults of `params`.
+        """
+        dep = set()
+        for param in reversed(self.params_by_default):
+            if param.name in params or param.name in dep:
+                if param.default_from is None:
+                    continue
+                for name in param.default_from.keys:
+                    dep.add(name)
+        return dep
+
     def validate(self, **kw):
         """
         Validate all values.
@@ -829,8 +895,32 @@ class Command(HasParam):
         self.params_by_default = NameSpace(params, sort=False)
         self.output = NameSpace(self._iter_output(), sort=False)
         self._create_param_namespace('output_params')
+        self._compile_call_plan()
         super(Command, self)._on_finalize()
 
+    def _compile_call_plan(self):
+        """
+        Precompute what `Command.__call__` needs on every call.
+
+        Dependencies of default values are resolved once here rather than
+        walking ``params_by_default`` for each call, and normalization and
+        conversion are fused into a single pass when the subclass does not
+        customize either of them.
+        """
+        self._default_params = tuple(
+            p for p in self.params() if p.required or p.autofill)
+        self._default_deps = dict(
+            (p.name, frozenset(self.__get_default_deps([p.name])))
+            for p in self.params_by_default() if p.default_from is not None
+        )
+        cls = type(self)
+        if (cls.normalize.im_func is Command.normalize.im_func and
+                cls.convert.im_func is Command.convert.im_func):
+            self._convert_params = dict((p.name, p) for p in self.params())
+        else:
+            self._convert_params = None
+        self._output_names = frozenset(self.output)
+
     def _iter_output(self):
         if type(self.has_output) is not tuple:
             raise TypeError('%s.has_output: need a %r; got a %r: %r' % (
@@ -927,7 +1017,7 @@ class Command(HasParam):
             raise TypeError('%s: need a %r; got a %r: %r' % (
                 nice, dict, type(output), output)
             )
-        expected_set = set(self.output)
+        expected_set = self._output_names
         actual_set = set(output) - set(['messages'])
         if expected_set != actual_set:
             missing = expected_set - actual_set
@@ -40,11 +40,7 @@ def get_subject(csr, datatype=PEM):
 
     This returns an nss.DN object.
     """
-    request = load_certificate_request(csr, datatype)
-    try:
-        return request.subject
-    finally:
-        del request
+    return CertificationRequest(csr, datatype).subject
 
 def get_extensions(csr, datatype=PEM):
     """
@@ -52,9 +48,7 @@ def get_extensions(csr, datatype=PEM):
 
     The return value is a tuple of strings
     """
-    request = load_certificate_request(csr, datatype)
-    return tuple(nss.oid_dotted_decimal(ext.oid_tag)[4:]
-                 for ext in request.extensions)
+    return CertificationRequest(csr, datatype).extensions
 
 class _PrincipalName(univ.Sequence):
     componentType = namedtype.NamedTypes(
@@ -135,14 +129,9 @@ def get_subjectaltname(csr, datatype=PEM):
 
     The return value is a tuple of strings or None
     """
-    request = load_certificate_request(csr, datatype)
-    for extension in request.extensions:
-        if extension.oid_tag == nss.SEC_OID_X509_SUBJECT_ALT_NAME:
-            break
-    else:
-        return None
-    del request
+    return CertificationRequest(csr, datatype).subjectaltname
 
+def _decode_subjectaltname(extension):
     nss_names = nss.x509_alt_name(extension.value, nss.AsObject)
     asn1_names = decoder.decode(extension.value.data,
                                 asn1Spec=_SubjectAltName())[0]
@@ -197,13 +186,61 @@ def get_friendlyname(csr, datatype=PEM):
         csr = strip_header(csr)
         csr = base64.b64decode(csr)
 
-    csr = decoder.decode(csr, asn1Spec=_CertificationRequest())[0]
+    return _decode_friendlyname(csr)
+
+def _decode_friendlyname(der):
+    csr = decoder.decode(der, asn1Spec=_CertificationRequest())[0]
     for attribute in csr['certificationRequestInfo']['attributes']:
         if attribute['type'] == _FRIENDLYNAME:
             return unicode(attribute['values'][0])
 
     return None
 
+class CertificationRequest(object):
+    """
+    A CSR decoded once for everything IPA checks in it.
+
+    The request is decoded by NSS and the subject alt name extension by
+    pyasn1 when the object is created, so decoding errors are raised by the
+    constructor. The friendly name attribute, which NSS cannot parse, is
+    decoded by pyasn1 on first use.
+    """
+
+    def __init__(self, csr, datatype=PEM):
+        if datatype == PEM:
+            csr = strip_header(csr)
+            csr = base64.b64decode(csr)
+        self.der = csr
+        self.request = load_certificate_request(csr, DER)
+        self.subject = self.request.subject
+
+        extensions = []
+        self.subjectaltname = None
+        for extension in self.request.extensions:
+            extensions.append(nss.oid_dotted_decimal(extension.oid_tag)[4:])
+            if (extension.oid_tag == nss.SEC_OID_X509_SUBJECT_ALT_NAME and
+                    self.subjectaltname is None):
+                self.subjectaltname = _decode_subjectaltname(extension)
+        self.extensions = tuple(extensions)
+
+    @property
+    def principal_names(self):
+        """
+        Kerberos principal names and UPNs in the subject alt name.
+        """
+        return tuple(
+            name for (name_type, name) in self.subjectaltname or ()
+            if name_type in (SAN_OTHERNAME_KRB5PRINCIPALNAME,
+                             SAN_OTHERNAME_UPN))
+
+    @property
+    def friendlyname(self):
+        try:
+            return self._friendlyname
+        except AttributeError:
+            self._friendlyname = _decode_friendlyname(self.der)
+            return self._friendlyname
+
 def strip_header(csr):
     """
     Remove the header and footer from a CSR.
@@ -639,6 +639,25 @@ class API(DictProxy):
         for package in self.packages:
             self.import_plugins(package)
 
+    def load_plugin_modules(self, modules):
+        """
+        Load only the plugin modules ``modules`` instead of all plugins.
+
+        This is used instead of `API.load_plugins` when the plugins needed
+        are known in advance, for example by the command line interface
+        when running a command from `ipalib.clicache`.
+
+        `API.bootstrap` will automatically be called if it hasn't been
+        already.
+        """
+        self.__doing('load_plugins')
+        self.__do_if_not_done('bootstrap')
+        if self.env.mode in ('dummy', 'unit_test'):
+            return
+        for module in modules:
+            self.log.debug('importing plugin module %r', module)
+            __import__(module)
+
     # FIXME: This method has no unit test
     def import_plugins(self, package):
         """
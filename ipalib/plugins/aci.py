@@ -122,7 +122,7 @@ from copy import deepcopy
 from ipalib import api, crud, errors
 from ipalib import Object
 from ipalib import Flag, Str, StrEnum, DNParam
-from ipalib.aci import ACI
+from ipalib.aci import ACI, ACIIndex, parse_aci, get_aci_index, invalidate_aci_index
 from ipalib import output
 from ipalib import _, ngettext
 from ipalib.plugable import Registry
@@ -388,16 +388,28 @@ def _convert_strings_to_acis(acistrs):
     acis = []
     for a in acistrs:
         try:
-            acis.append(ACI(a))
+            acis.append(parse_aci(a))
         except SyntaxError, e:
             root_logger.warning("Failed to parse: %s" % a)
     return acis
 
+def _get_aci_index(entry):
+    """Return the ACIIndex of the ACIs of entry"""
+    index = get_aci_index(entry.dn, entry.get('aci', []))
+    for a, e in index.unparseable:
+        root_logger.warning("Failed to parse: %s" % a)
+    return index
+
 def _find_aci_by_name(acis, aciprefix, aciname):
+    """Find an ACI in a list of ACIs or in an ACIIndex"""
     name = _make_aci_name(aciprefix, aciname).lower()
-    for a in acis:
-        if a.name.lower() == name:
+    if isinstance(acis, ACIIndex):
+        for acistr, a in acis.find(name, ignore_case=True):
             return a
+    else:
+        for a in acis:
+            if a.name.lower() == name:
+                return a
     raise errors.NotFound(reason=_('ACI with name "%s" not found') % aciname)
 
 
@@ -539,8 +551,8 @@ class aci_add(crud.Create):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        for a in acis:
+        index = _get_aci_index(entry)
+        for acistr, a in index.acis:
             # FIXME: add check for permission_group = permission_group
             if a.isequal(newaci) or newaci.name == a.name:
                 raise errors.DuplicateEntry()
@@ -549,7 +561,10 @@ class aci_add(crud.Create):
         entry.setdefault('aci', []).append(newaci_str)
 
         if not kw.get('test', False):
-            ldap.update_entry(entry)
+            try:
+                ldap.update_entry(entry)
+            finally:
+                invalidate_aci_index(entry.dn)
 
         if kw.get('raw', False):
             result = dict(aci=unicode(newaci_str))
@@ -584,17 +599,19 @@ class aci_del(crud.Delete):
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
         acistrs = entry.get('aci', [])
-        acis = _convert_strings_to_acis(acistrs)
-        aci = _find_aci_by_name(acis, aciprefix, aciname)
-        for a in acistrs:
-            candidate = ACI(a)
+        index = _get_aci_index(entry)
+        aci = _find_aci_by_name(index, aciprefix, aciname)
+        for a, candidate in index.acis:
             if aci.isequal(candidate):
                 acistrs.remove(a)
                 break
 
         entry['aci'] = acistrs
 
-        ldap.update_entry(entry)
+        try:
+            ldap.update_entry(entry)
+        finally:
+            invalidate_aci_index(entry.dn)
 
         return dict(
             result=True,
@@ -626,8 +643,7 @@ class aci_mod(crud.Update):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        aci = _find_aci_by_name(acis, aciprefix, aciname)
+        aci = _find_aci_by_name(_get_aci_index(entry), aciprefix, aciname)
 
         # The strategy here is to convert the ACI we're updating back into
         # a series of keywords. Then we replace any keywords that have been
@@ -702,7 +718,7 @@ class aci_find(crud.Search):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
+        acis = [a for (acistr, a) in _get_aci_index(entry).acis]
         results = []
 
         if term:
@@ -910,9 +926,9 @@ class aci_show(crud.Retrieve):
         dn = kw.get('location', self.api.env.basedn)
         entry = ldap.get_entry(dn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
+        index = _get_aci_index(entry)
 
-        aci = _find_aci_by_name(acis, kw['aciprefix'], aciname)
+        aci = _find_aci_by_name(index, kw['aciprefix'], aciname)
         if kw.get('raw', False):
             result = dict(aci=unicode(aci))
         else:
@@ -949,10 +965,10 @@ class aci_rename(crud.Update):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        aci = _find_aci_by_name(acis, kw['aciprefix'], aciname)
+        index = _get_aci_index(entry)
+        aci = _find_aci_by_name(index, kw['aciprefix'], aciname)
 
-        for a in acis:
+        for acistr, a in index.acis:
             prefix, name = _parse_aci_name(a.name)
             if _make_aci_name(prefix, kw['newname']) == a.name:
                 raise errors.DuplicateEntry()
@@ -123,6 +123,9 @@ EXAMPLES:
 """) + _("""
  Rebuild membership for specified hosts:
     ipa automember-rebuild --hosts=web1.example.com --hosts=web2.example.com
+""") + _("""
+ Rebuild membership for users modified since the last complete rebuild:
+    ipa automember-rebuild --type=group --incremental
 """)
 
 register = Registry()
@@ -135,6 +138,16 @@ REBUILD_TASK_CONTAINER = DN(('cn', 'automember rebuild membership'),
                             ('cn', 'tasks'),
                             ('cn', 'config'))
 
+# Maximum number of entries named in the filter of a single rebuild task
+REBUILD_TASK_SIZE = 1000
+
+# The start time of the last complete rebuild is stored in ipaConfigString of
+# the automember definition entry as "lastRebuild:<generalized time>", the
+# default group at that time as "lastRebuildDefaultGroup:<DN>"
+LAST_REBUILD_PREFIX = u'lastRebuild:'
+LAST_REBUILD_FORMAT = '%Y%m%d%H%M%SZ'
+LAST_REBUILD_DEFAULT_GROUP_PREFIX = u'lastRebuildDefaultGroup:'
+
 
 regex_attrs = (
     Str('automemberinclusiveregex*',
@@ -203,7 +216,7 @@ class automember(LDAPObject):
             'ipapermdefaultattr': {
                 'objectclass', 'cn', 'automemberscope', 'automemberfilter',
                 'automembergroupingattr', 'automemberdefaultgroup',
-                'automemberdisabled',
+                'automemberdisabled', 'ipaconfigstring',
             },
             'default_privileges': {'Automember Readers',
                                    'Automember Task Administrator'},
@@ -227,6 +240,14 @@ class automember(LDAPObject):
             'ipapermdefaultattr': {'*'},
             'default_privileges': {'Automember Task Administrator'},
         },
+        'System: Record Automember Rebuild': {
+            'non_object': True,
+            'ipapermlocation': DN(container_dn, api.env.basedn),
+            'ipapermtargetfilter': {'(objectclass=automemberdefinition)'},
+            'ipapermright': {'write'},
+            'ipapermdefaultattr': {'ipaconfigstring'},
+            'default_privileges': {'Automember Task Administrator'},
+        },
     }
 
     label = _('Auto Membership Rule')
@@ -662,6 +683,13 @@ class automember_rebuild(Command):
             label=_('Hosts'),
             doc=_('Rebuild membership for specified hosts'),
         ),
+        Flag(
+            'incremental?',
+            default=False,
+            label=_('Incremental'),
+            doc=_('Rebuild membership only for entries modified since the '
+                  'last completed rebuild'),
+        ),
         Flag(
             'no_wait?',
             default=False,
@@ -672,10 +700,18 @@ class automember_rebuild(Command):
     has_output = output.standard_entry
     has_output_params = (
         DNParam(
-            'dn',
+            'dn*',
             label=_('Task DN'),
             doc=_('DN of the started task'),
         ),
+        Str(
+            'nstaskstatus*',
+            label=_('Task status'),
+        ),
+        Str(
+            'modified_since?',
+            label=_('Modified since'),
+        ),
     )
 
     def validate(self, **kw):
@@ -708,45 +744,113 @@ class automember_rebuild(Command):
                 reason=_("users cannot be set when type is 'hostgroup'")
             )
 
-    def execute(self, *keys, **options):
-        ldap = self.api.Backend.ldap2
-        cn = str(uuid.uuid4())
-
-        gtype = options.get('type')
-        if not gtype:
-            gtype = 'group' if options.get('users') else 'hostgroup'
+    def _check_names(self, ldap, obj, basedn, names):
+        """
+        Make sure that all entries in names exist.
 
-        types = {
-            'group': (
-                'user',
-                'users',
-                DN(api.env.container_user, api.env.basedn)
-            ),
-            'hostgroup': (
-                'host',
-                'hosts',
-                DN(api.env.container_host, api.env.basedn)
-            ),
-        }
+        Names are looked up in bulk, only those which are not found by their
+        primary key (e.g. short host names) are looked up one by one.
+        """
+        attr = obj.primary_key.name
+        found = set()
+        for i in xrange(0, len(names), BULK_SEARCH_SIZE):
+            search_filter = ldap.make_filter_from_attr(
+                attr, names[i:i + BULK_SEARCH_SIZE], rules=ldap.MATCH_ANY)
+            try:
+                entries, truncated = ldap.find_entries(
+                    search_filter, [attr], basedn, ldap.SCOPE_ONELEVEL,
+                    size_limit=0)
+            except errors.NotFound:
+                continue
+            for entry in entries:
+                found.update(value.lower() for value in entry.get(attr, []))
+
+        for name in names:
+            if name.lower() in found:
+                continue
+            try:
+                obj.get_dn_if_exists(name)
+            except errors.NotFound:
+                obj.handle_not_found(name)
+
+    def _get_last_rebuild(self, ldap, definition_dn):
+        """
+        Return the time the last complete rebuild was started as a
+        generalized time string or None if it is not known.
 
-        obj_name, opt_name, basedn = types[gtype]
-        obj = self.api.Object[obj_name]
+        None is returned as well if the rules or the default group changed
+        since then. They can make any entry a member of a group, not only
+        the entries modified since the last rebuild.
+        """
+        try:
+            entry = ldap.get_entry(
+                definition_dn, ['ipaconfigstring', 'automemberdefaultgroup'])
+        except errors.NotFound:
+            return None
+
+        timestamp = None
+        default_group = None
+        prefix = LAST_REBUILD_PREFIX.lower()
+        group_prefix = LAST_REBUILD_DEFAULT_GROUP_PREFIX.lower()
+        for value in entry.get('ipaconfigstring', []):
+            if value.lower().startswith(group_prefix):
+                default_group = value[len(group_prefix):]
+            elif value.lower().startswith(prefix):
+                timestamp = value[len(prefix):]
+        if timestamp is None:
+            return None
+        try:
+            time.strptime(timestamp, LAST_REBUILD_FORMAT)
+        except ValueError:
+            self.log.warning(
+                "Ignoring invalid automember rebuild time '%s' in %s",
+                timestamp, definition_dn)
+            return None
+
+        current_group = entry.single_value.get('automemberdefaultgroup')
+        if default_group != unicode(current_group or u''):
+            self.log.info(
+                "Automember default group changed since %s, rebuilding "
+                "all entries", timestamp)
+            return None
 
-        names = options.get(opt_name)
-        if names:
-            for name in names:
-                try:
-                    obj.get_dn_if_exists(name)
-                except errors.NotFound:
-                    obj.handle_not_found(name)
-            search_filter = ldap.make_filter_from_attr(
-                obj.primary_key.name,
-                names,
-                rules=ldap.MATCH_ANY
-            )
+        try:
+            ldap.find_entries(
+                '(modifytimestamp>=%s)' % timestamp, ['cn'], definition_dn,
+                ldap.SCOPE_ONELEVEL, size_limit=1)
+        except errors.NotFound:
+            pass
         else:
-            search_filter = '(%s=*)' % obj.primary_key.name
+            self.log.info(
+                "Automember rules changed since %s, rebuilding all entries",
+                timestamp)
+            return None
+
+        return timestamp
 
+    def _set_last_rebuild(self, ldap, definition_dn, timestamp):
+        prefixes = (LAST_REBUILD_PREFIX.lower(),
+                    LAST_REBUILD_DEFAULT_GROUP_PREFIX.lower())
+        try:
+            entry = ldap.get_entry(
+                definition_dn, ['ipaconfigstring', 'automemberdefaultgroup'])
+            values = [value for value in entry.get('ipaconfigstring', [])
+                      if not value.lower().startswith(prefixes)]
+            values.append(u'%s%s' % (LAST_REBUILD_PREFIX, timestamp))
+            default_group = entry.single_value.get('automemberdefaultgroup')
+            values.append(u'%s%s' % (LAST_REBUILD_DEFAULT_GROUP_PREFIX,
+                                     unicode(default_group or u'')))
+            entry['ipaconfigstring'] = values
+            ldap.update_entry(entry)
+        except errors.ExecutionError, e:
+            # Failing to record the time only makes the next incremental
+            # rebuild do more work, the rebuild itself succeeded
+            self.log.warning(
+                "Failed to record automember rebuild time in %s: %s",
+                definition_dn, e)
+
+    def _add_task(self, ldap, basedn, search_filter):
+        cn = str(uuid.uuid4())
         task_dn = DN(('cn', cn), REBUILD_TASK_CONTAINER)
 
         entry = ldap.make_entry(
@@ -759,31 +863,129 @@ class automember_rebuild(Command):
             ttl=[3600])
         ldap.add_entry(entry)
 
-        summary = _('Automember rebuild membership task started')
-        result = {'dn': task_dn}
+        return task_dn
 
-        if not options.get('no_wait'):
-            summary = _('Automember rebuild membership task completed')
-            result = {}
-            start_time = time.time()
+    def _wait_for_tasks(self, ldap, task_dns):
+        """
+        Wait until all tasks finish and return their statuses.
+
+        The timeout is restarted every time a task finishes, so a rebuild
+        split into many tasks is not aborted as long as it makes progress.
+        """
+        statuses = []
+        start_time = time.time()
 
+        for task_dn in task_dns:
             while True:
                 try:
-                    task = ldap.get_entry(task_dn)
+                    task = ldap.get_entry(
+                        task_dn, ['nstaskexitcode', 'nstaskstatus'])
                 except errors.NotFound:
+                    status = None
                     break
 
                 if 'nstaskexitcode' in task:
+                    status = task.single_value.get('nstaskstatus')
                     if str(task.single_value['nstaskexitcode']) == '0':
-                        summary=task.single_value['nstaskstatus']
                         break
                     else:
                         raise errors.DatabaseError(
-                            desc=task.single_value['nstaskstatus'],
+                            desc=status,
                             info=_("Task DN = '%s'" % task_dn))
                 time.sleep(1)
                 if time.time() > (start_time + 60):
-                   raise errors.TaskTimeout(task=_('Automember'), task_dn=task_dn)
+                    raise errors.TaskTimeout(task=_('Automember'), task_dn=task_dn)
+
+            statuses.append(status)
+            start_time = time.time()
+            if len(task_dns) > 1:
+                self.log.info(
+                    "Automember rebuild: %d of %d tasks completed",
+                    len(statuses), len(task_dns))
+
+        return statuses
+
+    def execute(self, *keys, **options):
+        ldap = self.api.Backend.ldap2
+
+        gtype = options.get('type')
+        if not gtype:
+            gtype = 'group' if options.get('users') else 'hostgroup'
+
+        types = {
+            'group': (
+                'user',
+                'users',
+                DN(api.env.container_user, api.env.basedn)
+            ),
+            'hostgroup': (
+                'host',
+                'hosts',
+                DN(api.env.container_host, api.env.basedn)
+            ),
+        }
+
+        obj_name, opt_name, basedn = types[gtype]
+        obj = self.api.Object[obj_name]
+        definition_dn = DN(('cn', gtype), api.env.container_automember,
+                           api.env.basedn)
+
+        modified_since = None
+        if options.get('incremental'):
+            modified_since = self._get_last_rebuild(ldap, definition_dn)
+        start = time.strftime(LAST_REBUILD_FORMAT, time.gmtime())
+
+        names = options.get(opt_name)
+        if names:
+            names = list(names)
+            self._check_names(ldap, obj, basedn, names)
+            search_filters = [
+                ldap.make_filter_from_attr(
+                    obj.primary_key.name,
+                    names[i:i + REBUILD_TASK_SIZE],
+                    rules=ldap.MATCH_ANY
+                )
+                for i in xrange(0, len(names), REBUILD_TASK_SIZE)
+            ]
+        else:
+            search_filters = ['(%s=*)' % obj.primary_key.name]
+
+        if modified_since:
+            # The timestamp was validated by _get_last_rebuild
+            search_filters = [
+                ldap.combine_filters(
+                    [search_filter, '(modifytimestamp>=%s)' % modified_since],
+                    rules=ldap.MATCH_ALL)
+                for search_filter in search_filters
+            ]
+
+        task_dns = [self._add_task(ldap, basedn, search_filter)
+                    for search_filter in search_filters]
+
+        if len(task_dns) == 1:
+            summary = _('Automember rebuild membership task started')
+            result = {'dn': task_dns[0]}
+        else:
+            summary = _('Automember rebuild membership tasks started')
+            result = {'dn': task_dns}
+
+        if not options.get('no_wait'):
+            statuses = self._wait_for_tasks(ldap, task_dns)
+            summary = _('Automember rebuild membership task completed')
+            result = {}
+            if len(task_dns) == 1:
+                if statuses[0] is not None:
+                    summary = statuses[0]
+            else:
+                result['nstaskstatus'] = [s for s in statuses if s is not None]
+
+            # Only a rebuild which covered all entries of the grouping type
+            # can serve as the starting point of the next incremental one
+            if not names:
+                self._set_last_rebuild(ldap, definition_dn, start)
+
+        if modified_since:
+            result['modified_since'] = unicode(modified_since)
 
         return dict(
             result=result,
@@ -38,6 +38,9 @@ from ipapython.version import API_VERSION
 
 DNA_MAGIC = -1
 
+# Number of entries looked up by one search when processing search results
+BULK_SEARCH_SIZE = 100
+
 global_output_params = (
     Flag('has_password',
         label=_('Password'),
@@ -743,6 +746,44 @@ class LDAPObject(Object):
             except errors.NotFound:
                 entry_attrs[attr] = False
 
+    def get_entries_password_attributes(self, ldap, entries):
+        """
+        Determine if the entries have a password or keytab set, like
+        get_password_attributes does for a single entry.
+
+        Instead of searching on each entry, the entries of each container
+        which have a given password type set are found by searches of up
+        to BULK_SEARCH_SIZE entries each.
+        """
+        containers = {}
+        for entry_attrs in entries:
+            for (pwattr, attr) in self.password_attributes:
+                entry_attrs[attr] = False
+            containers.setdefault(entry_attrs.dn[1:], []).append(entry_attrs)
+
+        for container_dn, container_entries in containers.iteritems():
+            for i in xrange(0, len(container_entries), BULK_SEARCH_SIZE):
+                chunk = dict(
+                    (entry_attrs.dn, entry_attrs) for entry_attrs in
+                    container_entries[i:i + BULK_SEARCH_SIZE])
+                rdn_filter = ldap.combine_filters(
+                    [ldap.make_filter_from_attr(dn[0].attr, dn[0].value)
+                     for dn in chunk],
+                    rules=ldap.MATCH_ANY)
+                for (pwattr, attr) in self.password_attributes:
+                    search_filter = ldap.combine_filters(
+                        ['(%s=*)' % pwattr, rdn_filter], rules=ldap.MATCH_ALL)
+                    try:
+                        (found, truncated) = ldap.find_entries(
+                            search_filter, [''], container_dn,
+                            ldap.SCOPE_ONELEVEL, size_limit=0
+                        )
+                    except errors.NotFound:
+                        continue
+                    for entry in found:
+                        if entry.dn in chunk:
+                            chunk[entry.dn][attr] = True
+
     def handle_not_found(self, *keys):
         pkey = ''
         if self.primary_key:
@@ -1367,6 +1408,31 @@ class LDAPRetrieve(LDAPQuery):
     )
 
     def execute(self, *keys, **options):
+        entry_attrs = self._get_entry(*keys, **options)
+
+        dn = entry_attrs.dn
+        entry_attrs = entry_to_dict(entry_attrs, **options)
+        entry_attrs['dn'] = dn
+
+        if self.obj.primary_key:
+            pkey = keys[-1]
+        else:
+            pkey = None
+
+        return dict(result=entry_attrs, value=pkey_to_value(pkey, options))
+
+    def internal_entry(self, *keys, **options):
+        """
+        Retrieve the entry for another command running on the server.
+
+        Unlike `execute`, the `LDAPEntry` is returned as is, without
+        conversion to a dict. Commands which override `execute` do not
+        support this.
+        """
+        (keys, options) = self._prepare_internal(keys, options)
+        return self._get_entry(*keys, **options)
+
+    def _get_entry(self, *keys, **options):
         ldap = self.obj.backend
 
         dn = self.obj.get_dn(*keys, **options)
@@ -1403,16 +1469,7 @@ class LDAPRetrieve(LDAPQuery):
 
         self.obj.convert_attribute_members(entry_attrs, *keys, **options)
 
-        dn = entry_attrs.dn
-        entry_attrs = entry_to_dict(entry_attrs, **options)
-        entry_attrs['dn'] = dn
-
-        if self.obj.primary_key:
-            pkey = keys[-1]
-        else:
-            pkey = None
-
-        return dict(result=entry_attrs, value=pkey_to_value(pkey, options))
+        return entry_attrs
 
     def pre_callback(self, ldap, dn, attrs_list, *keys, **options):
         assert isinstance(dn, DN)
@@ -2023,6 +2080,30 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
     has_output_params = global_output_params
 
     def execute(self, *args, **options):
+        (entries, truncated) = self._get_entries(*args, **options)
+
+        for (i, e) in enumerate(entries):
+            entries[i] = entry_to_dict(e, **options)
+            entries[i]['dn'] = e.dn
+
+        return dict(
+            result=entries,
+            count=len(entries),
+            truncated=truncated,
+        )
+
+    def internal_entries(self, *args, **options):
+        """
+        Search for entries for another command running on the server.
+
+        Unlike `execute`, a tuple of the list of `LDAPEntry` objects and the
+        truncated flag is returned, without conversion to dicts. Commands
+        which override `execute` do not support this.
+        """
+        (args, options) = self._prepare_internal(args, options)
+        return self._get_entries(*args, **options)
+
+    def _get_entries(self, *args, **options):
         ldap = self.obj.backend
 
         term = args[-1]
@@ -2108,15 +2189,7 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
                 self.obj.get_indirect_members(e, attrs_list)
                 self.obj.convert_attribute_members(e, *args, **options)
 
-        for (i, e) in enumerate(entries):
-            entries[i] = entry_to_dict(e, **options)
-            entries[i]['dn'] = e.dn
-
-        return dict(
-            result=entries,
-            count=len(entries),
-            truncated=truncated,
-        )
+        return (entries, truncated)
 
     def pre_callback(self, ldap, filters, attrs_list, base_dn, scope, *args, **options):
         assert isinstance(base_dn, DN)
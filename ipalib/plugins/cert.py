@@ -19,29 +19,37 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import errno
+import json
 import os
+import threading
 import time
-from ipalib import Command, Str, Int, Bytes, Flag, File
+import Queue
+from ipalib import Command, Str, Int, Bytes, Flag, File, Any
 from ipalib import api
 from ipalib import errors
 from ipalib import pkcs10
 from ipalib import x509
 from ipalib import util
 from ipalib import ngettext
+from ipalib.constants import LDAP_GENERALIZED_TIME_FORMAT
 from ipalib.plugable import Registry
 from ipalib.plugins.virtual import *
-from ipalib.plugins.baseldap import pkey_to_value
-from ipalib.plugins.service import split_any_principal
+from ipalib.plugins.baseldap import pkey_to_value, BULK_SEARCH_SIZE
+from ipalib.plugins.service import split_any_principal, service_mod
+from ipalib.plugins.host import host_mod
 from ipalib.plugins.certprofile import validate_profile_id
 import base64
 import traceback
 from ipalib.text import _
-from ipalib.request import context
+from ipalib.request import context, get_durations, record_duration
 from ipalib import output
 from ipalib.plugins.service import validate_principal
 import nss.nss as nss
 from nss.error import NSPRError
 from pyasn1.error import PyAsn1Error
+from ipaplatform.paths import paths
 
 __doc__ = _("""
 IPA certificate operations
@@ -100,6 +108,13 @@ EXAMPLES:
  Search for certificates based on issuance date
    ipa cert-find --issuedon-from=2013-02-01 --issuedon-to=2013-02-07
 
+ List all certificates 1000 at a time, until the result is not truncated:
+   ipa cert-find --sizelimit=1000 --offset=0
+   ipa cert-find --sizelimit=1000 --offset=1000
+
+ Search for certificates of hosts and services which expire in November 2015:
+   ipa cert-expiry-find --validnotafter-from=2015-11-01 --validnotafter-to=2015-11-30
+
 IPA currently immediately issues (or declines) all certificate requests so
 the status of a request is not normally useful. This is for future use
 or the case where a CA does not immediately issue a certificate.
@@ -149,11 +164,26 @@ def validate_csr(ugettext, csr):
         if csr and os.path.exists(csr):
             return
     try:
-        request = pkcs10.load_certificate_request(csr)
+        request = pkcs10.CertificationRequest(csr)
     except TypeError, e:
         raise errors.Base64DecodeError(reason=str(e))
     except Exception, e:
         raise errors.CertificateOperationError(error=_('Failure decoding Certificate Signing Request: %s') % e)
+    # Keep the decoded request for the command which is being validated
+    context.certification_request = (csr, request)
+
+def get_certification_request(csr):
+    """
+    Return the decoded CSR, reusing the one decoded by validate_csr().
+    """
+    cached = getattr(context, 'certification_request', None)
+    if cached is not None and cached[0] == csr:
+        return cached[1]
+    try:
+        return pkcs10.CertificationRequest(csr)
+    except (NSPRError, PyAsn1Error), e:
+        raise errors.CertificateOperationError(
+            error=_("Failure decoding Certificate Signing Request: %s") % e)
 
 def normalize_csr(csr):
     """
@@ -219,6 +249,216 @@ def ca_enabled_check():
     if not api.Command.ca_is_enabled()['result']:
         raise errors.NotFound(reason=_('CA is not configured'))
 
+def get_principal_type(service):
+    """
+    Return the type of a principal given the service part of its name.
+    """
+    if service is None:
+        return USER
+    elif service == 'host':
+        return HOST
+    else:
+        return SERVICE
+
+# Maximum number of concurrent requests to the CA made by batch commands
+CA_REQUEST_WORKERS = 4
+
+def run_ca_requests(func, items):
+    """
+    Call ``func`` for each of ``items`` in at most CA_REQUEST_WORKERS
+    threads.
+
+    Return a list of (result, exception) tuples in the order of ``items``.
+    The threads have no LDAP connection, ``func`` must only talk to the CA
+    and must not select the CA host, pass the host selected beforehand.
+
+    The durations recorded by the threads, e.g. the CA time, are added to
+    the current request.
+    """
+    results = [None] * len(items)
+    durations = []
+    queue = Queue.Queue()
+    for i, item in enumerate(items):
+        queue.put((i, item))
+
+    def worker():
+        try:
+            while True:
+                try:
+                    i, item = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                try:
+                    results[i] = (func(item), None)
+                except Exception, e:
+                    results[i] = (None, e)
+        finally:
+            durations.append(get_durations())
+
+    threads = [threading.Thread(target=worker)
+               for i in xrange(min(CA_REQUEST_WORKERS, len(items)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for thread_durations in durations:
+        for name, duration in thread_durations.iteritems():
+            record_duration(name, duration)
+    return results
+
+def batch_error(command, e):
+    """
+    Return the result of a failed item of a batch command, in the format
+    used by the batch command.
+    """
+    if isinstance(e, errors.PublicError):
+        reported_error = e
+    else:
+        command.error('%s: %s: %s', command.name, e.__class__.__name__, e)
+        reported_error = errors.InternalError()
+    return dict(
+        error=reported_error.strerror,
+        error_code=reported_error.errno,
+        error_name=unicode(type(reported_error).__name__),
+    )
+
+
+class PrincipalLookup(object):
+    """
+    Look up the principals of certificate requests and check whether the
+    bound principal may write their certificates.
+    """
+
+    show_commands = {
+        USER: 'user_show',
+        HOST: 'host_show',
+        SERVICE: 'service_show',
+    }
+
+    def __init__(self, command):
+        self.command = command
+
+    def check_access(self, operation=None):
+        self.command.check_access(operation)
+
+    def get_entry(self, principal_type, name):
+        show = self.command.api.Command[self.show_commands[principal_type]]
+        return show.internal_entry(name, all=True)
+
+    def can_write(self, dn):
+        ldap = self.command.api.Backend.ldap2
+        return ldap.can_write(dn, 'usercertificate')
+
+
+class BulkPrincipalLookup(PrincipalLookup):
+    """
+    Look up the principals of many certificate requests at once.
+
+    prefetch() retrieves the principal entries together with the rights to
+    write their certificates with one LDAP search per principal type and
+    BULK_SEARCH_SIZE principals. Principals which were not prefetched are
+    looked up one by one. The results of access checks are remembered.
+    """
+
+    objects = {
+        USER: 'user',
+        HOST: 'host',
+        SERVICE: 'service',
+    }
+
+    def __init__(self, command):
+        super(BulkPrincipalLookup, self).__init__(command)
+        self.__access = {}
+        self.__entries = {}
+        self.__writable = {}
+
+    def prefetch(self, requests):
+        """
+        :param requests: list of (decoded CSR, principal name) tuples
+        """
+        names = dict((principal_type, set()) for principal_type in self.objects)
+        for request, principal_string in requests:
+            try:
+                service, name, realm = split_any_principal(principal_string)
+            except errors.PublicError:
+                continue
+            principal_type = get_principal_type(service)
+            if principal_type == SERVICE:
+                names[SERVICE].add(principal_string)
+            else:
+                names[principal_type].add(name)
+            for name_type, name in request.subjectaltname or ():
+                if name_type != pkcs10.SAN_DNSNAME:
+                    continue
+                name = unicode(name)
+                if principal_type == HOST:
+                    names[HOST].add(name)
+                elif principal_type == SERVICE:
+                    names[SERVICE].add('%s/%s@%s' % (service, name, realm))
+
+        for principal_type, principal_names in names.iteritems():
+            if principal_names:
+                self.__prefetch(principal_type, principal_names)
+
+    def __prefetch(self, principal_type, names):
+        api = self.command.api
+        ldap = api.Backend.ldap2
+        obj = api.Object[self.objects[principal_type]]
+        pkey = obj.primary_key
+        base_dn = DN(obj.container_dn, api.env.basedn)
+
+        # Principals are looked up by the normalized primary key
+        by_pkey = {}
+        for name in names:
+            try:
+                by_pkey.setdefault(pkey.normalize(name), []).append(name)
+            except errors.PublicError:
+                pass
+
+        pkeys = sorted(by_pkey)
+        for i in xrange(0, len(pkeys), BULK_SEARCH_SIZE):
+            filter = ldap.make_filter_from_attr(
+                pkey.name, pkeys[i:i + BULK_SEARCH_SIZE], rules=ldap.MATCH_ANY)
+            try:
+                entries = ldap.find_effective_rights(
+                    filter, ['*', 'usercertificate'], base_dn)
+            except errors.NotFound:
+                continue
+            for entry in entries:
+                for value in entry.get(pkey.name, []):
+                    for name in by_pkey.get(value, []):
+                        self.__entries[principal_type, name] = entry
+                rights = entry.get('attributelevelrights', [''])[0]
+                for attr_rights in rights.split(','):
+                    attr, sep, attr_rights = attr_rights.strip().partition(':')
+                    if attr.lower() == 'usercertificate':
+                        self.__writable[entry.dn] = 'w' in attr_rights
+
+    def check_access(self, operation=None):
+        if operation not in self.__access:
+            try:
+                super(BulkPrincipalLookup, self).check_access(operation)
+            except errors.ACIError, e:
+                self.__access[operation] = e
+            else:
+                self.__access[operation] = None
+        if self.__access[operation] is not None:
+            raise self.__access[operation]
+
+    def get_entry(self, principal_type, name):
+        try:
+            return self.__entries[principal_type, name]
+        except KeyError:
+            return super(BulkPrincipalLookup, self).get_entry(
+                principal_type, name)
+
+    def can_write(self, dn):
+        try:
+            return self.__writable[dn]
+        except KeyError:
+            return super(BulkPrincipalLookup, self).can_write(dn)
+
 @register()
 class cert_request(VirtualCommand):
     __doc__ = _('Submit a certificate signing request.')
@@ -300,12 +540,39 @@ class cert_request(VirtualCommand):
     def execute(self, csr, **kw):
         ca_enabled_check()
 
-        ldap = self.api.Backend.ldap2
         add = kw.get('add')
         request_type = kw.get('request_type')
         profile_id = kw.get('profile_id', self.Backend.ra.DEFAULT_PROFILE)
+        principal_string = kw.get('principal')
+
+        request = get_certification_request(csr)
+        principal_type, principal_name = self._check_request(
+            request, principal_string, add, PrincipalLookup(self))
+
+        # Request the certificate
+        result = self.Backend.ra.request_certificate(
+            csr, profile_id, request_type=request_type)
+        self._add_certificate_attrs(result)
+
+        # Success? Then add it to the principal's entry
+        # (unless the profile tells us not to)
+        if self._store_issued(profile_id) and 'certificate' in result:
+            self._store_certificates(
+                principal_type, principal_string, principal_name,
+                [str(result.get('certificate'))])
+
+        return dict(
+            result=result
+        )
 
+    def _check_request(self, request, principal_string, add, lookup):
         """
+        Check that the bound principal may request a certificate for
+        ``principal_string`` with the decoded CSR ``request``.
+
+        The principal entries are retrieved using ``lookup``, see
+        `PrincipalLookup`. Return the type and the name of the principal.
+
         Access control is partially handled by the ACI titled
         'Hosts can modify service userCertificate'. This is for the case
         where a machine binds using a host/ prinicpal. It can only do the
@@ -315,45 +582,27 @@ class cert_request(VirtualCommand):
         Binding with a user principal one needs to be in the request_certs
         taskgroup (directly or indirectly via role membership).
         """
-
-        principal_string = kw.get('principal')
         principal = split_any_principal(principal_string)
         servicename, principal_name, realm = principal
-        if servicename is None:
-            principal_type = USER
-        elif servicename == 'host':
-            principal_type = HOST
-        else:
-            principal_type = SERVICE
+        principal_type = get_principal_type(servicename)
 
         bind_principal = split_any_principal(getattr(context, 'principal'))
-        bind_service, bind_name, bind_realm = bind_principal
-
-        if bind_service is None:
-            bind_principal_type = USER
-        elif bind_service == 'host':
-            bind_principal_type = HOST
-        else:
-            bind_principal_type = SERVICE
+        bind_principal_type = get_principal_type(bind_principal[0])
 
         if bind_principal != principal and bind_principal_type != HOST:
             # Can the bound principal request certs for another principal?
-            self.check_access()
+            lookup.check_access()
 
-        try:
-            subject = pkcs10.get_subject(csr)
-            extensions = pkcs10.get_extensions(csr)
-            subjectaltname = pkcs10.get_subjectaltname(csr) or ()
-        except (NSPRError, PyAsn1Error), e:
-            raise errors.CertificateOperationError(
-                error=_("Failure decoding Certificate Signing Request: %s") % e)
+        subject = request.subject
+        extensions = request.extensions
+        subjectaltname = request.subjectaltname or ()
 
         # host principals may bypass allowed ext check
         if bind_principal_type != HOST:
             for ext in extensions:
                 operation = self._allowed_extensions.get(ext)
                 if operation:
-                    self.check_access(operation)
+                    lookup.check_access(operation)
 
         dn = None
         principal_obj = None
@@ -361,19 +610,18 @@ class cert_request(VirtualCommand):
         # going to add it
         try:
             if principal_type == SERVICE:
-                principal_obj = api.Command['service_show'](principal_string, all=True)
-            elif principal_type == HOST:
-                principal_obj = api.Command['host_show'](principal_name, all=True)
-            elif principal_type == USER:
-                principal_obj = api.Command['user_show'](principal_name, all=True)
+                principal_obj = lookup.get_entry(SERVICE, principal_string)
+            else:
+                principal_obj = lookup.get_entry(principal_type, principal_name)
+            dn = principal_obj.dn
         except errors.NotFound as e:
             if principal_type == SERVICE and add:
-                principal_obj = api.Command['service_add'](principal_string, force=True)
+                principal_obj = api.Command['service_add'].internal(
+                    principal_string, force=True)['result']
+                dn = principal_obj['dn']
             else:
                 raise errors.NotFound(
                     reason=_("The principal for this request doesn't exist."))
-        principal_obj = principal_obj['result']
-        dn = principal_obj['dn']
 
         # Ensure that the DN in the CSR matches the principal
         cn = subject.common_name  #pylint: disable=E1101
@@ -413,22 +661,32 @@ class cert_request(VirtualCommand):
                     name='csr', error=_("extension %s is forbidden") % ext)
 
         # We got this far so the principal entry exists, can we write it?
-        if not ldap.can_write(dn, "usercertificate"):
+        if not lookup.can_write(dn):
             raise errors.ACIError(info=_("Insufficient 'write' privilege "
                 "to the 'userCertificate' attribute of entry '%s'.") % dn)
 
         # Validate the subject alt name, if any
+        for name in request.principal_names:
+            if name != principal_string:
+                raise errors.ACIError(
+                    info=_("Principal '%s' in subject alt name does not "
+                           "match requested principal") % name)
+
         for name_type, name in subjectaltname:
-            if name_type == pkcs10.SAN_DNSNAME:
+            if name_type in (pkcs10.SAN_OTHERNAME_KRB5PRINCIPALNAME,
+                             pkcs10.SAN_OTHERNAME_UPN):
+                # Checked in principal_names above
+                continue
+            elif name_type == pkcs10.SAN_DNSNAME:
                 name = unicode(name)
                 alt_principal_obj = None
                 try:
                     if principal_type == HOST:
-                        alt_principal_obj = api.Command['host_show'](name, all=True)
+                        alt_principal_obj = lookup.get_entry(HOST, name)
                     elif principal_type == SERVICE:
                         altprincipal = '%s/%s@%s' % (servicename, name, realm)
-                        alt_principal_obj = api.Command['service_show'](
-                            altprincipal, all=True)
+                        alt_principal_obj = lookup.get_entry(
+                            SERVICE, altprincipal)
                     elif principal_type == USER:
                         raise errors.ValidationError(
                             name='csr',
@@ -443,17 +701,11 @@ class cert_request(VirtualCommand):
                         'subject alt name %s in certificate request does not '
                         'exist') % name)
                 if alt_principal_obj is not None:
-                    altdn = alt_principal_obj['result']['dn']
-                    if not ldap.can_write(altdn, "usercertificate"):
+                    altdn = alt_principal_obj.dn
+                    if not lookup.can_write(altdn):
                         raise errors.ACIError(info=_(
                             "Insufficient privilege to create a certificate "
                             "with subject alt name '%s'.") % name)
-            elif name_type in (pkcs10.SAN_OTHERNAME_KRB5PRINCIPALNAME,
-                               pkcs10.SAN_OTHERNAME_UPN):
-                if name != principal_string:
-                    raise errors.ACIError(
-                        info=_("Principal '%s' in subject alt name does not "
-                               "match requested principal") % name)
             elif name_type == pkcs10.SAN_RFC822NAME:
                 if principal_type == USER:
                     if name not in principal_obj.get('mail', []):
@@ -474,9 +726,12 @@ class cert_request(VirtualCommand):
                     info=_("Subject alt name type %s is forbidden") %
                          name_type)
 
-        # Request the certificate
-        result = self.Backend.ra.request_certificate(
-            csr, profile_id, request_type=request_type)
+        return principal_type, principal_name
+
+    def _add_certificate_attrs(self, result):
+        """
+        Add the attributes of the issued certificate to ``result``.
+        """
         cert = x509.load_certificate(result['certificate'])
         result['issuer'] = unicode(cert.issuer)
         result['valid_not_before'] = unicode(cert.valid_not_before_str)
@@ -484,23 +739,146 @@ class cert_request(VirtualCommand):
         result['md5_fingerprint'] = unicode(nss.data_to_hex(nss.md5_digest(cert.der_data), 64)[0])
         result['sha1_fingerprint'] = unicode(nss.data_to_hex(nss.sha1_digest(cert.der_data), 64)[0])
 
-        # Success? Then add it to the principal's entry
-        # (unless the profile tells us not to)
-        profile = api.Command['certprofile_show'](profile_id)
-        store = profile['result']['ipacertprofilestoreissued'][0] == 'TRUE'
-        if store and 'certificate' in result:
-            cert = str(result.get('certificate'))
-            kwargs = dict(addattr=u'usercertificate={}'.format(cert))
-            if principal_type == SERVICE:
-                api.Command['service_mod'](principal_string, **kwargs)
-            elif principal_type == HOST:
-                api.Command['host_mod'](principal_name, **kwargs)
-            elif principal_type == USER:
-                api.Command['user_mod'](principal_name, **kwargs)
+    def _store_issued(self, profile_id):
+        """
+        Return True if certificates issued using the profile should be
+        added to the principal's entry.
+        """
+        profile = api.Command['certprofile_show'].internal(profile_id)
+        return profile['result']['ipacertprofilestoreissued'][0] == 'TRUE'
 
-        return dict(
-            result=result
+    def _store_certificates(self, principal_type, principal_string,
+                            principal_name, certs):
+        """
+        Add the certificates to the principal's entry in a single modify.
+        """
+        kwargs = dict(
+            addattr=[u'usercertificate={}'.format(cert) for cert in certs])
+        if principal_type == SERVICE:
+            api.Command['service_mod'].internal(principal_string, **kwargs)
+        elif principal_type == HOST:
+            api.Command['host_mod'].internal(principal_name, **kwargs)
+        elif principal_type == USER:
+            api.Command['user_mod'].internal(principal_name, **kwargs)
+
+
+@register()
+class cert_request_batch(VirtualCommand):
+    __doc__ = _('Submit many certificate signing requests.')
+
+    NO_CLI = True
+
+    takes_args = (
+        Any('requests+',
+            doc=_('Certificate signing requests, each a dictionary with '
+                  '"csr" and "principal" keys'),
+        ),
+    )
+    operation = "request certificate"
+
+    takes_options = (
+        Str('request_type',
+            default=u'pkcs10',
+            autofill=True,
+        ),
+        Flag('add',
+            doc=_("automatically add the principals if they don't exist"),
+            default=False,
+            autofill=True
+        ),
+        Str('profile_id?', validate_profile_id,
+            label=_("Profile ID"),
+            doc=_("Certificate Profile to use"),
         )
+    )
+
+    has_output = (
+        output.Output('count', int, doc=_('Number of requests')),
+        output.Output('results', (list, tuple),
+            doc=_('Result or error of each request'),
+        ),
+    )
+
+    def execute(self, requests, **kw):
+        ca_enabled_check()
+
+        cert_request = self.api.Command.cert_request
+        add = kw.get('add')
+        request_type = kw.get('request_type')
+        profile_id = kw.get('profile_id', self.Backend.ra.DEFAULT_PROFILE)
+        results = [None] * len(requests)
+
+        # Decode the CSRs
+        decoded = []
+        for i, item in enumerate(requests):
+            try:
+                if not isinstance(item, dict):
+                    raise errors.ValidationError(
+                        name='requests', error=_('must be a dictionary'))
+                for key in ('csr', 'principal'):
+                    if not item.get(key):
+                        raise errors.RequirementError(name=key)
+                csr = normalize_csr(item['csr'])
+                principal_string = unicode(item['principal'])
+                request = get_certification_request(csr)
+            except Exception, e:
+                results[i] = batch_error(self, e)
+            else:
+                decoded.append((i, csr, request, principal_string))
+
+        # Check the requests, looking up all the principals at once
+        lookup = BulkPrincipalLookup(self)
+        lookup.prefetch([(request, principal_string)
+                         for (i, csr, request, principal_string) in decoded])
+        checked = []
+        for i, csr, request, principal_string in decoded:
+            try:
+                principal_type, principal_name = cert_request._check_request(
+                    request, principal_string, add, lookup)
+            except Exception, e:
+                results[i] = batch_error(self, e)
+            else:
+                checked.append(
+                    (i, csr, principal_type, principal_string, principal_name))
+
+        # Request the certificates. Select the CA host first, the threads
+        # which send the requests can't look it up.
+        ra = self.Backend.ra
+        ca_host = ra.ca_host
+        issued = run_ca_requests(
+            lambda csr: ra.request_certificate(
+                csr, profile_id, request_type=request_type, ca_host=ca_host),
+            [item[1] for item in checked])
+
+        store = None
+        certs = {}
+        for item, (result, e) in zip(checked, issued):
+            i, csr, principal_type, principal_string, principal_name = item
+            if e is not None:
+                results[i] = batch_error(self, e)
+                continue
+            cert_request._add_certificate_attrs(result)
+            results[i] = dict(result=result, error=None)
+
+            if store is None:
+                store = cert_request._store_issued(profile_id)
+            if store and 'certificate' in result:
+                principal = (principal_type, principal_string, principal_name)
+                certs.setdefault(principal, []).append(i)
+
+        # Add the certificates to the principal entries, one modify for all
+        # the certificates of a principal
+        for principal, indexes in certs.iteritems():
+            try:
+                cert_request._store_certificates(
+                    *principal,
+                    certs=[str(results[i]['result']['certificate'])
+                           for i in indexes])
+            except Exception, e:
+                for i in indexes:
+                    results[i].update(batch_error(self, e))
+
+        return dict(count=len(results), results=results)
 
 
 
@@ -675,6 +1053,111 @@ class cert_revoke(VirtualCommand):
 
 
 
+@register()
+class cert_revoke_batch(VirtualCommand):
+    __doc__ = _('Revoke many certificates.')
+
+    NO_CLI = True
+
+    takes_args = _serial_number.clone(multivalue=True)
+
+    operation = "revoke certificate"
+
+    takes_options = (
+        Int('revocation_reason',
+            label=_('Reason'),
+            doc=_('Reason for revoking the certificates (0-10)'),
+            minvalue=0,
+            maxvalue=10,
+            default=0,
+            autofill=True
+        ),
+    )
+
+    has_output = (
+        output.Output('count', int, doc=_('Number of certificates')),
+        output.Output('results', (list, tuple),
+            doc=_('Result or error of each revocation'),
+        ),
+    )
+
+    def execute(self, serial_numbers, **kw):
+        ca_enabled_check()
+        revocation_reason = kw['revocation_reason']
+        if revocation_reason == 7:
+            raise errors.CertificateOperationError(error=_('7 is not a valid revocation reason'))
+        results = [None] * len(serial_numbers)
+
+        # Select the CA host first, the threads which send the requests
+        # can't look it up
+        ra = self.Backend.ra
+        ca_host = ra.ca_host
+
+        try:
+            self.check_access()
+        except errors.ACIError, acierr:
+            self.debug("Not granted by ACI to revoke certificates, looking at principal")
+            allowed = self._check_host_certificates(
+                ra, ca_host, serial_numbers, results, acierr)
+        else:
+            allowed = range(len(serial_numbers))
+
+        revoked = run_ca_requests(
+            lambda serial_number: ra.revoke_certificate(
+                serial_number, revocation_reason=revocation_reason,
+                ca_host=ca_host),
+            [serial_numbers[i] for i in allowed])
+
+        for i, (result, e) in zip(allowed, revoked):
+            if e is not None:
+                results[i] = batch_error(self, e)
+            else:
+                results[i] = dict(result=result, error=None)
+
+        return dict(count=len(results), results=results)
+
+    def _check_host_certificates(self, ra, ca_host, serial_numbers, results,
+                                 acierr):
+        """
+        Return the indexes of the certificates in ``serial_numbers`` the
+        bound host principal may revoke, like cert_show() does for a single
+        certificate: the subject of the certificate must match the hostname.
+
+        The certificates are retrieved in parallel, the errors are stored in
+        ``results``.
+        """
+        bind_principal = getattr(context, 'principal')
+        if not bind_principal.startswith('host/'):
+            for i in xrange(len(serial_numbers)):
+                results[i] = batch_error(self, acierr)
+            return []
+        hostname = get_host_from_principal(bind_principal)
+
+        certificates = run_ca_requests(
+            lambda serial_number: ra.get_certificate(
+                serial_number, ca_host=ca_host),
+            serial_numbers)
+
+        allowed = []
+        for i, (result, e) in enumerate(certificates):
+            if isinstance(e, errors.NotImplementedError):
+                allowed.append(i)
+                continue
+            if e is None:
+                try:
+                    cert = x509.load_certificate(result['certificate'])
+                    if hostname != cert.subject.common_name:    #pylint: disable=E1101
+                        e = acierr
+                except Exception, e:
+                    pass
+            if e is not None:
+                results[i] = batch_error(self, e)
+                continue
+            allowed.append(i)
+        return allowed
+
+
+
 @register()
 class cert_remove_hold(VirtualCommand):
     __doc__ = _('Take a revoked certificate off hold.')
@@ -772,6 +1255,13 @@ class cert_find(Command):
             minvalue=0,
             default=100,
         ),
+        Int('offset?',
+            label=_('Offset'),
+            doc=_('Number of matching certs to skip'),
+            flags=['no_display'],
+            minvalue=0,
+            autofill=False,
+        ),
     )
 
     has_output = output.standard_list_of_entries
@@ -793,12 +1283,366 @@ class cert_find(Command):
 
     def execute(self, **options):
         ca_enabled_check()
-        ret = dict(
-            result=self.Backend.ra.find(options)
+
+        # Ask for one more cert to find out whether the result is truncated
+        sizelimit = options.get('sizelimit', 100)
+        if sizelimit:
+            options['sizelimit'] = sizelimit + 1
+        result = self.Backend.ra.find(options)
+        truncated = bool(sizelimit) and len(result) > sizelimit
+        if truncated:
+            del result[sizelimit:]
+
+        return dict(
+            result=result,
+            count=len(result),
+            truncated=truncated,
+        )
+
+
+# Entries which were not listed for this many seconds are dropped from the
+# certificate expiry index
+CERT_EXPIRY_INDEX_MAX_AGE = 86400
+
+
+def _generalized_time(value):
+    """
+    Return ``value``, a datetime or a string, as a GeneralizedTime string.
+    """
+    if isinstance(value, datetime.datetime):
+        return unicode(value.strftime(LDAP_GENERALIZED_TIME_FORMAT))
+    return unicode(value)
+
+
+class CertExpiryIndex(object):
+    """
+    Index of the certificates of hosts and services.
+
+    For every entry with certificates the index keeps its modifyTimestamp
+    and the metadata of its certificates. find() lists the entries with
+    certificates visible to the bound user and decodes only the certificates
+    of entries which were modified since they were indexed. update() indexes
+    an entry right after its certificates were modified.
+
+    The index is stored in ``filename``, shared by all the server processes,
+    and reloaded when another process replaced it. Processes writing it at
+    the same time may drop each other's changes; the entries lost that way
+    are indexed again by the next find().
+    """
+
+    containers = (
+        ('container_host', 'fqdn'),
+        ('container_service', 'krbprincipalname'),
+    )
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__lock = threading.Lock()
+        # DN -> (modifyTimestamp, principal, metadata list, last listed)
+        self.__entries = {}
+        self.__stat = None
+
+    def find(self, ldap, not_after_from=None, not_after_to=None):
+        """
+        Return the metadata of the certificates which expire in the given
+        time window, ordered by the expiration time, and whether the list
+        of the entries with certificates was truncated.
+
+        :param ldap: connection used to list the entries
+        :param not_after_from: datetime or None
+        :param not_after_to: datetime or None, not included in the window
+        """
+        now = time.time()
+        truncated = False
+        listed = {}
+        updated = {}
+        with self.__lock:
+            self.__load()
+        for container, pkey in self.containers:
+            base_dn = DN(getattr(api.env, container), api.env.basedn)
+            try:
+                entries, entries_truncated = ldap.find_entries(
+                    '(usercertificate=*)', ['modifytimestamp'], base_dn,
+                    size_limit=0, paged_search=True)
+            except errors.NotFound:
+                continue
+            truncated = truncated or entries_truncated
+            stale = []
+            with self.__lock:
+                for entry in entries:
+                    dn = unicode(entry.dn)
+                    timestamp = _generalized_time(
+                        entry.single_value.get('modifytimestamp'))
+                    listed[dn] = timestamp
+                    cached = self.__entries.get(dn)
+                    if cached is None or cached[0] != timestamp:
+                        stale.append(entry.dn)
+            if stale:
+                indexed, index_truncated = self.__index(
+                    ldap, base_dn, pkey, stale)
+                updated.update(indexed)
+                truncated = truncated or index_truncated
+
+        if not_after_from is not None:
+            not_after_from = not_after_from.strftime('%Y%m%d%H%M%S')
+        if not_after_to is not None:
+            not_after_to = not_after_to.strftime('%Y%m%d%H%M%S')
+
+        result = []
+        with self.__lock:
+            removed = []
+            for dn, cached in self.__entries.iteritems():
+                if dn in updated:
+                    continue
+                if dn not in listed:
+                    # Entries may be hidden from the bound user by ACIs, so
+                    # only drop them when nobody listed them for a while
+                    if (not truncated and
+                            cached[3] + CERT_EXPIRY_INDEX_MAX_AGE < now):
+                        removed.append(dn)
+                elif cached[3] + CERT_EXPIRY_INDEX_MAX_AGE / 2 < now:
+                    updated[dn] = tuple(cached[:3]) + (now,)
+            if updated or removed:
+                self.__save(updated, removed)
+
+            for dn in listed:
+                cached = self.__entries.get(dn)
+                if cached is None:
+                    continue
+                timestamp, principal, certs = cached[:3]
+                for not_after, metadata in certs:
+                    if not_after_from is not None and not_after < not_after_from:
+                        continue
+                    if not_after_to is not None and not_after >= not_after_to:
+                        continue
+                    result.append((not_after, principal, metadata))
+
+        result.sort(key=lambda r: (r[0], r[1]))
+        return ([dict(metadata, principal=principal)
+                 for (not_after, principal, metadata) in result],
+                truncated)
+
+    def update(self, ldap, dn):
+        """
+        Index the certificates of the host or service entry ``dn``.
+        """
+        for container, pkey in self.containers:
+            base_dn = DN(getattr(api.env, container), api.env.basedn)
+            if dn.endswith(base_dn):
+                break
+        else:
+            return
+        updated, truncated = self.__index(ldap, base_dn, pkey, [dn])
+        with self.__lock:
+            # An entry without certificates is not found
+            self.__save(updated, [] if updated else [unicode(dn)])
+
+    def __index(self, ldap, base_dn, pkey, stale):
+        """
+        Retrieve and decode the certificates of the entries in ``stale``.
+
+        Return the index records of the entries and whether the search for
+        them was truncated.
+        """
+        attrs_list = ['modifytimestamp', 'usercertificate', 'fqdn',
+                      'krbprincipalname']
+        truncated = False
+        if len(stale) > BULK_SEARCH_SIZE:
+            # Many entries changed (or the index is empty), fetch all
+            stale = set(stale)
+            try:
+                entries, truncated = ldap.find_entries(
+                    '(usercertificate=*)', attrs_list, base_dn,
+                    size_limit=0, paged_search=True)
+            except errors.NotFound:
+                entries = []
+            entries = [e for e in entries if e.dn in stale]
+        else:
+            filters = [ldap.make_filter_from_attr(
+                pkey, [dn[0].value for dn in stale], rules=ldap.MATCH_ANY)]
+            filters.append('(usercertificate=*)')
+            try:
+                entries, truncated = ldap.find_entries(
+                    ldap.combine_filters(filters, rules=ldap.MATCH_ALL),
+                    attrs_list, base_dn, size_limit=0)
+            except errors.NotFound:
+                entries = []
+
+        now = time.time()
+        records = {}
+        for entry in entries:
+            principal = entry.get('krbprincipalname') or entry.get('fqdn')
+            certs = []
+            for der in entry.get('usercertificate', []):
+                try:
+                    cert = x509.load_certificate(der, x509.DER)
+                except NSPRError, e:
+                    api.log.debug("Problem decoding certificate of %s: %s",
+                                  entry.dn, e)
+                    continue
+                not_after = datetime.datetime.utcfromtimestamp(
+                    cert.valid_not_after / 1e6)
+                certs.append((unicode(not_after.strftime('%Y%m%d%H%M%S')),
+                              dict(
+                    serial_number=unicode(cert.serial_number),
+                    serial_number_hex=u'0x%X' % cert.serial_number,
+                    subject=unicode(cert.subject),
+                    issuer=unicode(cert.issuer),
+                    valid_not_before=unicode(cert.valid_not_before_str),
+                    valid_not_after=unicode(cert.valid_not_after_str),
+                )))
+            records[unicode(entry.dn)] = (
+                _generalized_time(entry.single_value.get('modifytimestamp')),
+                unicode(principal[0]), certs, now)
+        return records, truncated
+
+    def __load(self):
+        """
+        Reload the index if another process replaced the file.
+        """
+        try:
+            st = os.stat(self.filename)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                api.log.debug("Cannot read certificate expiry index %s: %s",
+                              self.filename, e)
+            return
+        if (st.st_ino, st.st_mtime, st.st_size) == self.__stat:
+            return
+        try:
+            with open(self.filename) as f:
+                st = os.fstat(f.fileno())
+                data = json.load(f)
+            self.__entries = dict(
+                (dn, tuple(record))
+                for dn, record in data['entries'].iteritems())
+        except (IOError, OSError, ValueError, KeyError, TypeError), e:
+            api.log.debug("Cannot read certificate expiry index %s: %s",
+                          self.filename, e)
+            return
+        self.__stat = (st.st_ino, st.st_mtime, st.st_size)
+
+    def __save(self, updated, removed):
+        """
+        Replace the records in ``updated``, drop the DNs in ``removed`` and
+        write the index, keeping the changes written by other processes.
+        """
+        self.__load()
+        self.__entries.update(updated)
+        for dn in removed:
+            self.__entries.pop(dn, None)
+        try:
+            tmpname = '%s.%d' % (self.filename, os.getpid())
+            with open(tmpname, 'w') as f:
+                json.dump(dict(entries=self.__entries), f)
+                f.flush()
+                st = os.fstat(f.fileno())
+            os.rename(tmpname, self.filename)
+        except (IOError, OSError), e:
+            api.log.debug("Cannot write certificate expiry index %s: %s",
+                          self.filename, e)
+            return
+        self.__stat = (st.st_ino, st.st_mtime, st.st_size)
+
+
+cert_expiry_index = CertExpiryIndex(paths.IPA_CERT_EXPIRY_INDEX)
+
+
+def _index_certificates(self, ldap, dn, entry_attrs, *keys, **options):
+    """
+    Post callback of host-mod and service-mod which updates the certificate
+    expiry index when the certificates of the entry were modified.
+    """
+    attrs = [value.split('=', 1)[0].strip().lower()
+             for option in ('setattr', 'addattr', 'delattr')
+             for value in options.get(option) or ()]
+    if 'usercertificate' in options or 'usercertificate' in attrs:
+        try:
+            cert_expiry_index.update(ldap, dn)
+        except errors.ExecutionError, e:
+            self.log.debug("Cannot index the certificates of %s: %s", dn, e)
+    return dn
+
+
+host_mod.register_post_callback(_index_certificates)
+service_mod.register_post_callback(_index_certificates)
+
+
+@register()
+class cert_expiry_find(Command):
+    __doc__ = _('Search for certificates of hosts and services by expiration date.')
+
+    takes_options = (
+        Str('validnotafter_from?', validate_pkidate,
+            doc=_('Valid not after from this date (YYYY-mm-dd)'),
+            autofill=False,
+        ),
+        Str('validnotafter_to?', validate_pkidate,
+            doc=_('Valid not after to this date (YYYY-mm-dd)'),
+            autofill=False,
+        ),
+        Int('sizelimit?',
+            label=_('Size Limit'),
+            doc=_('Maximum number of certs returned (0 is unlimited)'),
+            flags=['no_display'],
+            minvalue=0,
+            default=100,
+        ),
+    )
+
+    has_output = output.standard_list_of_entries
+    has_output_params = (
+        Str('principal',
+            label=_('Principal'),
+        ),
+        Str('serial_number',
+            label=_('Serial number'),
+        ),
+        Str('serial_number_hex',
+            label=_('Serial number (hex)'),
+        ),
+        Str('subject',
+            label=_('Subject'),
+        ),
+        Str('issuer',
+            label=_('Issuer'),
+        ),
+        Str('valid_not_before',
+            label=_('Not Before'),
+        ),
+        Str('valid_not_after',
+            label=_('Not After'),
+        ),
+    )
+
+    msg_summary = ngettext(
+        '%(count)d certificate matched', '%(count)d certificates matched', 0
+    )
+
+    def execute(self, **options):
+        not_after_from = options.get('validnotafter_from')
+        if not_after_from is not None:
+            not_after_from = datetime.datetime.strptime(
+                not_after_from, '%Y-%m-%d')
+        not_after_to = options.get('validnotafter_to')
+        if not_after_to is not None:
+            # Include the whole day
+            not_after_to = datetime.datetime.strptime(
+                not_after_to, '%Y-%m-%d') + datetime.timedelta(1)
+
+        result, truncated = cert_expiry_index.find(
+            self.api.Backend.ldap2, not_after_from, not_after_to)
+
+        sizelimit = options.get('sizelimit', 100)
+        if sizelimit and len(result) > sizelimit:
+            del result[sizelimit:]
+            truncated = True
+
+        return dict(
+            result=result,
+            count=len(result),
+            truncated=truncated,
         )
-        ret['count'] = len(ret['result'])
-        ret['truncated'] = False
-        return ret
 
 
 @register()
@@ -24,6 +24,8 @@ from ipalib.cli import to_cli
 from ipalib import _, ngettext
 from ipapython.dn import DN
 from ipalib.plugable import Registry
+from ipalib.request import context
+from ipalib.plugins.baseldap import BULK_SEARCH_SIZE
 if api.env.in_server and api.env.context in ['lite', 'server']:
     try:
         import ipaserver.dcerpc
@@ -204,10 +206,37 @@ EXAMPLES:
     --------------------
       Matched rules: allow_all
       Not matched rules: can_login
+
+
+BULK TESTING
+
+hbactest-bulk tests every combination of the given users, hosts and services
+in one call. The group memberships of all the users, hosts and services are
+looked up with a few LDAP searches instead of one command per entry, which
+makes it suitable for auditing the access of many users to many hosts. It
+accepts the same --rules, --enabled, --disabled, --nodetail and --sizelimit
+options as hbactest.
+
+EXAMPLES:
+
+    1. Test which of two users can log in to two hosts with sshd:
+
+    $ ipa hbactest-bulk --user=a1a,b2b --host=foo,bar --service=sshd
+    ---------------------------------
+    2 of 4 access checks were granted
+    ---------------------------------
+      a1a -> foo.example.com (sshd): granted (allow_all)
+      a1a -> bar.example.com (sshd): granted (allow_all)
+      b2b -> foo.example.com (sshd): denied
+      b2b -> bar.example.com (sshd): denied
 """)
 
 register = Registry()
 
+# Converted HBAC rules by bind principal and size limit, see get_hbac_rules
+MAX_CACHED_RULESETS = 64
+_rule_cache = {}
+
 def convert_to_ipa_rule(rule):
     # convert a dict with a rule to an pyhbac rule
     ipa_rule = pyhbac.HbacRule(rule['cn'][0])
@@ -240,6 +269,65 @@ def convert_to_ipa_rule(rule):
     return ipa_rule
 
 
+def get_rules_stamp(api, sizelimit=None):
+    """
+    Return the DNs and entryUSNs of the HBAC rules which hbacrule_find
+    would return, or None if they cannot be determined.
+
+    The entryUSN of a rule changes whenever the rule or its members change,
+    including renames and deletions of its members done by the referential
+    integrity plugin.
+    """
+    ldap = api.Backend.ldap2
+    hbacrule = api.Object.hbacrule
+    filter = ldap.make_filter({'objectclass': hbacrule.object_class},
+                              rules=ldap.MATCH_ALL)
+    try:
+        entries, truncated = ldap.find_entries(
+            filter, ['entryusn'], DN(hbacrule.container_dn, api.env.basedn),
+            ldap.SCOPE_ONELEVEL, size_limit=sizelimit)
+    except errors.NotFound:
+        return ()
+    if truncated:
+        return None
+
+    stamp = []
+    for entry in entries:
+        usn = entry.get('entryusn')
+        if not usn:
+            return None
+        stamp.append((unicode(entry.dn).lower(), unicode(usn[0])))
+    return tuple(sorted(stamp))
+
+
+def get_hbac_rules(api, sizelimit=None):
+    """
+    Return all HBAC rules as a list of (rule, ipa_rule) tuples, where rule
+    is the hbacrule_find result and ipa_rule the converted pyhbac rule.
+
+    The rules are cached per bind principal, as access controls may hide
+    some rules from some users, and reused until any rule changes. The
+    returned pyhbac rules are shared and must not be modified.
+    """
+    key = (getattr(context, 'principal', None), sizelimit)
+    stamp = get_rules_stamp(api, sizelimit)
+    if stamp is not None:
+        cached = _rule_cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+
+    hbacset = api.Command.hbacrule_find.internal(sizelimit=sizelimit)['result']
+    rules = [(rule, convert_to_ipa_rule(rule)) for rule in hbacset]
+
+    # A rule changed after the stamp was taken only makes the next call
+    # fetch the rules again
+    if stamp is not None:
+        if len(_rule_cache) >= MAX_CACHED_RULESETS:
+            _rule_cache.clear()
+        _rule_cache[key] = (stamp, rules)
+    return rules
+
+
 @register()
 class hbactest(Command):
     __doc__ = _('Simulate use of Host-based access controls')
@@ -302,11 +390,14 @@ class hbactest(Command):
             return u'%s.%s' % (host, self.env.domain)
         return host
 
-    def execute(self, *args, **options):
+    def get_rules(self, options):
+        """
+        Return the pyhbac rules selected by the rules, enabled and disabled
+        options and the names of the requested rules which were not found.
+        """
         # First receive all needed information:
         # 1. HBAC rules (whether enabled or disabled)
-        # 2. Required options are (user, target host, service)
-        # 3. Options: rules to test (--rules, --enabled, --disabled), request for detail output
+        # 2. Options: rules to test (--rules, --enabled, --disabled)
         rules = []
 
         # Use all enabled IPA rules by default
@@ -334,22 +425,22 @@ class hbactest(Command):
         if options['enabled']:
             all_enabled = True
 
-        hbacset = []
         if len(testrules) == 0:
-            hbacset = self.api.Command.hbacrule_find(sizelimit=sizelimit)['result']
+            hbacset = get_hbac_rules(self.api, sizelimit)
         else:
+            hbacset = []
             for rule in testrules:
                 try:
-                    hbacset.append(self.api.Command.hbacrule_show(rule)['result'])
+                    rule = self.api.Command.hbacrule_show.internal(rule)['result']
                 except:
-                    pass
+                    continue
+                hbacset.append((rule, convert_to_ipa_rule(rule)))
 
         # We have some rules, import them
         # --enabled will import all enabled rules (default)
         # --disabled will import all disabled rules
         # --rules will implicitly add the rules from a rule list
-        for rule in hbacset:
-            ipa_rule = convert_to_ipa_rule(rule)
+        for rule, ipa_rule in hbacset:
             if ipa_rule.name in testrules:
                 ipa_rule.enabled = True
                 rules.append(ipa_rule)
@@ -359,9 +450,102 @@ class hbactest(Command):
                 rules.append(ipa_rule)
             elif all_disabled and not ipa_rule.enabled:
                 # Option --disabled forces to include all disabled IPA rules into test
+                # The cached rules are shared, enable a copy
+                ipa_rule = convert_to_ipa_rule(rule)
                 ipa_rule.enabled = True
                 rules.append(ipa_rule)
 
+        return rules, testrules
+
+    def get_trusted_user(self, user):
+        """
+        Return the SID and the IPA groups of the trusted domain user ``user``
+        or None if ``user`` is not a trusted domain user.
+        """
+        if _dcerpc_bindings_installed:
+            is_valid_sid = ipaserver.dcerpc.is_sid_valid(user)
+        else:
+            is_valid_sid = False
+        components = util.normalize_name(user)
+        if not (is_valid_sid or 'domain' in components or 'flatname' in components):
+            return None
+
+        # this is a trusted domain user
+        if not _dcerpc_bindings_installed:
+            raise errors.NotFound(reason=_(
+                'Cannot perform external member validation without '
+                'Samba 4 support installed. Make sure you have installed '
+                'server-trust-ad sub-package of IPA on the server'))
+        domain_validator = ipaserver.dcerpc.DomainValidator(self.api)
+        if not domain_validator.is_configured():
+            raise errors.NotFound(reason=_(
+                'Cannot search in trusted domains without own domain configured. '
+                'Make sure you have run ipa-adtrust-install on the IPA server first'))
+        user_sid, group_sids = domain_validator.get_trusted_domain_user_and_groups(user)
+
+        # Now search for all external groups that have this user or
+        # any of its groups in its external members. Found entires
+        # memberOf links will be then used to gather all groups where
+        # this group is assigned, including the nested ones
+        filter_sids = "(&(objectclass=ipaexternalgroup)(|(ipaExternalMember=%s)))" \
+                % ")(ipaExternalMember=".join(group_sids + [user_sid])
+
+        ldap = self.api.Backend.ldap2
+        group_container = DN(api.env.container_group, api.env.basedn)
+        try:
+            entries, truncated = ldap.find_entries(filter_sids, ['memberof'], group_container)
+        except errors.NotFound:
+            return user_sid, []
+
+        groups = []
+        for entry in entries:
+            memberof_dns = entry.get('memberof', [])
+            for memberof_dn in memberof_dns:
+                if memberof_dn.endswith(group_container):
+                    groups.append(memberof_dn[0][0].value)
+        return user_sid, sorted(set(groups))
+
+    def evaluate(self, request, rules, nodetail=False):
+        """
+        Evaluate the pyhbac ``request`` against ``rules``.
+
+        Return a tuple (access_granted, matched, notmatched, error) where
+        the last three are the names of the rules which matched, did not
+        match and could not be evaluated. The names are not collected if
+        ``nodetail`` is set.
+        """
+        matched_rules = []
+        notmatched_rules = []
+        error_rules = []
+
+        if not nodetail:
+            # Validate runs rules one-by-one and reports failed ones
+            for ipa_rule in rules:
+                try:
+                    res = request.evaluate([ipa_rule])
+                    if res == pyhbac.HBAC_EVAL_ALLOW:
+                        matched_rules.append(ipa_rule.name)
+                    if res == pyhbac.HBAC_EVAL_DENY:
+                        notmatched_rules.append(ipa_rule.name)
+                except pyhbac.HbacError as (code, rule_name):
+                    if code == pyhbac.HBAC_EVAL_ERROR:
+                        error_rules.append(rule_name)
+                        self.log.info('Native IPA HBAC rule "%s" parsing error: %s' % \
+                                      (rule_name, pyhbac.hbac_result_string(code)))
+                except (TypeError, IOError) as (info):
+                    self.log.error('Native IPA HBAC module error: %s' % (info))
+
+            access_granted = len(matched_rules) > 0
+        else:
+            res = request.evaluate(rules)
+            access_granted = (res == pyhbac.HBAC_EVAL_ALLOW)
+
+        return access_granted, matched_rules, notmatched_rules, error_rules
+
+    def execute(self, *args, **options):
+        # Required options are (user, target host, service)
+        rules, testrules = self.get_rules(options)
+
         # Check if there are unresolved rules left
         if len(testrules) > 0:
             # Error, unresolved rules are left in --rules
@@ -374,52 +558,15 @@ class hbactest(Command):
 
         if options['user'] != u'all':
             # check first if this is not a trusted domain user
-            if _dcerpc_bindings_installed:
-                is_valid_sid = ipaserver.dcerpc.is_sid_valid(options['user'])
-            else:
-                is_valid_sid = False
-            components = util.normalize_name(options['user'])
-            if is_valid_sid or 'domain' in components or 'flatname' in components:
-                # this is a trusted domain user
-                if not _dcerpc_bindings_installed:
-                    raise errors.NotFound(reason=_(
-                        'Cannot perform external member validation without '
-                        'Samba 4 support installed. Make sure you have installed '
-                        'server-trust-ad sub-package of IPA on the server'))
-                domain_validator = ipaserver.dcerpc.DomainValidator(self.api)
-                if not domain_validator.is_configured():
-                    raise errors.NotFound(reason=_(
-                        'Cannot search in trusted domains without own domain configured. '
-                        'Make sure you have run ipa-adtrust-install on the IPA server first'))
-                user_sid, group_sids = domain_validator.get_trusted_domain_user_and_groups(options['user'])
-                request.user.name = user_sid
-
-                # Now search for all external groups that have this user or
-                # any of its groups in its external members. Found entires
-                # memberOf links will be then used to gather all groups where
-                # this group is assigned, including the nested ones
-                filter_sids = "(&(objectclass=ipaexternalgroup)(|(ipaExternalMember=%s)))" \
-                        % ")(ipaExternalMember=".join(group_sids + [user_sid])
-
-                ldap = self.api.Backend.ldap2
-                group_container = DN(api.env.container_group, api.env.basedn)
-                try:
-                    entries, truncated = ldap.find_entries(filter_sids, ['memberof'], group_container)
-                except errors.NotFound:
-                    request.user.groups = []
-                else:
-                    groups = []
-                    for entry in entries:
-                        memberof_dns = entry.get('memberof', [])
-                        for memberof_dn in memberof_dns:
-                            if memberof_dn.endswith(group_container):
-                                groups.append(memberof_dn[0][0].value)
-                    request.user.groups = sorted(set(groups))
+            trusted_user = self.get_trusted_user(options['user'])
+            if trusted_user is not None:
+                request.user.name, request.user.groups = trusted_user
             else:
                 # try searching for a local user
                 try:
                     request.user.name = options['user']
-                    search_result = self.api.Command.user_show(request.user.name)['result']
+                    search_result = self.api.Command.user_show.internal_entry(
+                        request.user.name)
                     groups = search_result['memberof_group']
                     if 'memberofindirect_group' in search_result:
                         groups += search_result['memberofindirect_group']
@@ -430,7 +577,8 @@ class hbactest(Command):
         if options['service'] != u'all':
             try:
                 request.service.name = options['service']
-                service_result = self.api.Command.hbacsvc_show(request.service.name)['result']
+                service_result = self.api.Command.hbacsvc_show.internal_entry(
+                    request.service.name)
                 if 'memberof_hbacsvcgroup' in service_result:
                     request.service.groups = service_result['memberof_hbacsvcgroup']
             except:
@@ -439,7 +587,8 @@ class hbactest(Command):
         if options['targethost'] != u'all':
             try:
                 request.targethost.name = self.canonicalize(options['targethost'])
-                tgthost_result = self.api.Command.host_show(request.targethost.name)['result']
+                tgthost_result = self.api.Command.host_show.internal_entry(
+                    request.targethost.name)
                 groups = tgthost_result['memberof_hostgroup']
                 if 'memberofindirect_hostgroup' in tgthost_result:
                     groups += tgthost_result['memberofindirect_hostgroup']
@@ -447,34 +596,11 @@ class hbactest(Command):
             except:
                 pass
 
-        matched_rules = []
-        notmatched_rules = []
-        error_rules = []
+        access_granted, matched_rules, notmatched_rules, error_rules = \
+            self.evaluate(request, rules, options['nodetail'])
         warning_rules = []
 
         result = {'warning':None, 'matched':None, 'notmatched':None, 'error':None}
-        if not options['nodetail']:
-            # Validate runs rules one-by-one and reports failed ones
-            for ipa_rule in rules:
-                try:
-                    res = request.evaluate([ipa_rule])
-                    if res == pyhbac.HBAC_EVAL_ALLOW:
-                        matched_rules.append(ipa_rule.name)
-                    if res == pyhbac.HBAC_EVAL_DENY:
-                        notmatched_rules.append(ipa_rule.name)
-                except pyhbac.HbacError as (code, rule_name):
-                    if code == pyhbac.HBAC_EVAL_ERROR:
-                        error_rules.append(rule_name)
-                        self.log.info('Native IPA HBAC rule "%s" parsing error: %s' % \
-                                      (rule_name, pyhbac.hbac_result_string(code)))
-                except (TypeError, IOError) as (info):
-                    self.log.error('Native IPA HBAC module error: %s' % (info))
-
-            access_granted = len(matched_rules) > 0
-        else:
-            res = request.evaluate(rules)
-            access_granted = (res == pyhbac.HBAC_EVAL_ALLOW)
-
         result['summary'] = _('Access granted: %s') % (access_granted)
 
 
@@ -514,3 +640,177 @@ class hbactest(Command):
         # Propagate integer value for result. It will give proper command line result for scripts
         return int(not output['value'])
 
+
+@register()
+class hbactest_bulk(hbactest):
+    __doc__ = _('Simulate use of Host-based access controls for many users, '
+                'hosts and services')
+
+    has_output = (
+        output.summary,
+        output.Output('result', (list, tuple), _('Results of the simulation')),
+        output.Output('error', (list, tuple, NoneType), _('Non-existent or invalid rules')),
+        output.Output('count', int, _('Number of access checks')),
+        output.Output('value',  bool, _('Result of simulation'), ['no_display']),
+    )
+
+    takes_options = (
+        Str('user+',
+            cli_name='user',
+            label=_('User name'),
+            csv=True,
+        ),
+        Str('targethost+',
+            cli_name='host',
+            label=_('Target host'),
+            csv=True,
+        ),
+        Str('service+',
+            cli_name='service',
+            label=_('Service'),
+            csv=True,
+        ),
+    ) + tuple(
+        option for option in hbactest.takes_options
+        if option.name in ('rules', 'nodetail', 'enabled', 'disabled', 'sizelimit')
+    )
+
+    def get_memberof(self, container, attr, names, group_container):
+        """
+        Return the names of the groups in ``group_container`` which the
+        entries in ``container`` with ``attr`` in ``names`` are members of,
+        keyed by the lower case ``attr`` value.
+
+        The entries are looked up by searches of up to BULK_SEARCH_SIZE
+        entries each.
+        """
+        ldap = self.api.Backend.ldap2
+        base_dn = DN(container, api.env.basedn)
+        group_dn = DN(group_container, api.env.basedn)
+        names = sorted(set(names))
+
+        memberof = {}
+        for i in xrange(0, len(names), BULK_SEARCH_SIZE):
+            filter = ldap.make_filter_from_attr(
+                attr, names[i:i + BULK_SEARCH_SIZE], rules=ldap.MATCH_ANY)
+            try:
+                entries, truncated = ldap.find_entries(
+                    filter, [attr, 'memberof'], base_dn, ldap.SCOPE_ONELEVEL,
+                    size_limit=0)
+            except errors.NotFound:
+                continue
+            for entry in entries:
+                groups = sorted(set(
+                    memberof_dn[0][0].value
+                    for memberof_dn in entry.get('memberof', [])
+                    if memberof_dn.endswith(group_dn)))
+                for name in entry.get(attr, []):
+                    memberof[name.lower()] = groups
+        return memberof
+
+    def execute(self, *args, **options):
+        rules, testrules = self.get_rules(options)
+
+        # Check if there are unresolved rules left
+        if len(testrules) > 0:
+            return dict(summary=unicode(_(u'Unresolved rules in --rules')),
+                        result=[], error=testrules, count=0, value=False)
+
+        # Resolve the names and groups of all the subjects first, (None, None)
+        # stands for "all"
+        users = {}
+        local_users = []
+        for user in options['user']:
+            if user == u'all':
+                users[user] = (None, None)
+                continue
+            trusted_user = self.get_trusted_user(user)
+            if trusted_user is not None:
+                users[user] = trusted_user
+            else:
+                local_users.append(user)
+        memberof = self.get_memberof(
+            api.env.container_user, 'uid', local_users,
+            api.env.container_group)
+        for user in local_users:
+            users[user] = (user, memberof.get(user.lower(), []))
+
+        targethosts = {}
+        for host in options['targethost']:
+            if host == u'all':
+                targethosts[host] = (None, None)
+            else:
+                targethosts[host] = (self.canonicalize(host), None)
+        memberof = self.get_memberof(
+            api.env.container_host, 'fqdn',
+            [name for name, groups in targethosts.values() if name],
+            api.env.container_hostgroup)
+        for host, (name, groups) in targethosts.items():
+            if name is not None:
+                targethosts[host] = (name, memberof.get(name.lower(), []))
+
+        services = {}
+        memberof = self.get_memberof(
+            api.env.container_hbacservice, 'cn',
+            [service for service in options['service'] if service != u'all'],
+            api.env.container_hbacservicegroup)
+        for service in options['service']:
+            if service == u'all':
+                services[service] = (None, None)
+            else:
+                services[service] = (service, memberof.get(service.lower(), []))
+
+        results = []
+        error_rules = set()
+        for user in options['user']:
+            for host in options['targethost']:
+                for service in options['service']:
+                    request = pyhbac.HbacRequest()
+                    for element, (name, groups) in (
+                            (request.user, users[user]),
+                            (request.targethost, targethosts[host]),
+                            (request.service, services[service])):
+                        if name is not None:
+                            element.name = name
+                            element.groups = groups
+
+                    access_granted, matched, notmatched, failed = \
+                        self.evaluate(request, rules, options['nodetail'])
+                    error_rules.update(failed)
+
+                    result = dict(user=user, service=service,
+                                  targethost=targethosts[host][0] or host,
+                                  value=access_granted)
+                    if not options['nodetail']:
+                        result['matched'] = matched
+                    results.append(result)
+
+        granted = len([result for result in results if result['value']])
+        return dict(
+            summary=_('%(granted)d of %(count)d access checks were granted') %
+                dict(granted=granted, count=len(results)),
+            result=results,
+            error=sorted(error_rules) or None,
+            count=len(results),
+            value=granted == len(results),
+        )
+
+    def output_for_cli(self, textui, output, *args, **options):
+        textui.print_summary(output['summary'])
+        for result in output['result']:
+            if result['value']:
+                access = unicode(_('granted'))
+            else:
+                access = unicode(_('denied'))
+            line = u'%s -> %s (%s): %s' % (
+                result['user'], result['targethost'], result['service'],
+                access)
+            if result.get('matched'):
+                line = u'%s (%s)' % (line, u', '.join(result['matched']))
+            textui.print_indented(line)
+        if output['error']:
+            textui.print_attribute(unicode(self.output['error'].doc),
+                                   output['error'], '%s: %s', 1, True)
+
+        # Non-zero unless all the access checks were granted
+        return int(not output['value'])
@@ -28,7 +28,8 @@ from ipalib.plugins.baseldap import (LDAPQuery, LDAPObject, LDAPCreate,
                                      LDAPDelete, LDAPUpdate, LDAPSearch,
                                      LDAPRetrieve, LDAPAddMember,
                                      LDAPRemoveMember, host_is_master,
-                                     pkey_to_value, add_missing_object_class)
+                                     pkey_to_value, add_missing_object_class,
+                                     BULK_SEARCH_SIZE)
 from ipalib.plugins.service import (split_principal, validate_certificate,
     set_certificate_attrs, ticket_flags_params, update_krbticketflags,
     set_kerberos_attrs, rename_ipaallowedtoperform_from_ldap,
@@ -125,13 +126,13 @@ def remove_fwd_ptr(ipaddr, host, domain, recordtype):
         # normalize the entry
         delkw = {'ptrrecord': "%s.%s" % (host, domain)}
 
-        api.Command['dnsrecord_del'](revzone, revname, **delkw)
+        api.Command['dnsrecord_del'].internal(revzone, revname, **delkw)
     except errors.NotFound:
         pass
 
     try:
         delkw = {recordtype: ipaddr}
-        api.Command['dnsrecord_del'](domain, host, **delkw)
+        api.Command['dnsrecord_del'].internal(domain, host, **delkw)
     except errors.NotFound:
         pass
 
@@ -158,7 +159,7 @@ def update_sshfp_record(zone, record, entry_attrs):
             sshfps.append(sshfp)
 
     try:
-        api.Command['dnsrecord_mod'](zone, record, sshfprecord=sshfps)
+        api.Command['dnsrecord_mod'].internal(zone, record, sshfprecord=sshfps)
     except errors.EmptyModlist:
         pass
 
@@ -563,10 +564,43 @@ class host(LDAPObject):
 
         return managed_hosts
 
-    def suppress_netgroup_memberof(self, ldap, entry_attrs):
+    def get_entries_managed_hosts(self, ldap, dns):
+        """
+        Return a dict of the DNs of the hosts managed by each of the hosts
+        ``dns``, like get_managed_hosts does for a single host.
+
+        The managed hosts are found by searches for the hosts managed by up
+        to BULK_SEARCH_SIZE hosts each.
+        """
+        dns = list(dns)
+        managed_hosts = dict((dn, []) for dn in dns)
+        for i in xrange(0, len(dns), BULK_SEARCH_SIZE):
+            host_filter = ldap.make_filter_from_attr(
+                'managedby', dns[i:i + BULK_SEARCH_SIZE], rules=ldap.MATCH_ANY)
+            try:
+                (hosts, truncated) = ldap.find_entries(
+                    base_dn=DN(self.container_dn, api.env.basedn),
+                    filter=host_filter, attrs_list=['managedby'],
+                    size_limit=0)
+            except errors.NotFound:
+                continue
+
+            for host in hosts:
+                for dn in host.get('managedby', []):
+                    if dn in managed_hosts:
+                        managed_hosts[dn].append(host.dn)
+
+        return managed_hosts
+
+    def suppress_netgroup_memberof(self, ldap, entry_attrs,
+                                   managed_netgroups=None):
         """
         We don't want to show managed netgroups so remove them from the
         memberofindirect list.
+
+        If ``managed_netgroups`` is not None, it is the set of the DNs of
+        all the managed netgroups which may be in the list, see
+        get_managed_netgroups.
         """
         ng_container = DN(api.env.container_netgroup, api.env.basedn)
         for member in list(entry_attrs.get('memberofindirect', [])):
@@ -574,6 +608,11 @@ class host(LDAPObject):
             if not memberdn.endswith(ng_container):
                 continue
 
+            if managed_netgroups is not None:
+                if memberdn in managed_netgroups:
+                    entry_attrs['memberofindirect'].remove(member)
+                continue
+
             filter = ldap.make_filter({'objectclass': 'mepmanagedentry'})
             try:
                 ldap.get_entries(memberdn, ldap.SCOPE_BASE, filter, [''])
@@ -582,6 +621,42 @@ class host(LDAPObject):
             else:
                 entry_attrs['memberofindirect'].remove(member)
 
+    def get_managed_netgroups(self, ldap, entries):
+        """
+        Return the set of the DNs of the managed netgroups in the
+        memberofindirect lists of ``entries``.
+
+        The netgroups are looked up by searches of up to BULK_SEARCH_SIZE
+        netgroups each.
+        """
+        ng_container = DN(api.env.container_netgroup, api.env.basedn)
+        netgroups = set()
+        for entry_attrs in entries:
+            for member in entry_attrs.get('memberofindirect', []):
+                memberdn = DN(member)
+                if memberdn.endswith(ng_container):
+                    netgroups.add(memberdn)
+
+        netgroups = list(netgroups)
+        managed_netgroups = set()
+        for i in xrange(0, len(netgroups), BULK_SEARCH_SIZE):
+            filter = ldap.combine_filters(
+                [ldap.make_filter({'objectclass': 'mepmanagedentry'}),
+                 ldap.make_filter_from_attr(
+                     'cn', [dn[0].value
+                            for dn in netgroups[i:i + BULK_SEARCH_SIZE]],
+                     rules=ldap.MATCH_ANY)],
+                rules=ldap.MATCH_ALL)
+            try:
+                (found, truncated) = ldap.find_entries(
+                    filter, [''], ng_container, ldap.SCOPE_ONELEVEL,
+                    size_limit=0)
+            except errors.NotFound:
+                continue
+            managed_netgroups.update(entry.dn for entry in found)
+
+        return managed_netgroups
+
 
 @register()
 class host_add(LDAPCreate):
@@ -721,7 +796,7 @@ class host_del(LDAPDelete):
         assert isinstance(dn, DN)
         # If we aren't given a fqdn, find it
         if _hostname_validator(None, keys[-1]) is not None:
-            hostentry = api.Command['host_show'](keys[-1])['result']
+            hostentry = api.Command['host_show'].internal_entry(keys[-1])
             fqdn = hostentry['fqdn'][0]
         else:
             fqdn = keys[-1]
@@ -730,9 +805,8 @@ class host_del(LDAPDelete):
         truncated = True
         while truncated:
             try:
-                ret = api.Command['service_find'](fqdn)
-                truncated = ret['truncated']
-                services = ret['result']
+                (services, truncated) = api.Command['service_find'].internal_entries(
+                    fqdn)
             except errors.NotFound:
                 break
             else:
@@ -740,7 +814,7 @@ class host_del(LDAPDelete):
                     principal = entry_attrs['krbprincipalname'][0]
                     (service, hostname, realm) = split_principal(principal)
                     if hostname.lower() == fqdn:
-                        api.Command['service_del'](principal)
+                        api.Command['service_del'].internal(principal)
         updatedns = options.get('updatedns', False)
         if updatedns:
             try:
@@ -753,12 +827,12 @@ class host_del(LDAPDelete):
             parts = fqdn.split('.')
             domain = unicode('.'.join(parts[1:]))
             try:
-                result = api.Command['dnszone_show'](domain)['result']
+                result = api.Command['dnszone_show'].internal(domain)['result']
                 domain = result['idnsname'][0]
             except errors.NotFound:
                 self.obj.handle_not_found(*keys)
             # Get all forward resources for this host
-            records = api.Command['dnsrecord_find'](domain, idnsname=parts[0])['result']
+            records = api.Command['dnsrecord_find'].internal(domain, idnsname=parts[0])['result']
             for record in records:
                 if 'arecord' in record:
                     remove_fwd_ptr(record['arecord'][0], parts[0],
@@ -776,7 +850,7 @@ class host_del(LDAPDelete):
                                 if (record[attr][i].endswith(parts[0]) or
                                     record[attr][i].endswith(fqdn+'.')):
                                     delkw = { unicode(attr) : record[attr][i] }
-                                    api.Command['dnsrecord_del'](domain,
+                                    api.Command['dnsrecord_del'].internal(domain,
                                             record['idnsname'][0],
                                             **delkw)
                             break
@@ -791,11 +865,11 @@ class host_del(LDAPDelete):
                 try:
                     serial = unicode(x509.get_serial_number(cert, x509.DER))
                     try:
-                        result = api.Command['cert_show'](serial)['result']
+                        result = api.Command['cert_show'].internal(serial)['result']
                         if 'revocation_reason' not in result:
                             try:
-                                api.Command['cert_revoke'](serial,
-                                                           revocation_reason=4)
+                                api.Command['cert_revoke'].internal(
+                                    serial, revocation_reason=4)
                             except errors.NotImplementedError:
                                 # some CA's might not implement revoke
                                 pass
@@ -883,10 +957,10 @@ class host_mod(LDAPUpdate):
                 try:
                     serial = unicode(x509.get_serial_number(cert, x509.DER))
                     try:
-                        result = api.Command['cert_show'](serial)['result']
+                        result = api.Command['cert_show'].internal(serial)['result']
                         if 'revocation_reason' not in result:
                             try:
-                                api.Command['cert_revoke'](
+                                api.Command['cert_revoke'].internal(
                                     serial, revocation_reason=4)
                             except errors.NotImplementedError:
                                 # some CA's might not implement revoke
@@ -923,7 +997,7 @@ class host_mod(LDAPUpdate):
             parts = keys[-1].split('.')
             domain = unicode('.'.join(parts[1:]))
             try:
-                result = api.Command['dnszone_show'](domain)['result']
+                result = api.Command['dnszone_show'].internal(domain)['result']
                 domain = result['idnsname'][0]
             except errors.NotFound:
                 self.obj.handle_not_found(*keys)
@@ -995,6 +1069,10 @@ class host_find(LDAPSearch):
         if 'locality' in attrs_list:
             attrs_list.remove('locality')
             attrs_list.append('l')
+        if (not options.get('pkey_only', False) and
+                'ipasshpubkey' not in attrs_list):
+            # The SSH public keys are needed for their fingerprints
+            attrs_list.append('ipasshpubkey')
         if 'man_host' in options or 'not_man_host' in options:
             hosts = []
             if options.get('man_host') is not None:
@@ -1040,21 +1118,35 @@ class host_find(LDAPSearch):
     def post_callback(self, ldap, entries, truncated, *args, **options):
         if options.get('pkey_only', False):
             return truncated
+
+        # Look up the attributes computed from other entries for all the
+        # entries at once
+        self.obj.get_entries_password_attributes(ldap, entries)
+        managed_netgroups = self.obj.get_managed_netgroups(ldap, entries)
+        if options.get('all', False):
+            managed_hosts = self.obj.get_entries_managed_hosts(
+                ldap, [entry_attrs.dn for entry_attrs in entries])
+
         for entry_attrs in entries:
             set_certificate_attrs(entry_attrs)
             set_kerberos_attrs(entry_attrs, options)
             rename_ipaallowedtoperform_from_ldap(entry_attrs, options)
-            self.obj.get_password_attributes(ldap, entry_attrs.dn, entry_attrs)
-            self.obj.suppress_netgroup_memberof(ldap, entry_attrs)
+            self.obj.suppress_netgroup_memberof(
+                ldap, entry_attrs, managed_netgroups)
             if entry_attrs['has_password']:
                 # If an OTP is set there is no keytab, at least not one
                 # fetched anywhere.
                 entry_attrs['has_keytab'] = False
 
             if options.get('all', False):
-                entry_attrs['managing'] = self.obj.get_managed_hosts(entry_attrs.dn)
-
-            convert_sshpubkey_post(ldap, entry_attrs.dn, entry_attrs)
+                entry_attrs['managing'] = managed_hosts[entry_attrs.dn]
+
+            # ipaSshPubKey was retrieved by the search, an entry without it
+            # has no SSH public keys
+            if 'ipasshpubkey' in entry_attrs:
+                convert_sshpubkey_post(ldap, entry_attrs.dn, entry_attrs)
+                if not options.get('all', False):
+                    del entry_attrs['ipasshpubkey']
             convert_ipaassignedidview_post(entry_attrs, options)
 
         return truncated
@@ -1127,7 +1219,7 @@ class host_disable(LDAPQuery):
 
         # If we aren't given a fqdn, find it
         if _hostname_validator(None, keys[-1]) is not None:
-            hostentry = api.Command['host_show'](keys[-1])['result']
+            hostentry = api.Command['host_show'].internal_entry(keys[-1])
             fqdn = hostentry['fqdn'][0]
         else:
             fqdn = keys[-1]
@@ -1140,9 +1232,8 @@ class host_disable(LDAPQuery):
         truncated = True
         while truncated:
             try:
-                ret = api.Command['service_find'](fqdn)
-                truncated = ret['truncated']
-                services = ret['result']
+                (services, truncated) = api.Command['service_find'].internal_entries(
+                    fqdn)
             except errors.NotFound:
                 break
             else:
@@ -1151,7 +1242,7 @@ class host_disable(LDAPQuery):
                     (service, hostname, realm) = split_principal(principal)
                     if hostname.lower() == fqdn:
                         try:
-                            api.Command['service_disable'](principal)
+                            api.Command['service_disable'].internal(principal)
                             done_work = True
                         except errors.AlreadyInactive:
                             pass
@@ -1167,11 +1258,11 @@ class host_disable(LDAPQuery):
                 try:
                     serial = unicode(x509.get_serial_number(cert, x509.DER))
                     try:
-                        result = api.Command['cert_show'](serial)['result']
+                        result = api.Command['cert_show'].internal(serial)['result']
                         if 'revocation_reason' not in result:
                             try:
-                                api.Command['cert_revoke'](serial,
-                                                           revocation_reason=4)
+                                api.Command['cert_revoke'].internal(
+                                    serial, revocation_reason=4)
                             except errors.NotImplementedError:
                                 # some CA's might not implement revoke
                                 pass
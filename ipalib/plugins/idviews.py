@@ -55,6 +55,9 @@ protected_default_trust_view_error = errors.ProtectedEntryError(
 
 DEFAULT_TRUST_VIEW_NAME = "default trust view"
 
+# Maximum number of IPA anchors resolved by a single search
+ANCHOR_SEARCH_SIZE = 100
+
 @register()
 class idview(LDAPObject):
     """
@@ -174,13 +177,15 @@ class idview_show(LDAPRetrieve):
                     scope=ldap.SCOPE_ONELEVEL,
                     paged_search=True)
 
+                anchors = [override.single_value['ipaanchoruuid']
+                           for override in overrides]
+                names = resolve_anchors_to_object_names(
+                    ldap, obj_type, anchors)
+
                 entry_attrs[attr_name] = [
-                    resolve_anchor_to_object_name(
-                        ldap,
-                        obj_type,
-                        override.single_value['ipaanchoruuid']
-                    )
-                    for override in overrides
+                    names.get(anchor) or
+                    resolve_anchor_to_object_name(ldap, obj_type, anchor)
+                    for anchor in anchors
                 ]
 
             except errors.NotFound:
@@ -528,6 +533,71 @@ def resolve_anchor_to_object_name(ldap, obj_type, anchor):
                % dict(anchor=anchor))
 
 
+def resolve_anchors_to_object_names(ldap, obj_type, anchors):
+    """
+    Resolves many anchors at once, see resolve_anchor_to_object_name.
+
+    IPA anchors are resolved by searches for up to ANCHOR_SEARCH_SIZE
+    objects, SID anchors by a single request to the trusted domains.
+
+    Returns a dict of the object names keyed by anchor. Anchors which could
+    not be resolved are left out.
+    """
+
+    names = {}
+    anchors_by_uuid = {}
+    anchors_by_sid = {}
+
+    for anchor in set(anchors):
+        if anchor.startswith(IPA_ANCHOR_PREFIX):
+            uuid = anchor.rpartition(':')[-1].strip().lower()
+            anchors_by_uuid.setdefault(uuid, []).append(anchor)
+        elif anchor.startswith(SID_ANCHOR_PREFIX):
+            sid = anchor[len(SID_ANCHOR_PREFIX):].strip()
+            anchors_by_sid.setdefault(sid, []).append(anchor)
+
+    if anchors_by_uuid:
+        accounts_dn = DN(api.env.container_accounts, api.env.basedn)
+
+        objectclass, name_attr = {
+            'user': ('posixaccount', 'uid'),
+            'group': ('ipausergroup', 'cn'),
+        }[obj_type]
+
+        uuids = sorted(anchors_by_uuid)
+        for i in xrange(0, len(uuids), ANCHOR_SEARCH_SIZE):
+            filter = ldap.combine_filters(
+                (ldap.make_filter_from_attr('objectclass', objectclass),
+                 ldap.make_filter_from_attr(
+                     'ipaUniqueID', uuids[i:i + ANCHOR_SEARCH_SIZE],
+                     rules=ldap.MATCH_ANY)),
+                rules=ldap.MATCH_ALL)
+            try:
+                (entries, truncated) = ldap.find_entries(
+                    filter=filter,
+                    attrs_list=['ipaUniqueID', name_attr],
+                    base_dn=accounts_dn,
+                    size_limit=0)
+            except errors.NotFound:
+                continue
+
+            for entry in entries:
+                uuid = entry.single_value['ipaUniqueID'].lower()
+                for anchor in anchors_by_uuid.get(uuid, []):
+                    names[anchor] = entry.single_value[name_attr]
+
+    if anchors_by_sid and _dcerpc_bindings_installed:
+        domain_validator = ipaserver.dcerpc.DomainValidator(api)
+        if domain_validator.is_configured():
+            sid_names = domain_validator.get_trusted_domain_objects_from_sids(
+                anchors_by_sid.keys())
+            for sid, name in sid_names.iteritems():
+                for anchor in anchors_by_sid[sid]:
+                    names[anchor] = name
+
+    return names
+
+
 # This is not registered on purpose, it's a base class for ID overrides
 class baseidoverride(LDAPObject):
     """
@@ -583,6 +653,29 @@ class baseidoverride(LDAPObject):
                 )
                 entry_attrs.single_value['ipaanchoruuid'] = object_name
 
+    def convert_anchors_to_human_readable_form(self, entries, **options):
+        """
+        Convert the anchors of all ``entries`` like
+        convert_anchor_to_human_readable_form, resolving them together.
+        """
+        if options.get('raw'):
+            return
+
+        anchors = [entry.single_value.get('ipaanchoruuid')
+                   for entry in entries]
+        names = resolve_anchors_to_object_names(
+            self.backend,
+            self.override_object,
+            [anchor for anchor in anchors if anchor]
+        )
+
+        for entry, anchor in zip(entries, anchors):
+            if anchor in names:
+                entry.single_value['ipaanchoruuid'] = names[anchor]
+            else:
+                # Report the anchors which cannot be resolved as before
+                self.convert_anchor_to_human_readable_form(entry, **options)
+
     def prohibit_ipa_users_in_default_view(self, dn, entry_attrs):
         # Check if parent object is Default Trust View, if so, prohibit
         # adding overrides for IPA objects
@@ -638,8 +731,7 @@ class baseidoverride_find(LDAPSearch):
                            '%(count)d ID overrides matched', 0)
 
     def post_callback(self, ldap, entries, truncated, *args, **options):
-        for entry in entries:
-            self.obj.convert_anchor_to_human_readable_form(entry, **options)
+        self.obj.convert_anchors_to_human_readable_form(entries, **options)
         return truncated
 
 
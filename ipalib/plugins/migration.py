@@ -18,11 +18,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import os
+import sys
+import errno
+import hashlib
+import threading
+import Queue
 from ldap import MOD_ADD
 from ldap import SCOPE_BASE, SCOPE_ONELEVEL, SCOPE_SUBTREE
 
 from ipalib import api, errors, output
 from ipalib import Command, Password, Str, Flag, StrEnum, DNParam, File, Bool
+from ipalib import Int
+from ipalib.request import destroy_context
 from ipalib.cli import to_cli
 from ipalib.plugable import Registry
 from ipalib.plugins.user import NO_UPG_MAGIC
@@ -83,6 +91,14 @@ mode for every 100 users. As a result there will be a window in which
 users will be added to IPA but will not be members of the default
 user group.
 
+The entries are read from the remote server in pages and added to IPA by
+several workers in parallel, each using its own connections. The number
+of workers is set with the "--workers" option (4 by default).
+
+The entries migrated so far are recorded in a checkpoint file on the IPA
+server. If the migration is interrupted, run the same command again with
+the "--resume" option to skip the entries migrated before.
+
 EXAMPLES:
 
  The simplest migration, accepting all defaults:
@@ -121,7 +137,7 @@ file should be evaluated post-migration to correct or investigate any
 issues that were discovered.
 
 For every 100 users migrated an info-level message will be displayed to
-give the current progress and duration to make it possible to track
+give the current progress, rate and duration to make it possible to track
 the progress of migration.
 
 If the log level is debug, either by setting debug = True in
@@ -146,6 +162,13 @@ _supported_schemas = (u'RFC2307bis', u'RFC2307')
 _supported_scopes = {u'base': SCOPE_BASE, u'onelevel': SCOPE_ONELEVEL, u'subtree': SCOPE_SUBTREE}
 _default_scope = u'onelevel'
 
+# Number of entries requested from the remote server at once
+MIGRATION_PAGE_SIZE = 1000
+# Number of entries waiting to be migrated per worker
+MIGRATION_QUEUE_DEPTH = 50
+# Number of migrated entries between progress reports
+PROGRESS_INTERVAL = 100
+
 
 def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs):
     assert isinstance(dn, DN)
@@ -156,13 +179,23 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
     search_bases = kwargs.get('search_bases', None)
     valid_gids = kwargs['valid_gids']
     invalid_gids = kwargs['invalid_gids']
+    remote_gids = kwargs.get('remote_gids')
 
     if 'gidnumber' not in entry_attrs:
         raise errors.NotFound(reason=_('%(user)s is not a POSIX user') % dict(user=pkey))
     else:
         # See if the gidNumber at least points to a valid group on the remote
         # server.
-        if entry_attrs['gidnumber'][0] in invalid_gids:
+        if remote_gids is not None:
+            # GID numbers of all the remote groups were read in advance
+            found = remote_gids.get(entry_attrs['gidnumber'][0], 0)
+            if found == 0:
+                api.log.warn('GID number %s of migrated user %s does not point to a known group.' \
+                             % (entry_attrs['gidnumber'][0], pkey))
+            elif found > 1:
+                api.log.warn('GID number %s of migrated user %s should match 1 group, but it matched %d groups' \
+                             % (entry_attrs['gidnumber'][0], pkey, found))
+        elif entry_attrs['gidnumber'][0] in invalid_gids:
             api.log.warn('GID number %s of migrated user %s does not point to a known group.' \
                          % (entry_attrs['gidnumber'][0], pkey))
         elif entry_attrs['gidnumber'][0] not in valid_gids:
@@ -274,9 +307,6 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
 def _post_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx):
     assert isinstance(dn, DN)
 
-    if 'def_group_dn' in ctx:
-        _update_default_group(ldap, ctx, False)
-
     if 'description' in entry_attrs and NO_UPG_MAGIC in entry_attrs['description']:
         entry_attrs['description'].remove(NO_UPG_MAGIC)
         try:
@@ -287,36 +317,34 @@ def _post_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx):
             pass
 
 def _update_default_group(ldap, ctx, force):
-    migrate_cnt = ctx['migrate_cnt']
     group_dn = ctx['def_group_dn']
 
-    # Purposely let this fire when migrate_cnt == 0 so on re-running migration
-    # it can catch any users migrated but not added to the default group.
-    if force or migrate_cnt % 100 == 0:
-        s = datetime.datetime.now()
-        searchfilter = "(&(objectclass=posixAccount)(!(memberof=%s)))" % group_dn
-        try:
-            (result, truncated) = ldap.find_entries(searchfilter,
-                [''], DN(api.env.container_user, api.env.basedn),
-                scope=ldap.SCOPE_SUBTREE, time_limit=-1, size_limit=-1)
-        except errors.NotFound:
-            api.log.debug('All users have default group set')
-            return
+    # Add all users which are not members yet, so on re-running migration
+    # it also catches any users migrated but not added to the default group.
+    s = datetime.datetime.now()
+    searchfilter = "(&(objectclass=posixAccount)(!(memberof=%s)))" % group_dn
+    try:
+        (result, truncated) = ldap.find_entries(searchfilter,
+            [''], DN(api.env.container_user, api.env.basedn),
+            scope=ldap.SCOPE_SUBTREE, time_limit=-1, size_limit=-1)
+    except errors.NotFound:
+        api.log.debug('All users have default group set')
+        return
 
-        member_dns = [m.dn for m in result]
-        modlist = [(MOD_ADD, 'member', ldap.encode(member_dns))]
-        try:
-            with ldap.error_handler():
-                ldap.conn.modify_s(str(group_dn), modlist)
-        except errors.DatabaseError as e:
-            api.log.error('Adding new members to default group failed: %s \n'
-                          'members: %s', e, ','.join(member_dns))
-
-        e = datetime.datetime.now()
-        d = e - s
-        mode = " (forced)" if force else ""
-        api.log.info('Adding %d users to group%s duration %s',
-                      len(member_dns), mode, d)
+    member_dns = [m.dn for m in result]
+    modlist = [(MOD_ADD, 'member', ldap.encode(member_dns))]
+    try:
+        with ldap.error_handler():
+            ldap.conn.modify_s(str(group_dn), modlist)
+    except errors.DatabaseError as e:
+        api.log.error('Adding new members to default group failed: %s \n'
+                      'members: %s', e, ','.join(member_dns))
+
+    e = datetime.datetime.now()
+    d = e - s
+    mode = " (forced)" if force else ""
+    api.log.info('Adding %d users to group%s duration %s',
+                  len(member_dns), mode, d)
 
 # GROUP MIGRATION CALLBACKS AND VARS
 
@@ -432,6 +460,140 @@ def _group_exc_callback(ldap, dn, entry_attrs, exc, options):
 
 # DS MIGRATION PLUGIN
 
+class MigrationCheckpoint(object):
+    """
+    Record of the entries migrated so far by migrate-ds.
+
+    The object type and primary key of each migrated entry are appended to
+    a file named after the source of the migration. When a migration is
+    resumed, the entries recorded in the file are skipped. The file is
+    removed once the migration completes.
+    """
+
+    def __init__(self, key, resume):
+        self.filename = os.path.join(
+            paths.IPA_MIGRATION_DIR,
+            '%s.checkpoint' % hashlib.sha1(key).hexdigest())
+        self.migrated = set()
+        self.__lock = threading.Lock()
+        self.__file = None
+
+        if resume:
+            try:
+                with open(self.filename) as f:
+                    for line in f:
+                        # The last line may be incomplete
+                        if not line.endswith('\n'):
+                            break
+                        ldap_obj_name, pkey = \
+                            line[:-1].decode('utf-8').split(u' ', 1)
+                        self.migrated.add((ldap_obj_name, pkey))
+            except IOError, e:
+                if e.errno != errno.ENOENT:
+                    api.log.warn('Cannot read migration checkpoint %s: %s',
+                                 self.filename, e)
+
+        try:
+            self.__file = open(self.filename, 'a' if resume else 'w')
+        except IOError, e:
+            api.log.warn('Cannot write migration checkpoint %s: %s',
+                         self.filename, e)
+
+    def __contains__(self, item):
+        return item in self.migrated
+
+    def add(self, ldap_obj_name, pkey):
+        if self.__file is None:
+            return
+        line = (u'%s %s\n' % (ldap_obj_name, pkey)).encode('utf-8')
+        with self.__lock:
+            self.__file.write(line)
+            self.__file.flush()
+
+    def close(self, remove=False):
+        if self.__file is None:
+            return
+        self.__file.close()
+        self.__file = None
+        if remove:
+            try:
+                os.unlink(self.filename)
+            except OSError, e:
+                api.log.warn('Cannot remove migration checkpoint %s: %s',
+                             self.filename, e)
+
+
+class _MigrationPool(object):
+    """
+    Threads migrating entries in parallel.
+
+    Each thread calls ``connect`` to open its own connections and then
+    ``migrate`` for the entries submitted to the pool. The first exception
+    raised in a thread stops the pool and is re-raised by `submit` or
+    `close`.
+    """
+
+    def __init__(self, migrate, connect, workers):
+        self.__migrate = migrate
+        self.__connect = connect
+        self.__queue = Queue.Queue(workers * MIGRATION_QUEUE_DEPTH)
+        self.__exc_info = None
+        self.__stopped = False
+        self.__threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.__worker,
+                                      name='migrate_ds-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def __worker(self):
+        try:
+            self.__connect()
+            while True:
+                args = self.__queue.get()
+                if args is None:
+                    break
+                if not self.__stopped:
+                    self.__migrate(*args)
+        except Exception:
+            if self.__exc_info is None:
+                self.__exc_info = sys.exc_info()
+            self.__stopped = True
+            # Keep consuming the queue so that submit() does not block
+            while self.__queue.get() is not None:
+                pass
+        finally:
+            destroy_context()
+
+    def __join(self):
+        for thread in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
+
+    def submit(self, *args):
+        if self.__exc_info is not None:
+            self.close()
+        self.__queue.put(args)
+
+    def close(self):
+        """
+        Wait for the submitted entries to be migrated and stop the threads.
+        """
+        self.__join()
+        if self.__exc_info is not None:
+            exc_info, self.__exc_info = self.__exc_info, None
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def abort(self):
+        """
+        Stop the threads without migrating the entries still waiting.
+        """
+        self.__stopped = True
+        self.__join()
+
 def construct_filter(template, oc_list):
     oc_subfilter = ''.join([ '(objectclass=%s)' % oc for oc in oc_list])
     return template % oc_subfilter
@@ -625,6 +787,19 @@ class migrate_ds(Command):
             default=_default_scope,
             autofill=True,
         ),
+        Int('workers?',
+            label=_('Workers'),
+            doc=_('Number of entries migrated in parallel (default: 4)'),
+            minvalue=1,
+            default=4,
+            autofill=True,
+        ),
+        Flag('resume?',
+            label=_('Resume'),
+            doc=_('Skip the entries migrated by a previous interrupted '
+                  'migration from the same server and containers'),
+            default=False,
+        ),
     )
 
     has_output = (
@@ -710,9 +885,58 @@ can use their Kerberos accounts.''')
             search_bases[ldap_obj_name] = search_base
         return search_bases
 
-    def migrate(self, ldap, config, ds_ldap, ds_base_dn, options):
+    def _get_checkpoint_key(self, ds_ldap, search_bases, options):
+        """
+        Return a string identifying the source of the migration.
+        """
+        key = [ds_ldap.ldap_uri, options.get('scope')]
+        for ldap_obj_name in self.migrate_order:
+            oc_option = self.migrate_objects[ldap_obj_name]['oc_option']
+            key.append(unicode(search_bases[ldap_obj_name]))
+            key.extend(options[to_cli(oc_option)])
+        return u'\n'.join(key).encode('utf-8')
+
+    def _get_remote_gids(self, ds_ldap, search_base):
+        """
+        Return a dict mapping the GID numbers of the groups in DS to the
+        number of groups with the GID number, or None if the groups cannot
+        be read.
+        """
+        gids = {}
+        try:
+            for entry_attrs in ds_ldap.iter_entries(
+                    '(&(objectclass=posixgroup)(gidnumber=*))', ['gidnumber'],
+                    search_base, page_size=MIGRATION_PAGE_SIZE):
+                for gid in entry_attrs.get('gidnumber', []):
+                    gids[gid] = gids.get(gid, 0) + 1
+        except errors.NotFound:
+            pass
+        except errors.ExecutionError, e:
+            self.log.warning(
+                'Failed to read GID numbers of groups in DS, they will be '
+                'searched for each user: %s', e)
+            return None
+        return gids
+
+    def _report_progress(self, ldap_obj_name, count, start, migration_start):
+        now = datetime.datetime.now()
+        duration = now - start
+        seconds = (duration.days * 86400 + duration.seconds +
+                   duration.microseconds / 1e6)
+        rate = count / seconds if seconds else 0.0
+        api.log.info("%d %ss migrated, %.1f per second. %s elapsed." %
+                     (count, ldap_obj_name, rate, now - migration_start))
+
+    def migrate(self, ldap, config, ds_ldap, ds_base_dn, options,
+                ds_connect=None):
         """
         Migrate objects from DS to LDAP.
+
+        The objects are read from DS page by page and migrated by
+        options['workers'] threads. Each thread connects to IPA with the
+        Kerberos credentials of the request and calls ``ds_connect`` to
+        connect ``ds_ldap`` to DS. Without ``ds_connect`` the objects are
+        migrated in the calling thread.
         """
         assert isinstance(ds_base_dn, DN)
         migrated = {} # {'OBJ': ['PKEY1', 'PKEY2', ...], ...}
@@ -722,146 +946,205 @@ can use their Kerberos accounts.''')
 
         scope = _supported_scopes[options.get('scope')]
 
-        for ldap_obj_name in self.migrate_order:
-            ldap_obj = self.api.Object[ldap_obj_name]
+        workers = options.get('workers') or 1
+        ccache = os.environ.get('KRB5CCNAME')
+        if ds_connect is None or ccache is None:
+            workers = 1
 
-            template = self.migrate_objects[ldap_obj_name]['filter_template']
-            oc_list = options[to_cli(self.migrate_objects[ldap_obj_name]['oc_option'])]
-            search_filter = construct_filter(template, oc_list)
+        def connect_worker():
+            ldap.connect(ccache=ccache)
+            ds_connect()
 
-            exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
-            context = dict(ds_ldap = ds_ldap)
+        checkpoint = MigrationCheckpoint(
+            self._get_checkpoint_key(ds_ldap, search_bases, options),
+            options.get('resume', False))
 
-            migrated[ldap_obj_name] = []
-            failed[ldap_obj_name] = {}
+        try:
+            for ldap_obj_name in self.migrate_order:
+                ldap_obj = self.api.Object[ldap_obj_name]
 
-            try:
-                entries, truncated = ds_ldap.find_entries(
-                    search_filter, ['*'], search_bases[ldap_obj_name],
-                    scope,
-                    time_limit=0, size_limit=-1,
-                    search_refs=True    # migrated DS may contain search references
-                )
-            except errors.NotFound:
-                if not options.get('continue',False):
-                    raise errors.NotFound(
-                        reason=_('%(container)s LDAP search did not return any result '
-                                 '(search base: %(search_base)s, '
-                                 'objectclass: %(objectclass)s)')
-                                 % {'container': ldap_obj_name,
-                                    'search_base': search_bases[ldap_obj_name],
-                                    'objectclass': ', '.join(oc_list)}
-                    )
-                else:
-                    truncated = False
-                    entries = []
-            if truncated:
-                self.log.error(
-                    '%s: %s' % (
-                        ldap_obj.name, self.truncated_err_msg
-                    )
-                )
+                template = self.migrate_objects[ldap_obj_name]['filter_template']
+                oc_list = options[to_cli(self.migrate_objects[ldap_obj_name]['oc_option'])]
+                search_filter = construct_filter(template, oc_list)
 
-            blacklists = {}
-            for blacklist in ('oc_blacklist', 'attr_blacklist'):
-                blacklist_option = self.migrate_objects[ldap_obj_name][blacklist+'_option']
-                if blacklist_option is not None:
-                    blacklists[blacklist] = options.get(blacklist_option, tuple())
-                else:
-                    blacklists[blacklist] = tuple()
+                exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
+                context = dict(ds_ldap = ds_ldap)
 
-            # get default primary group for new users
-            if 'def_group_dn' not in context and options.get('use_def_group'):
-                def_group = config.get('ipadefaultprimarygroup')
-                context['def_group_dn'] = api.Object.group.get_dn(def_group)
-                try:
-                    ldap.get_entry(context['def_group_dn'], ['gidnumber', 'cn'])
-                except errors.NotFound:
-                    error_msg = _('Default group for new users not found')
-                    raise errors.NotFound(reason=error_msg)
-
-            context['has_upg'] = ldap.has_upg()
-
-            valid_gids = set()
-            invalid_gids = set()
-            migrate_cnt = 0
-            context['migrate_cnt'] = 0
-            for entry_attrs in entries:
-                context['migrate_cnt'] = migrate_cnt
-                s = datetime.datetime.now()
-
-                ava = entry_attrs.dn[0][0]
-                if ava.attr == ldap_obj.primary_key.name:
-                    # In case if pkey attribute is in the migrated object DN
-                    # and the original LDAP is multivalued, make sure that
-                    # we pick the correct value (the unique one stored in DN)
-                    pkey = ava.value.lower()
-                else:
-                    pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
+                migrated[ldap_obj_name] = []
+                failed[ldap_obj_name] = {}
 
-                if pkey in exclude:
-                    continue
+                blacklists = {}
+                for blacklist in ('oc_blacklist', 'attr_blacklist'):
+                    blacklist_option = self.migrate_objects[ldap_obj_name][blacklist+'_option']
+                    if blacklist_option is not None:
+                        blacklists[blacklist] = options.get(blacklist_option, tuple())
+                    else:
+                        blacklists[blacklist] = tuple()
 
-                entry_attrs.dn = ldap_obj.get_dn(pkey)
-                entry_attrs['objectclass'] = list(
-                    set(
-                        config.get(
-                            ldap_obj.object_class_config, ldap_obj.object_class
-                        ) + [o.lower() for o in entry_attrs['objectclass']]
+                # get default primary group for new users
+                if 'def_group_dn' not in context and options.get('use_def_group'):
+                    def_group = config.get('ipadefaultprimarygroup')
+                    context['def_group_dn'] = api.Object.group.get_dn(def_group)
+                    try:
+                        ldap.get_entry(context['def_group_dn'], ['gidnumber', 'cn'])
+                    except errors.NotFound:
+                        error_msg = _('Default group for new users not found')
+                        raise errors.NotFound(reason=error_msg)
+
+                context['has_upg'] = ldap.has_upg()
+
+                valid_gids = set()
+                invalid_gids = set()
+                remote_gids = None
+                if ldap_obj_name == 'user':
+                    remote_gids = self._get_remote_gids(
+                        ds_ldap, search_bases['group'])
+
+                def migrate_entry(pkey, entry_attrs):
+                    s = datetime.datetime.now()
+
+                    entry_attrs.dn = ldap_obj.get_dn(pkey)
+                    entry_attrs['objectclass'] = list(
+                        set(
+                            config.get(
+                                ldap_obj.object_class_config, ldap_obj.object_class
+                            ) + [o.lower() for o in entry_attrs['objectclass']]
+                        )
                     )
-                )
-                entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
+                    entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
+
+                    callback = self.migrate_objects[ldap_obj_name]['pre_callback']
+                    if callable(callback):
+                        try:
+                            entry_attrs.dn = callback(
+                                ldap, pkey, entry_attrs.dn, entry_attrs,
+                                failed[ldap_obj_name], config, context,
+                                schema=options['schema'],
+                                search_bases=search_bases,
+                                valid_gids=valid_gids,
+                                invalid_gids=invalid_gids,
+                                remote_gids=remote_gids,
+                                **blacklists
+                            )
+                            if not entry_attrs.dn:
+                                return
+                        except errors.NotFound, e:
+                            failed[ldap_obj_name][pkey] = unicode(e.reason)
+                            return
 
-                callback = self.migrate_objects[ldap_obj_name]['pre_callback']
-                if callable(callback):
                     try:
-                        entry_attrs.dn = callback(
+                        ldap.add_entry(entry_attrs)
+                    except errors.ExecutionError, e:
+                        callback = self.migrate_objects[ldap_obj_name]['exc_callback']
+                        if callable(callback):
+                            try:
+                                callback(
+                                    ldap, entry_attrs.dn, entry_attrs, e, options)
+                            except errors.ExecutionError, e:
+                                failed[ldap_obj_name][pkey] = unicode(e)
+                                return
+                        else:
+                            failed[ldap_obj_name][pkey] = unicode(e)
+                            return
+
+                    migrated[ldap_obj_name].append(pkey)
+                    checkpoint.add(ldap_obj_name, pkey)
+
+                    callback = self.migrate_objects[ldap_obj_name]['post_callback']
+                    if callable(callback):
+                        callback(
                             ldap, pkey, entry_attrs.dn, entry_attrs,
-                            failed[ldap_obj_name], config, context,
-                            schema=options['schema'],
-                            search_bases=search_bases,
-                            valid_gids=valid_gids,
-                            invalid_gids=invalid_gids,
-                            **blacklists
-                        )
-                        if not entry_attrs.dn:
-                            continue
-                    except errors.NotFound, e:
-                        failed[ldap_obj_name][pkey] = unicode(e.reason)
-                        continue
+                            failed[ldap_obj_name], config, context)
+                    e = datetime.datetime.now()
+                    api.log.debug("%s %s migrated, duration: %s (total %s)" % (ldap_obj_name, pkey, e - s, e - migration_start))
+
+                if workers > 1:
+                    pool = _MigrationPool(migrate_entry, connect_worker, workers)
+                    submit = pool.submit
+                else:
+                    pool = None
+                    submit = migrate_entry
 
+                start = datetime.datetime.now()
+                resumed = 0
+                next_report = PROGRESS_INTERVAL
+                entries = ds_ldap.iter_entries(
+                    search_filter, ['*'], search_bases[ldap_obj_name],
+                    scope, time_limit=0,
+                    search_refs=True,   # migrated DS may contain search references
+                    page_size=MIGRATION_PAGE_SIZE,
+                )
                 try:
-                    ldap.add_entry(entry_attrs)
-                except errors.ExecutionError, e:
-                    callback = self.migrate_objects[ldap_obj_name]['exc_callback']
-                    if callable(callback):
+                    while True:
                         try:
-                            callback(
-                                ldap, entry_attrs.dn, entry_attrs, e, options)
-                        except errors.ExecutionError, e:
-                            failed[ldap_obj_name][pkey] = unicode(e)
+                            entry_attrs = next(entries)
+                        except StopIteration:
+                            break
+                        except errors.NotFound:
+                            if not options.get('continue',False):
+                                raise errors.NotFound(
+                                    reason=_('%(container)s LDAP search did not return any result '
+                                             '(search base: %(search_base)s, '
+                                             'objectclass: %(objectclass)s)')
+                                             % {'container': ldap_obj_name,
+                                                'search_base': search_bases[ldap_obj_name],
+                                                'objectclass': ', '.join(oc_list)}
+                                )
+                            break
+                        except errors.LimitsExceeded:
+                            self.log.error(
+                                '%s: %s' % (
+                                    ldap_obj.name, self.truncated_err_msg
+                                )
+                            )
+                            break
+
+                        ava = entry_attrs.dn[0][0]
+                        if ava.attr == ldap_obj.primary_key.name:
+                            # In case if pkey attribute is in the migrated object DN
+                            # and the original LDAP is multivalued, make sure that
+                            # we pick the correct value (the unique one stored in DN)
+                            pkey = ava.value.lower()
+                        else:
+                            pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
+
+                        if pkey in exclude:
                             continue
-                    else:
-                        failed[ldap_obj_name][pkey] = unicode(e)
-                        continue
-
-                migrated[ldap_obj_name].append(pkey)
 
-                callback = self.migrate_objects[ldap_obj_name]['post_callback']
-                if callable(callback):
-                    callback(
-                        ldap, pkey, entry_attrs.dn, entry_attrs,
-                        failed[ldap_obj_name], config, context)
-                e = datetime.datetime.now()
-                d = e - s
-                total_dur = e - migration_start
-                migrate_cnt += 1
-                if migrate_cnt > 0 and migrate_cnt % 100 == 0:
-                    api.log.info("%d %ss migrated. %s elapsed." % (migrate_cnt, ldap_obj_name, total_dur))
-                api.log.debug("%d %ss migrated, duration: %s (total %s)" % (migrate_cnt, ldap_obj_name, d, total_dur))
+                        if (ldap_obj_name, pkey) in checkpoint:
+                            migrated[ldap_obj_name].append(pkey)
+                            resumed += 1
+                            continue
 
-        if 'def_group_dn' in context:
-            _update_default_group(ldap, context, True)
+                        submit(pkey, entry_attrs)
+
+                        migrate_cnt = len(migrated[ldap_obj_name]) - resumed
+                        if migrate_cnt >= next_report:
+                            next_report = (migrate_cnt // PROGRESS_INTERVAL + 1) * PROGRESS_INTERVAL
+                            self._report_progress(
+                                ldap_obj_name, migrate_cnt, start, migration_start)
+                            if ldap_obj_name == 'user' and 'def_group_dn' in context:
+                                _update_default_group(ldap, context, False)
+                except Exception:
+                    if pool is not None:
+                        pool.abort()
+                    raise
+                if pool is not None:
+                    pool.close()
+
+                if resumed:
+                    api.log.info("%d %ss were migrated before resuming." %
+                                 (resumed, ldap_obj_name))
+                self._report_progress(
+                    ldap_obj_name, len(migrated[ldap_obj_name]) - resumed,
+                    start, migration_start)
+
+            if 'def_group_dn' in context:
+                _update_default_group(ldap, context, True)
+        except Exception:
+            checkpoint.close()
+            raise
+        checkpoint.close(remove=True)
 
         return (migrated, failed)
 
@@ -882,18 +1165,28 @@ can use their Kerberos accounts.''')
         ds_ldap = ldap2(shared_instance=False, ldap_uri=ldapuri, base_dn='')
 
         cacert = None
+        tmp_ca_cert_f = None
         if options.get('cacertfile') is not None:
-            #store CA cert into file
+            #store CA cert into file, the migration workers connect with
+            #it too so it is kept until the migration finishes
             tmp_ca_cert_f = write_tmp_file(options['cacertfile'])
             cacert = tmp_ca_cert_f.name
 
-            #start TLS connection
+        def ds_connect():
+            #start TLS connection if the CA cert is set
             ds_ldap.connect(bind_dn=options['binddn'], bind_pw=bindpw,
                 tls_cacertfile=cacert)
 
-            tmp_ca_cert_f.close()
-        else:
-            ds_ldap.connect(bind_dn=options['binddn'], bind_pw=bindpw)
+        try:
+            return self._connect_and_migrate(
+                ldap, config, ds_ldap, ds_connect, ds_base_dn, options)
+        finally:
+            if tmp_ca_cert_f is not None:
+                tmp_ca_cert_f.close()
+
+    def _connect_and_migrate(self, ldap, config, ds_ldap, ds_connect,
+                             ds_base_dn, options):
+        ds_connect()
 
         #check whether the compat plugin is enabled
         if not options.get('compat'):
@@ -921,7 +1214,7 @@ can use their Kerberos accounts.''')
 
         # migrate!
         (migrated, failed) = self.migrate(
-            ldap, config, ds_ldap, ds_base_dn, options
+            ldap, config, ds_ldap, ds_base_dn, options, ds_connect
         )
 
         return dict(result=migrated, failed=failed, enabled=True, compat=True)
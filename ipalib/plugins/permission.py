@@ -26,7 +26,7 @@ from ipalib.parameters import Str, StrEnum, DNParam, Flag
 from ipalib import api, _, ngettext
 from ipalib.plugable import Registry
 from ipalib.capabilities import client_has_capability
-from ipalib.aci import ACI
+from ipalib.aci import parse_aci, get_aci_index, invalidate_aci_index
 from ipapython.dn import DN
 from ipalib.request import context
 
@@ -404,13 +404,14 @@ class permission(baseldap.LDAPObject):
 
         return result
 
-    def postprocess_result(self, entry, options):
+    def postprocess_result(self, entry, options, cached_acientry=None):
         """Update a permission entry for output (in place)
 
         :param entry: The entry to update
         :param options:
             Command options. Contains keys such as ``raw``, ``all``,
             ``pkey_only``, ``version``.
+        :param cached_acientry: See upgrade_permission()
         """
         old_client = not client_has_capability(
             options['version'], 'permissions2')
@@ -474,7 +475,8 @@ class permission(baseldap.LDAPObject):
         if options.get('raw'):
             # Retreive the ACI from LDAP to ensure we get the real thing
             try:
-                acientry, acistring = self._get_aci_entry_and_string(entry)
+                acientry, acistring = self._get_aci_entry_and_string(
+                    entry, cached_acientry=cached_acientry)
             except errors.NotFound:
                 if list(entry.get('ipapermissiontype')) == ['SYSTEM']:
                     # SYSTEM permissions don't have normal ACIs
@@ -602,7 +604,10 @@ class permission(baseldap.LDAPObject):
         except errors.NotFound:
             raise errors.NotFound(reason=_('Entry %s not found') % location)
         entry.setdefault('aci', []).append(acistring)
-        ldap.update_entry(entry)
+        try:
+            ldap.update_entry(entry)
+        finally:
+            invalidate_aci_index(location)
 
     def remove_aci(self, permission_entry):
         """Remove the ACI corresponding to the given permission entry
@@ -649,6 +654,8 @@ class permission(baseldap.LDAPObject):
             ldap.update_entry(acientry)
         except errors.EmptyModlist:
             self.log.info('No changes to ACI')
+        finally:
+            invalidate_aci_index(acidn)
         return acientry, acistring
 
     def _get_aci_entry_and_string(self, permission_entry, name=None,
@@ -677,22 +684,18 @@ class permission(baseldap.LDAPObject):
                 acientry = ldap.get_entry(location, ['aci'])
             except errors.NotFound:
                 acientry = ldap.make_entry(location)
-        acis = acientry.get('aci', ())
-        for acistring in acis:
-            try:
-                aci = ACI(acistring)
-            except SyntaxError as e:
-                self.log.warning('Unparseable ACI %s: %s (at %s)',
-                                 acistring, e, location)
-                continue
-            if aci.name == wanted_aciname:
-                return acientry, acistring
-        else:
-            if notfound_ok:
-                return acientry, None
-            raise errors.NotFound(
-                reason=_('The ACI for permission %(name)s was not found '
-                         'in %(dn)s ') % {'name': name, 'dn': location})
+        index = get_aci_index(location, acientry.get('aci', ()))
+        for acistring, e in index.unparseable:
+            self.log.warning('Unparseable ACI %s: %s (at %s)',
+                             acistring, e, location)
+        matches = index.find(wanted_aciname)
+        if matches:
+            return acientry, matches[0][0]
+        if notfound_ok:
+            return acientry, None
+        raise errors.NotFound(
+            reason=_('The ACI for permission %(name)s was not found '
+                     'in %(dn)s ') % {'name': name, 'dn': location})
 
     def upgrade_permission(self, entry, target_entry=None,
                            output_only=False, cached_acientry=None):
@@ -726,7 +729,7 @@ class permission(baseldap.LDAPObject):
         # (pylint thinks `base` is just a dict, but it's an LDAPEntry)
         assert base.dn == self.api.env.basedn, base  # pylint: disable=E1103
 
-        aci = ACI(acistring)
+        aci = parse_aci(acistring)
 
         if 'target' in aci.target:
             target_entry.single_value['ipapermtarget'] = DN(strip_ldap_prefix(
@@ -740,7 +743,7 @@ class permission(baseldap.LDAPObject):
             target_entry.single_value['ipapermbindruletype'] = u'anonymous'
         else:
             target_entry.single_value['ipapermbindruletype'] = u'permission'
-        target_entry['ipapermright'] = aci.permissions
+        target_entry['ipapermright'] = list(aci.permissions)
         if 'targetattr' in aci.target:
             target_entry['ipapermincludedattr'] = [
                 unicode(a) for a in aci.target['targetattr']['expression']]
@@ -755,7 +758,7 @@ class permission(baseldap.LDAPObject):
 
         # Make sure we're not losing *any info* by the upgrade
         new_acistring = self.make_aci(target_entry)
-        if not ACI(new_acistring).isequal(aci):
+        if not parse_aci(new_acistring).isequal(aci):
             raise ValueError('Cannot convert ACI, %r != %r' % (new_acistring,
                                                                acistring))
 
@@ -1276,6 +1279,7 @@ class permission_find(baseldap.LDAPSearch):
         attribute_options = [o for o in options
                              if (o in self.options and
                                  self.options[o].attribute)]
+        root_entry = None
 
         if not options.get('pkey_only'):
             for entry in entries:
@@ -1350,13 +1354,22 @@ class permission_find(baseldap.LDAPSearch):
                     else:
                         entries.append(entry)
 
+        if (options.get('raw') and not options.get('pkey_only') and
+                root_entry is None):
+            # Retrieve the root entry (with most ACIs) at once
+            try:
+                root_entry = ldap.get_entry(DN(api.env.basedn), ['aci'])
+            except errors.NotFound:
+                pass
+
         for entry in entries:
             if options.get('pkey_only'):
                 for opt_name in entry.keys():
                     if opt_name != self.obj.primary_key.name:
                         del entry[opt_name]
             else:
-                self.obj.postprocess_result(entry, options)
+                self.obj.postprocess_result(entry, options,
+                                            cached_acientry=root_entry)
 
         return truncated
 
@@ -21,11 +21,15 @@ from time import gmtime, strftime
 import string
 import posixpath
 import os
+import sys
+import threading
 from copy import deepcopy
+from ldap import MOD_ADD
 from ipalib import api, errors
 from ipalib import Flag, Int, Password, Str, Bool, StrEnum, DateTime
 from ipalib.plugable import Registry
 from ipalib.plugins.baseldap import LDAPCreate, LDAPQuery, LDAPSearch, DN, entry_to_dict, pkey_to_value
+from ipalib.plugins.baseldap import BULK_SEARCH_SIZE
 from ipalib.plugins import baseldap
 from ipalib.plugins.baseuser import baseuser, baseuser_add, baseuser_del, \
     baseuser_mod, baseuser_find, baseuser_show, \
@@ -33,7 +37,7 @@ from ipalib.plugins.baseuser import baseuser, baseuser_add, baseuser_del, \
     baseuser_pwdchars, fix_addressbook_permission_bindrule, normalize_principal, validate_principal, \
     baseuser_output_params, status_baseuser_output_params
 
-from ipalib.request import context
+from ipalib.request import context, destroy_context
 from ipalib import _, ngettext
 from ipalib import output
 from ipaplatform.paths import paths
@@ -78,6 +82,11 @@ may cause problems for some UNIX systems.
 Use 'ipa config-mod' to change the username format allowed by IPA tools.
 
 
+Many stage users can be activated at once with 'stageuser-activate-bulk'.
+The stage users are selected by login or by an LDAP filter and are all
+validated before any of them is activated. The result of each activation
+is reported separately.
+
 EXAMPLES:
 
  Add a new stageuser:
@@ -86,11 +95,16 @@ EXAMPLES:
  Add a stageuser from the Delete container
    ipa stageuser-add  --first=Tim --last=User --from-delete tuser1
 
+ Activate several stageusers
+   ipa stageuser-activate-bulk tuser1 tuser2 tuser3
+
+ Activate all the stageusers of a department
+   ipa stageuser-activate-bulk --filter='(ou=Sales)'
+
 """)
 
 register = Registry()
 
-
 stageuser_output_params = baseuser_output_params
 
 status_output_params = status_baseuser_output_params
@@ -558,7 +572,8 @@ class stageuser_activate(LDAPQuery):
 
         return(entry_attrs)
 
-    def __merge_values(self, args, options, entry_from, entry_to, attr):
+    def __merge_values(self, args, options, entry_from, entry_to, attr,
+                       active_dns=None):
         '''
         This routine merges the values of attr taken from entry_from, into entry_to.
         If attr is a syntax DN attribute, it is replaced by an empty value. It is a preferable solution
@@ -566,6 +581,7 @@ class stageuser_activate(LDAPQuery):
         An exception of this is for a limited set of syntax DN attribute that we want to
         preserved (defined in preserved_DN_syntax_attrs)
         see http://www.freeipa.org/page/V3/User_Life-Cycle_Management#Adjustment_of_DN_syntax_attributes
+        active_dns is passed to __value_2_add.
         '''
         if not attr in entry_to:
             if isinstance(entry_from[attr], (list, tuple)):
@@ -580,7 +596,7 @@ class stageuser_activate(LDAPQuery):
 
         for value in entry_from[attr]:
                 # merge all the values from->to
-                v = self.__value_2_add(args, options, attr, value)
+                v = self.__value_2_add(args, options, attr, value, active_dns)
                 if (isinstance(v, str) and v in ('', None)) or \
                    (isinstance(v, unicode) and v in (u'', None)):
                     try:
@@ -621,14 +637,15 @@ class stageuser_activate(LDAPQuery):
                         if value:
                             entry_to[attr] = value
 
-    def __value_2_add(self, args, options, attr, value):
+    def __value_2_add(self, args, options, attr, value, active_dns=None):
         '''
         If the attribute is NOT syntax DN it returns its value.
         Else it checks if the value can be preserved.
         To be preserved:
             - attribute must be in preserved_DN_syntax_attrs
             - value must be an active user DN (in Active container)
-            - the active user entry exists
+            - the active user entry exists, if active_dns is not None it
+              must be one of the DNs it contains
         '''
         ldap = self.obj.backend
 
@@ -643,6 +660,10 @@ class stageuser_activate(LDAPQuery):
                     return u''
 
                 # Check that this value is a Active user
+                if active_dns is not None:
+                    if value in active_dns:
+                        return value
+                    return u''
                 try:
                     entry_attrs = self._exc_wrapper(args, options, ldap.get_entry)(value, ['dn'])
                     return value
@@ -653,6 +674,49 @@ class stageuser_activate(LDAPQuery):
         else:
             return value
 
+    def _make_active_entry(self, ldap, staging_dn, active_dn, entry_attrs,
+                           args, options, active_dns=None):
+        """
+        Build the Active entry from the attributes of the Staging entry.
+
+        active_dns is passed to __value_2_add.
+        """
+        new_entry_attrs = self.__dict_new_entry()
+        for attr in entry_attrs:
+            self.__merge_values(args, options, entry_attrs, new_entry_attrs,
+                                attr, active_dns)
+
+        # Allow Managed entry plugin to do its work
+        if 'description' in new_entry_attrs and NO_UPG_MAGIC in new_entry_attrs['description']:
+            new_entry_attrs['description'].remove(NO_UPG_MAGIC)
+
+        for (k,v) in new_entry_attrs.iteritems():
+            self.log.debug("new entry: k=%r and v=%r)"  % (k, v))
+
+        self._build_new_entry(ldap, staging_dn, entry_attrs, new_entry_attrs)
+
+        return ldap.make_entry(active_dn, new_entry_attrs)
+
+    def _move_to_active(self, ldap, staging_dn, entry, args, options):
+        """
+        Add the Active entry and delete the Staging entry.
+
+        If the Staging entry cannot be deleted, the Active entry is deleted
+        again.
+        """
+        self._exc_wrapper(args, options, ldap.add_entry)(entry)
+
+        try:
+            self._exc_wrapper(args, options, ldap.delete_entry)(staging_dn)
+        except:
+            try:
+                self.log.error("Fail to delete the Staging user after activating it %s " % (staging_dn))
+                self._exc_wrapper(args, options, ldap.delete_entry)(entry.dn)
+            except:
+                self.log.error("Fail to cleanup activation. The user remains active %s" % (entry.dn))
+                pass
+            raise
+
     def execute(self, *args, **options):
 
         ldap = self.obj.backend
@@ -685,38 +749,11 @@ class stageuser_activate(LDAPQuery):
         self._check_validy(staging_dn, entry_attrs)
 
         # Time to build the new entry
-        result_entry = {'dn' : active_dn}
-        new_entry_attrs = self.__dict_new_entry()
-        for (attr, values) in entry_attrs.iteritems():
-            self.__merge_values(args, options, entry_attrs, new_entry_attrs, attr)
-            result_entry[attr] = values
+        entry = self._make_active_entry(
+            ldap, staging_dn, active_dn, entry_attrs, args, options)
 
-        # Allow Managed entry plugin to do its work
-        if 'description' in new_entry_attrs and NO_UPG_MAGIC in new_entry_attrs['description']:
-            new_entry_attrs['description'].remove(NO_UPG_MAGIC)
-            if result_entry['description'] == NO_UPG_MAGIC:
-                del result_entry['description']
-
-        for (k,v) in new_entry_attrs.iteritems():
-            self.log.debug("new entry: k=%r and v=%r)"  % (k, v))
-
-        self._build_new_entry(ldap, staging_dn, entry_attrs, new_entry_attrs)
-
-        # Add the Active entry
-        entry = ldap.make_entry(active_dn, new_entry_attrs)
-        self._exc_wrapper(args, options, ldap.add_entry)(entry)
-
-        # Now delete the Staging entry
-        try:
-            self._exc_wrapper(args, options, ldap.delete_entry)(staging_dn)
-        except:
-            try:
-                self.log.error("Fail to delete the Staging user after activating it %s " % (staging_dn))
-                self._exc_wrapper(args, options, ldap.delete_entry)(active_dn)
-            except:
-                self.log.error("Fail to cleanup activation. The user remains active %s" % (active_dn))
-                pass
-            raise
+        # Add the Active entry and delete the Staging entry
+        self._move_to_active(ldap, staging_dn, entry, args, options)
 
         # add the user we just created into the default primary group
         config = ldap.get_ipa_config()
@@ -739,3 +776,257 @@ class stageuser_activate(LDAPQuery):
         return dict(result=result_entry,
                     summary=unicode(_('Stage user %s activated' % staging_dn[0].value)),
                     value=pkey_to_value(args[-1], options))
+
+
+@register()
+class stageuser_activate_bulk(stageuser_activate):
+    __doc__ = _('Activate many stage users.')
+
+    takes_options = (
+        Str('filter?',
+            label=_('Filter'),
+            doc=_('LDAP filter selecting the stage users to activate'),
+        ),
+        Int('workers?',
+            label=_('Workers'),
+            doc=_('Number of stage users activated in parallel (default: 4)'),
+            minvalue=1,
+            default=4,
+            autofill=True,
+        ),
+    )
+
+    has_output = (
+        output.summary,
+        output.Output('result', (list, tuple), _('Results of the activation')),
+        output.Output('count', int, _('Number of activated stage users')),
+        output.Output('value', bool, _('True if all the stage users were activated'), ['no_display']),
+    )
+    has_output_params = ()
+
+    def get_args(self):
+        for arg in super(stageuser_activate_bulk, self).get_args():
+            if arg.name == self.obj.primary_key.name:
+                yield arg.clone(multivalue=True, required=False)
+            else:
+                yield arg
+
+    def _find_by_uid(self, ldap, base_dn, uids, attrs_list):
+        """
+        Return the entries in ``base_dn`` with uid in ``uids``, looked up
+        by searches of up to BULK_SEARCH_SIZE users each.
+        """
+        uids = sorted(set(uids))
+        entries = []
+        for i in xrange(0, len(uids), BULK_SEARCH_SIZE):
+            filter = ldap.make_filter_from_attr(
+                'uid', uids[i:i + BULK_SEARCH_SIZE], rules=ldap.MATCH_ANY)
+            try:
+                result, truncated = ldap.find_entries(
+                    filter, attrs_list, base_dn, ldap.SCOPE_ONELEVEL,
+                    size_limit=0)
+            except errors.NotFound:
+                continue
+            entries.extend(result)
+        return entries
+
+    def _select(self, ldap, uids, filter):
+        """
+        Return the list of (uid, staging DN) of the selected stage users and
+        a dict of their entries keyed by staging DN.
+        """
+        stage_dn = DN(self.obj.container_dn, api.env.basedn)
+        selected = []
+        seen = set()
+        staged = {}
+
+        if uids:
+            for entry in self._find_by_uid(ldap, stage_dn, uids, ['*']):
+                staged[entry.dn] = entry
+            for uid in uids:
+                staging_dn = self.obj.get_dn(uid)
+                if staging_dn not in seen:
+                    seen.add(staging_dn)
+                    selected.append((uid, staging_dn))
+
+        if filter:
+            if not filter.startswith('('):
+                filter = '(%s)' % filter
+            filter = ldap.combine_filters(['(uid=*)', filter],
+                                          rules=ldap.MATCH_ALL)
+            try:
+                entries, truncated = ldap.find_entries(
+                    filter, ['*'], stage_dn, ldap.SCOPE_ONELEVEL,
+                    size_limit=0, paged_search=True)
+            except errors.NotFound:
+                entries, truncated = [], False
+            if truncated:
+                raise errors.LimitsExceeded()
+            for entry in sorted(entries, key=lambda e: e.dn[0].value):
+                if entry.dn not in seen:
+                    seen.add(entry.dn)
+                    staged[entry.dn] = entry
+                    selected.append((entry.dn[0].value, entry.dn))
+
+        return selected, staged
+
+    def _activate_all(self, ldap, jobs, workers, args, options):
+        """
+        Add the Active entries and delete the Staging entries of ``jobs``,
+        a list of (result, staging DN, Active entry), in ``workers``
+        threads with their own connections.
+        """
+        def activate(jobs):
+            for result, staging_dn, entry in jobs:
+                try:
+                    self._move_to_active(ldap, staging_dn, entry, args,
+                                         options)
+                except errors.PublicError, e:
+                    result['error'] = unicode(e)
+                else:
+                    result['value'] = True
+
+        ccache = os.environ.get('KRB5CCNAME')
+        if workers <= 1 or len(jobs) <= 1 or ccache is None:
+            activate(jobs)
+            return
+
+        exc_info = []
+
+        def worker(jobs):
+            try:
+                ldap.connect(ccache=ccache)
+                activate(jobs)
+            except Exception:
+                exc_info.append(sys.exc_info())
+            finally:
+                destroy_context()
+
+        workers = min(workers, len(jobs))
+        threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=worker, args=(jobs[i::workers],),
+                                      name='stageuser_activate-%d' % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if exc_info:
+            raise exc_info[0][0], exc_info[0][1], exc_info[0][2]
+
+    def _add_to_default_group(self, ldap, results):
+        """
+        Add the activated users to the default primary group, up to
+        BULK_SEARCH_SIZE users with one modification.
+        """
+        config = ldap.get_ipa_config()
+        def_primary_group = config.get('ipadefaultprimarygroup')
+        group_dn = self.api.Object['group'].get_dn(def_primary_group)
+
+        for i in xrange(0, len(results), BULK_SEARCH_SIZE):
+            chunk = results[i:i + BULK_SEARCH_SIZE]
+            modlist = [(MOD_ADD, 'member',
+                        ldap.encode([dn for (result, dn) in chunk]))]
+            try:
+                with ldap.error_handler():
+                    ldap.conn.modify_s(str(group_dn), modlist)
+                continue
+            except errors.DatabaseError:
+                # Some of the users are members already, for example
+                # because of an automember rule, add them one by one
+                pass
+            for result, dn in chunk:
+                try:
+                    ldap.add_entry_to_group(dn, group_dn)
+                except errors.AlreadyGroupMember:
+                    pass
+                except errors.PublicError, e:
+                    result['error'] = unicode(e)
+
+    def execute(self, *args, **options):
+        ldap = self.obj.backend
+        uids = args[-1] or ()
+        if not uids and not options.get('filter'):
+            raise errors.RequirementError(name=self.obj.primary_key.name)
+
+        selected, staged = self._select(ldap, uids, options.get('filter'))
+
+        # Look up the users which are already active and the active users
+        # referenced by the preserved DN syntax attributes at once
+        active_dn = DN(api.env.container_user, api.env.basedn)
+        referenced = set(staging_dn[0].value for (uid, staging_dn) in selected)
+        for entry in staged.itervalues():
+            for attr in self.preserved_DN_syntax_attrs:
+                for value in entry.get(attr, []):
+                    if isinstance(value, DN) and self.obj.active_user(value):
+                        referenced.add(value[0].value)
+        active_dns = set(
+            entry.dn for entry in
+            self._find_by_uid(ldap, active_dn, referenced, ['uid']))
+
+        results = []
+        valid = []
+        for uid, staging_dn in selected:
+            result = dict(uid=uid, value=False)
+            results.append(result)
+            try:
+                if staging_dn not in staged:
+                    self.obj.handle_not_found(uid)
+                entry_attrs = dict(
+                    (k.lower(), v) for (k, v) in staged[staging_dn].iteritems())
+
+                user_dn = DN(staging_dn[0], active_dn)
+                if user_dn in active_dns:
+                    raise errors.DuplicateEntry(message=_('Active user %(user)s already exists') % dict(
+                                    user=user_dn))
+
+                self._check_validy(staging_dn, entry_attrs)
+            except errors.PublicError, e:
+                result['error'] = unicode(e)
+                continue
+            valid.append((result, staging_dn, user_dn, entry_attrs))
+
+        # The users activated together may reference each other, for example
+        # a stage user may have another stage user of the batch as manager
+        active_dns.update(user_dn for (result, staging_dn, user_dn,
+                                       entry_attrs) in valid)
+
+        jobs = []
+        for result, staging_dn, user_dn, entry_attrs in valid:
+            try:
+                entry = self._make_active_entry(
+                    ldap, staging_dn, user_dn, entry_attrs, args, options,
+                    active_dns)
+            except errors.PublicError, e:
+                result['error'] = unicode(e)
+                continue
+            jobs.append((result, staging_dn, entry))
+
+        self._activate_all(ldap, jobs, options['workers'], args, options)
+
+        self._add_to_default_group(
+            ldap, [(result, entry.dn) for (result, staging_dn, entry) in jobs
+                   if result['value']])
+
+        count = len([result for result in results if result['value']])
+        return dict(
+            summary=unicode(_('%(count)d of %(total)d stage users activated') %
+                dict(count=count, total=len(results))),
+            result=results,
+            count=count,
+            value=count == len(results),
+        )
+
+    def output_for_cli(self, textui, output, *args, **options):
+        textui.print_summary(output['summary'])
+        for result in output['result']:
+            if result.get('error'):
+                textui.print_indented(u'%s: %s' % (result['uid'], result['error']))
+            else:
+                textui.print_indented(u'%s: %s' % (result['uid'],
+                                                   unicode(_('activated'))))
+
+        # Non-zero unless all the stage users were activated
+        return int(not output['value'])
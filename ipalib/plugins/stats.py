@@ -0,0 +1,90 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+from ipalib import api, Decimal, Int, Str
+from ipalib import output
+from ipalib.plugable import Registry
+from ipalib.plugins.virtual import VirtualCommand
+from ipalib import ngettext
+from ipalib.text import _
+
+if api.env.in_server and api.env.context in ['lite', 'server']:
+    from ipaserver import metrics
+
+__doc__ = _("""
+Command statistics
+
+Show how many times each command was executed by the server and how long the
+executions took. The durations are in milliseconds. The time spent in LDAP
+operations, in requests to the CA and in (un)marshalling the request is
+averaged over all executions of the command.
+
+The statistics are collected by each server process separately since it was
+started, so consecutive calls may show different numbers.
+
+Only administrators are allowed to show the statistics.
+
+EXAMPLES:
+
+ Show command statistics:
+   ipa command-stats
+""")
+
+register = Registry()
+
+
+@register()
+class command_stats(VirtualCommand):
+    __doc__ = _('Show command execution statistics.')
+
+    operation = 'read command statistics'
+
+    has_output = output.standard_list_of_entries
+    has_output_params = (
+        Str('command',
+            label=_('Command'),
+        ),
+        Int('count',
+            label=_('Executions'),
+        ),
+        Int('errors',
+            label=_('Errors'),
+        ),
+        Decimal('p50',
+            label=_('Median duration'),
+        ),
+        Decimal('p95',
+            label=_('95th percentile duration'),
+        ),
+        Decimal('p99',
+            label=_('99th percentile duration'),
+        ),
+        Decimal('ldap',
+            label=_('Average LDAP time'),
+        ),
+        Decimal('ca',
+            label=_('Average CA time'),
+        ),
+        Decimal('marshal',
+            label=_('Average marshal time'),
+        ),
+    )
+
+    msg_summary = ngettext(
+        '%(count)d command executed', '%(count)d commands executed', 0
+    )
+
+    def execute(self, **options):
+        self.check_access()
+
+        result = metrics.command_stats.summary()
+        for entry in result:
+            for key in ('p50', 'p95', 'p99', 'ldap', 'ca', 'marshal'):
+                entry[key] = round(entry[key], 1)
+
+        return dict(
+            result=result,
+            count=len(result),
+            truncated=False,
+        )
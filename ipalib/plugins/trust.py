@@ -472,6 +472,7 @@ sides.
         full_join = self.validate_options(*keys, **options)
         old_range, range_name, dom_sid = self.validate_range(*keys, **options)
         result = self.execute_ad(full_join, *keys, **options)
+        ipaserver.dcerpc.invalidate_trust_cache()
 
         if not old_range:
             # Store the created range type, since for POSIX trusts no
@@ -777,6 +778,11 @@ class trust_del(LDAPDelete):
 
     msg_summary = _('Deleted trust "%(value)s"')
 
+    def post_callback(self, ldap, dn, *keys, **options):
+        if _bindings_installed:
+            ipaserver.dcerpc.invalidate_trust_cache()
+        return True
+
 @register()
 class trust_mod(LDAPUpdate):
     __doc__ = _("""
@@ -1265,6 +1271,11 @@ class trustdomain_add(LDAPCreate):
             entry_attrs['ipanttrustpartner'] = [options['ipanttrustpartner']]
         return dn
 
+    def post_callback(self, ldap, dn, entry_attrs, *keys, **options):
+        if _bindings_installed:
+            ipaserver.dcerpc.invalidate_trust_cache()
+        return dn
+
 @register()
 class trustdomain_del(LDAPDelete):
     __doc__ = _('Remove infromation about the domain associated with the trust.')
@@ -1284,6 +1295,8 @@ class trustdomain_del(LDAPDelete):
             except errors.AlreadyActive:
                 pass
         result = super(trustdomain_del, self).execute(*keys, **options)
+        if _bindings_installed:
+            ipaserver.dcerpc.invalidate_trust_cache()
         result['value'] = pkey_to_value(keys[1], options)
         return result
 
@@ -56,3 +56,73 @@ def destroy_context():
             value.disconnect()
     context.__dict__.clear()
 
+
+def record_duration(name, duration):
+    """
+    Add *duration* seconds to the time spent in *name* during the current
+    request, e.g. ``'ldap'`` for LDAP operations.
+    """
+    durations = context.__dict__.setdefault('durations', {})
+    durations[name] = durations.get(name, 0.0) + duration
+
+
+def get_durations():
+    """
+    Return a ``dict`` with the times recorded by `record_duration()` during
+    the current request.
+    """
+    return dict(context.__dict__.get('durations', {}))
+
+
+def set_command_params(name, params):
+    """
+    Remember the prepared *params* of the command *name* executed by the
+    current request. Commands executed by that command are not remembered.
+    """
+    context.__dict__.setdefault('command_params', (name, params))
+
+
+def get_command_params(name):
+    """
+    Return the params remembered by `set_command_params()` for the command
+    *name* or None if the command did not get as far as preparing them.
+    """
+    command_params = context.__dict__.get('command_params')
+    if command_params is not None and command_params[0] == name:
+        return command_params[1]
+    return None
+
+
+def enable_trace(name):
+    """
+    Start collecting trace records of *name* operations, e.g. ``'ldap'``,
+    during the current request.
+    """
+    context.__dict__.setdefault('traces', {}).setdefault(name, [])
+
+
+def is_traced(name):
+    """
+    Return True if *name* operations are traced in the current request.
+    """
+    return name in context.__dict__.get('traces', {})
+
+
+def record_trace(name, record):
+    """
+    Add the trace *record* of a *name* operation if *name* operations are
+    traced in the current request, see `enable_trace()`.
+    """
+    trace = context.__dict__.get('traces', {}).get(name)
+    if trace is not None:
+        trace.append(record)
+
+
+def get_trace(name):
+    """
+    Return a ``list`` with the trace records of *name* operations collected
+    during the current request or None if they are not traced.
+    """
+    trace = context.__dict__.get('traces', {}).get(name)
+    if trace is not None:
+        return list(trace)
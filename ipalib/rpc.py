@@ -40,6 +40,10 @@ import base64
 import urllib
 import json
 import socket
+import threading
+import time
+import httplib
+import Queue
 from urllib2 import urlparse
 
 from xmlrpclib import (Binary, Fault, DateTime, dumps, loads, ServerProxy,
@@ -74,6 +78,22 @@ from ipalib import api
 COOKIE_NAME = 'ipa_session'
 KEYRING_COOKIE_NAME = '%s_cookie:%%s' % COOKIE_NAME
 
+# Seconds to wait for a server to accept a TCP connection when ranking
+SERVER_PROBE_TIMEOUT = 2
+SERVER_RANKING_FILE = 'server_ranking.json'
+
+# Idle keep-alive connections kept per server
+MAX_IDLE_CONNECTIONS = 4
+# Seconds a connection is kept idle, less than the 5 seconds Apache httpd
+# keeps it open by default, so that requests are not sent on connections
+# the server is closing
+MAX_IDLE_TIME = 4
+
+# Session data of the principals used by this process, kept so that the
+# kernel keyring is not read for every connection
+_session_data = {}
+_session_data_lock = threading.Lock()
+
 errors_by_code = dict((e.errno, e) for e in public_errors)
 
 
@@ -98,13 +118,19 @@ def update_persistent_client_session_data(principal, data):
     except Exception, e:
         raise ValueError(str(e))
 
-    # kernel_keyring only raises ValueError (why??)
-    kernel_keyring.update_key(keyname, data)
+    with _session_data_lock:
+        if _session_data.get(principal) == data:
+            return
+
+        # kernel_keyring only raises ValueError (why??)
+        kernel_keyring.update_key(keyname, data)
+        _session_data[principal] = data
 
 def read_persistent_client_session_data(principal):
     '''
     Given a principal return the stored session data for that
-    principal from the persistent secure storage.
+    principal from the persistent secure storage. The data is kept in
+    memory for the lifetime of the process.
 
     Raises ValueError if unable to perform the action for any reason.
     '''
@@ -114,8 +140,11 @@ def read_persistent_client_session_data(principal):
     except Exception, e:
         raise ValueError(str(e))
 
-    # kernel_keyring only raises ValueError (why??)
-    return kernel_keyring.read_key(keyname)
+    with _session_data_lock:
+        if principal not in _session_data:
+            # kernel_keyring only raises ValueError (why??)
+            _session_data[principal] = kernel_keyring.read_key(keyname)
+        return _session_data[principal]
 
 def delete_persistent_client_session_data(principal):
     '''
@@ -130,8 +159,66 @@ def delete_persistent_client_session_data(principal):
     except Exception, e:
         raise ValueError(str(e))
 
-    # kernel_keyring only raises ValueError (why??)
-    kernel_keyring.del_key(keyname)
+    with _session_data_lock:
+        _session_data.pop(principal, None)
+        # kernel_keyring only raises ValueError (why??)
+        kernel_keyring.del_key(keyname)
+
+def probe_servers(urls, timeout=SERVER_PROBE_TIMEOUT):
+    """
+    Concurrently open a TCP connection to the server of each URL.
+
+    Returns a dict mapping the network location of each URL to the time
+    in seconds it took to connect, or None if the server did not accept
+    the connection within timeout seconds.
+    """
+    rtts = {}
+    threads = []
+
+    def probe(netloc, address):
+        start = time.time()
+        try:
+            sock = socket.create_connection(address, timeout)
+        except (socket.error, socket.timeout):
+            return
+        sock.close()
+        rtts[netloc] = time.time() - start
+
+    for url in urls:
+        parsed = urlparse.urlparse(url)
+        if parsed.netloc in rtts:
+            continue
+        rtts[parsed.netloc] = None
+        if parsed.port:
+            port = parsed.port
+        elif parsed.scheme == 'https':
+            port = 443
+        else:
+            port = 80
+        thread = threading.Thread(target=probe,
+                                  args=(parsed.netloc, (parsed.hostname, port)))
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+
+    deadline = time.time() + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.time(), 0))
+
+    return dict(rtts)
+
+
+def rank_urls(urls, rtts):
+    """
+    Sort URLs by the connection time of their server as returned by
+    `probe_servers`, unresponsive servers last. The original order is
+    kept among servers with the same rank.
+    """
+    def key(url):
+        rtt = rtts.get(urlparse.urlparse(url).netloc)
+        return (rtt is None, rtt)
+    return sorted(urls, key=key)
+
 
 def xml_wrap(value, version):
     """
@@ -388,6 +475,73 @@ def xml_loads(data, encoding='UTF-8'):
         raise decode_fault(e)
 
 
+class ConnectionPool(object):
+    """
+    Idle keep-alive HTTPS connections shared by the transports of a process.
+
+    Connections are stored by a key identifying the server and the NSS
+    database they were created with. At most ``maxidle`` idle connections
+    are kept per key, additional connections are closed. Connections idle
+    for more than ``maxidletime`` seconds are closed instead of reused.
+    """
+
+    def __init__(self, maxidle=MAX_IDLE_CONNECTIONS,
+                 maxidletime=MAX_IDLE_TIME):
+        self.maxidle = maxidle
+        self.maxidletime = maxidletime
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return an idle connection for ``key`` or None.
+        """
+        expired = []
+        conn = None
+        with self.__lock:
+            conns = self.__idle.get(key)
+            if conns:
+                conn, idle_since = conns.pop()
+                if time.time() - idle_since > self.maxidletime:
+                    # The other connections have been idle even longer
+                    expired = [conn] + [c for c, t in conns]
+                    del conns[:]
+                    conn = None
+        for c in expired:
+            c.close()
+        return conn
+
+    def put(self, key, conn):
+        """
+        Store the idle connection ``conn`` for reuse.
+        """
+        with self.__lock:
+            conns = self.__idle.setdefault(key, [])
+            if len(conns) < self.maxidle:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def clear(self, key=None):
+        """
+        Close the idle connections for ``key``, or all idle connections.
+        """
+        with self.__lock:
+            if key is None:
+                conns = sum(self.__idle.values(), [])
+                self.__idle.clear()
+            else:
+                conns = self.__idle.pop(key, [])
+        for conn, idle_since in conns:
+            conn.close()
+
+
+connection_pool = ConnectionPool()
+
+# Serializes NSS initialization by the transports of concurrent threads
+nss_init_lock = threading.Lock()
+
+
 class DummyParser(object):
     def __init__(self):
         self.data = ''
@@ -452,6 +606,13 @@ class LanguageAwareTransport(MultiProtocolTransport):
 class SSLTransport(LanguageAwareTransport):
     """Handles an HTTPS transaction to an XML-RPC server."""
 
+    # Whether the current connection was used for a previous request
+    _reused = False
+    # Whether the current request was sent to the server
+    _sent = False
+    # When the current connection finished its last request
+    _idle_since = None
+
     def get_connection_dbdir(self):
         """
         If there is a connections open it may have already initialized
@@ -475,27 +636,49 @@ class SSLTransport(LanguageAwareTransport):
 
         if sys.version_info >= (2, 7):
             if self._connection and host == self._connection[0]:
-                return self._connection[1]
+                if (self._idle_since is not None and
+                        time.time() - self._idle_since <= MAX_IDLE_TIME):
+                    self._reused = True
+                    return self._connection[1]
+                # The server may be closing the connection
+                self.close()
 
         dbdir = getattr(context, 'nss_dir', paths.IPA_NSSDB_DIR)
-        connection_dbdir = self.get_connection_dbdir()
+        pooled = sys.version_info >= (2, 7) and api.env.rpc_connection_pool
 
-        if connection_dbdir:
-            # If an existing connection is already using the same NSS
-            # database there is no need to re-initialize.
-            no_init = dbdir == connection_dbdir
+        if pooled:
+            conn = connection_pool.get((host, dbdir))
+            if conn is not None:
+                self.dbdir = dbdir
+                self._reused = True
+                self._connection = host, conn
+                return conn
+        self._reused = False
 
-        else:
-            # If the NSS database is already being used there is no
-            # need to re-initialize.
-            no_init = dbdir == ipapython.nsslib.current_dbdir
+        with nss_init_lock:
+            connection_dbdir = self.get_connection_dbdir()
 
-        if sys.version_info < (2, 7):
-            conn = NSSHTTPS(host, 443, dbdir=dbdir, no_init=no_init)
-        else:
-            conn = NSSConnection(host, 443, dbdir=dbdir, no_init=no_init,
-                                 tls_version_min=api.env.tls_version_min,
-                                 tls_version_max=api.env.tls_version_max)
+            if connection_dbdir:
+                # If an existing connection is already using the same NSS
+                # database there is no need to re-initialize.
+                no_init = dbdir == connection_dbdir
+
+            else:
+                # If the NSS database is already being used there is no
+                # need to re-initialize.
+                no_init = dbdir == ipapython.nsslib.current_dbdir
+
+            if not no_init:
+                # Idle connections would prevent NSS from shutting down
+                connection_pool.clear()
+
+            if sys.version_info < (2, 7):
+                conn = NSSHTTPS(host, 443, dbdir=dbdir, no_init=no_init)
+            else:
+                conn = NSSConnection(host, 443, dbdir=dbdir, no_init=no_init,
+                                     tls_version_min=api.env.tls_version_min,
+                                     tls_version_max=api.env.tls_version_max,
+                                     resume_sessions=pooled)
         self.dbdir=dbdir
 
         conn.connect()
@@ -505,12 +688,57 @@ class SSLTransport(LanguageAwareTransport):
             self._connection = host, conn
             return self._connection[1]
 
+    def send_content(self, connection, request_body):
+        LanguageAwareTransport.send_content(self, connection, request_body)
+        self._sent = True
+
+    def request(self, host, handler, request_body, verbose=0):
+        self._sent = False
+        try:
+            response = self.single_request(
+                host, handler, request_body, verbose)
+        except (NSPRError, socket.error, httplib.BadStatusLine):
+            # Once the request was sent the server may have executed it,
+            # so it is only safe to retry requests which failed before
+            if not self._reused or self._sent:
+                raise
+        else:
+            self._idle_since = time.time()
+            return response
+        # The server closed the kept alive connection, the other idle
+        # connections are likely closed too. Retry on a new connection.
+        self.close()
+        connection_pool.clear()
+        self._sent = False
+        response = self.single_request(host, handler, request_body, verbose)
+        self._idle_since = time.time()
+        return response
+
+    def release(self):
+        """
+        Close the connection, or keep it open for reuse by other transports
+        of this process if rpc_connection_pool is enabled.
+        """
+        host, conn = self._connection
+        if conn is None:
+            return
+        if api.env.rpc_connection_pool:
+            self._connection = (None, None)
+            connection_pool.put((host, self.dbdir), conn)
+        else:
+            self.close()
+
 
 class KerbTransport(SSLTransport):
     """
     Handles Kerberos Negotiation authentication to an XML-RPC server.
     """
     flags = kerberos.GSS_C_MUTUAL_FLAG | kerberos.GSS_C_SEQUENCE_FLAG
+    use_session = True
+
+    def __init__(self, protocol, session_path=None):
+        SSLTransport.__init__(self, protocol)
+        self.session_path = session_path
 
     def _handle_exception(self, e, service=None):
         (major, minor) = ipautil.get_gsserror(e)
@@ -568,11 +796,21 @@ class KerbTransport(SSLTransport):
 
         return (host, extra_headers, x509)
 
+    def send_request(self, connection, handler, request_body):
+        if self.session_path and getattr(context, 'session_cookie', None):
+            # Requests authenticated by the session cookie must use the
+            # session URI
+            handler = self.session_path
+        SSLTransport.send_request(self, connection, handler, request_body)
+
     def single_request(self, host, handler, request_body, verbose=0):
+        # Keep the connection alive for the following requests, unless the
+        # server refused the request
         try:
             return SSLTransport.single_request(self, host, handler, request_body, verbose)
-        finally:
+        except ProtocolError:
             self.close()
+            raise
 
     def store_session_cookie(self, cookie_header):
         '''
@@ -621,6 +859,11 @@ class KerbTransport(SSLTransport):
             # Not fatal, we just can't use the session cookie we were sent.
             pass
 
+        if self.use_session and self.session_path:
+            # Authenticate the following requests with the session cookie
+            # instead of a new GSSAPI negotiation
+            setattr(context, 'session_cookie', session_cookie.http_cookie())
+
     def parse_response(self, response):
         self.store_session_cookie(response.getheader('Set-Cookie'))
         return SSLTransport.parse_response(self, response)
@@ -633,6 +876,8 @@ class DelegatedKerbTransport(KerbTransport):
     """
     flags = kerberos.GSS_C_DELEG_FLAG |  kerberos.GSS_C_MUTUAL_FLAG | \
             kerberos.GSS_C_SEQUENCE_FLAG
+    # The server needs the delegated credentials with every request
+    use_session = False
 
 
 class RPCClient(Connectible):
@@ -681,6 +926,83 @@ class RPCClient(Connectible):
 
         return servers
 
+    def get_server_ranking_file(self):
+        return os.path.join(self.env.dot_ipa, SERVER_RANKING_FILE)
+
+    def read_server_ranking(self, urls):
+        """
+        Return the cached server connection times for the current domain
+        if they are still valid and cover all the given URLs, otherwise
+        None.
+        """
+        try:
+            with open(self.get_server_ranking_file()) as f:
+                ranking = json.load(f)[self.env.domain]
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+        if ranking.get('expiration', 0) < time.time():
+            return None
+        rtts = ranking.get('servers', {})
+        for url in urls:
+            if urlparse.urlparse(url).netloc not in rtts:
+                return None
+
+        return rtts
+
+    def write_server_ranking(self, rtts):
+        """
+        Store the server connection times for the current domain, keeping
+        the rankings of other domains. Pass None to drop the ranking.
+        """
+        filename = self.get_server_ranking_file()
+        try:
+            with open(filename) as f:
+                rankings = json.load(f)
+            if not isinstance(rankings, dict):
+                rankings = {}
+        except (IOError, ValueError):
+            rankings = {}
+
+        if rtts is None:
+            if rankings.pop(self.env.domain, None) is None:
+                return
+        else:
+            rankings[self.env.domain] = {
+                'expiration': time.time() + self.env.server_ranking_ttl,
+                'servers': rtts,
+            }
+
+        try:
+            if not os.path.isdir(self.env.dot_ipa):
+                os.makedirs(self.env.dot_ipa, 0700)
+            tmpname = '%s.%d' % (filename, os.getpid())
+            with open(tmpname, 'w') as f:
+                json.dump(rankings, f)
+            os.rename(tmpname, filename)
+        except (IOError, OSError), e:
+            self.log.debug("failed to store server ranking in %s: %s",
+                           filename, e)
+
+    def rank_url_list(self, urls):
+        """
+        Order the URLs by the responsiveness of their servers.
+
+        The servers are probed concurrently and the result is cached for
+        server_ranking_ttl seconds so that subsequent invocations do not
+        have to wait for dead servers.
+        """
+        rtts = None
+        if self.env.server_ranking_ttl > 0:
+            rtts = self.read_server_ranking(urls)
+        if rtts is None:
+            rtts = probe_servers(urls)
+            self.log.debug('server connection times: %s', rtts)
+            if self.env.server_ranking_ttl > 0:
+                self.write_server_ranking(rtts)
+
+        return rank_urls(urls, rtts)
+
     def get_session_cookie_from_persistent_storage(self, principal):
         '''
         Retrieves the session cookie for the given principal from the
@@ -785,6 +1107,8 @@ class RPCClient(Connectible):
         if nss_dir:
             context.nss_dir = nss_dir
         urls = self.get_url_list(rpc_uri)
+        if len(urls) > 1:
+            urls = self.rank_url_list(urls)
         serverproxy = None
         for url in urls:
             kw = dict(allow_none=True, encoding='UTF-8')
@@ -794,9 +1118,11 @@ class RPCClient(Connectible):
                     transport_class = DelegatedKerbTransport
                 else:
                     transport_class = KerbTransport
+                kw['transport'] = transport_class(
+                    protocol=self.protocol, session_path=self.session_path)
             else:
-                transport_class = LanguageAwareTransport
-            kw['transport'] = transport_class(protocol=self.protocol)
+                kw['transport'] = LanguageAwareTransport(
+                    protocol=self.protocol)
             self.log.info('trying %s' % url)
             setattr(context, 'request_url', url)
             serverproxy = self.server_proxy_class(url, **kw)
@@ -844,6 +1170,8 @@ class RPCClient(Connectible):
                 else:
                     self.log.info('Connection to %s failed with %s', url, e)
                 serverproxy = None
+            # The cached ranking is stale, probe again next time
+            self.write_server_ranking(None)
 
         if serverproxy is None:
             raise NetworkError(uri=_('any of the configured servers'),
@@ -855,7 +1183,10 @@ class RPCClient(Connectible):
             conn = getattr(context, self.id, None)
             if conn is not None:
                 conn = conn.conn._ServerProxy__transport
-                conn.close()
+                if isinstance(conn, SSLTransport):
+                    conn.release()
+                else:
+                    conn.close()
 
     def _call_command(self, command, params):
         """Call the command with given params"""
@@ -1021,3 +1352,116 @@ class jsonclient(RPCClient):
     server_proxy_class = JSONServerProxy
     protocol = 'json'
     env_rpc_uri_key = 'jsonrpc_uri'
+
+
+class CommandFuture(object):
+    """
+    Result of a command submitted to `AsyncClient`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.__done = threading.Event()
+        self.__result = None
+        self.__exc_info = None
+
+    def set_result(self, result):
+        self.__result = result
+        self.__done.set()
+
+    def set_exception(self, exc_info):
+        self.__exc_info = exc_info
+        self.__done.set()
+
+    def done(self):
+        """
+        Return True if the command has finished.
+        """
+        return self.__done.is_set()
+
+    def result(self):
+        """
+        Wait for the command to finish and return its result, or raise the
+        exception raised by the command.
+        """
+        self.__done.wait()
+        if self.__exc_info is not None:
+            raise self.__exc_info[0], self.__exc_info[1], self.__exc_info[2]
+        return self.__result
+
+
+class AsyncClient(object):
+    """
+    Run several commands on the server at the same time.
+
+    Commands are run by a pool of worker threads, each with its own
+    connection to the server, so up to ``workers`` requests are in flight
+    at once. The connections authenticate with the session cookie of the
+    process once it has been obtained.
+
+    For example:
+
+    >>> with AsyncClient(api, workers=4) as client:  # doctest: +SKIP
+    ...     futures = [client.submit('user_show', uid) for uid in uids]
+    ...     users = [f.result() for f in futures]
+    """
+
+    def __init__(self, api, workers=4):
+        self.api = api
+        self.__queue = Queue.Queue()
+        self.__threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.__worker,
+                                      name='AsyncClient-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __worker(self):
+        backend = self.api.Backend.rpcclient
+        try:
+            while True:
+                item = self.__queue.get()
+                if item is None:
+                    break
+                future, args, options = item
+                try:
+                    if not backend.isconnected():
+                        backend.connect(verbose=self.api.env.verbose,
+                                        fallback=self.api.env.fallback,
+                                        delegate=self.api.env.delegate)
+                    result = self.api.Command[future.name](*args, **options)
+                except Exception:
+                    future.set_exception(sys.exc_info())
+                else:
+                    future.set_result(result)
+        finally:
+            if backend.isconnected():
+                backend.disconnect()
+
+    def submit(self, _name, *args, **options):
+        """
+        Queue the command ``_name`` and return a `CommandFuture` for its
+        result.
+        """
+        if not self.__threads:
+            raise RuntimeError('AsyncClient is closed')
+        future = CommandFuture(_name)
+        self.__queue.put((future, args, options))
+        return future
+
+    def close(self):
+        """
+        Wait for the queued commands to finish and stop the workers.
+        """
+        for thread in self.__threads:
+            self.__queue.put(None)
+        for thread in self.__threads:
+            thread.join()
+        self.__threads = []
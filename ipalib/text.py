@@ -112,19 +112,109 @@ For additional details, see `GettextFactory` and `Gettext`, and for plural
 forms, see `NGettextFactory` and `NGettext`.
 """
 
+import os
 import threading
 import locale
 import gettext
+import collections
 from request import context
 
+# Number of translations kept by get_translation()
+TRANSLATION_CACHE_SIZE = 32
+# Number of messages memoized by a cached translation
+MESSAGE_CACHE_SIZE = 4096
+
+_translations = collections.OrderedDict()
+_translations_lock = threading.Lock()
+
+
+class CachedTranslation(object):
+    """
+    A gettext translation which memoizes the translated messages.
+
+    Instances are shared by all threads, see `get_translation()`.
+    """
+
+    __slots__ = ('translation', 'messages')
+
+    def __init__(self, translation):
+        self.translation = translation
+        self.messages = {}
+
+    def ugettext(self, message):
+        try:
+            return self.messages[message]
+        except KeyError:
+            pass
+        translated = self.translation.ugettext(message)
+        if len(self.messages) < MESSAGE_CACHE_SIZE:
+            self.messages[message] = translated
+        return translated
+
+    def ungettext(self, singular, plural, n):
+        key = (singular, plural, n)
+        try:
+            return self.messages[key]
+        except KeyError:
+            pass
+        translated = self.translation.ungettext(singular, plural, n)
+        if len(self.messages) < MESSAGE_CACHE_SIZE:
+            self.messages[key] = translated
+        return translated
+
+
+def get_translation(domain, localedir, languages=None):
+    """
+    Return the `CachedTranslation` for *domain*, *localedir* and *languages*.
+
+    The last TRANSLATION_CACHE_SIZE translations are kept for the whole
+    process, so the message catalogs are not looked up again for every
+    request. If *languages* is ``None``, the languages are taken from the
+    environment, as ``gettext.translation()`` does.
+    """
+    if languages is None:
+        for envar in ('LANGUAGE', 'LC_ALL', 'LC_MESSAGES', 'LANG'):
+            value = os.environ.get(envar)
+            if value:
+                languages = value.split(':')
+                break
+        else:
+            languages = ['C']
+    key = (domain, localedir, tuple(languages))
+
+    with _translations_lock:
+        translation = _translations.pop(key, None)
+        if translation is not None:
+            # Move to the end, the least recently used is the first one
+            _translations[key] = translation
+            return translation
+
+    translation = CachedTranslation(gettext.translation(domain,
+        localedir=localedir,
+        languages=list(languages),
+        fallback=True,
+    ))
+
+    with _translations_lock:
+        _translations[key] = translation
+        while len(_translations) > TRANSLATION_CACHE_SIZE:
+            _translations.popitem(last=False)
+    return translation
+
+
+def clear_translations():
+    """
+    Forget all translations kept by `get_translation()`.
+    """
+    with _translations_lock:
+        _translations.clear()
+
 
 def create_translation(key):
     assert key not in context.__dict__
     (domain, localedir) = key
-    translation = gettext.translation(domain,
-        localedir=localedir,
+    translation = get_translation(domain, localedir,
         languages=getattr(context, 'languages', None),
-        fallback=True,
     )
     context.__dict__[key] = translation
     return translation
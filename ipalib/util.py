@@ -23,6 +23,7 @@ Various utility functions.
 
 import os
 import imp
+import hashlib
 import time
 import socket
 import re
@@ -322,6 +323,44 @@ def validate_sshpubkey_no_options(ugettext, value):
     if pubkey.has_options():
         return _('options are not allowed')
 
+# OpenSSH form and fingerprint of SSH public keys by the SHA-1 hash of the
+# key. The cache is cleared when it grows over MAX_CACHED_SSH_KEYS entries.
+MAX_CACHED_SSH_KEYS = 10000
+_ssh_key_cache = {}
+
+
+def convert_sshpubkey(pubkey):
+    """
+    Return the OpenSSH form and the fingerprint of the SSH public key
+    ``pubkey``, or None if it is not a valid key.
+    """
+    if isinstance(pubkey, unicode):
+        key = (unicode, hashlib.sha1(pubkey.encode('utf-8')).digest())
+    else:
+        key = (str, hashlib.sha1(pubkey).digest())
+    try:
+        return _ssh_key_cache[key]
+    except KeyError:
+        pass
+
+    try:
+        pubkey = SSHPublicKey(pubkey)
+    except (ValueError, UnicodeDecodeError):
+        result = None
+    else:
+        fp = pubkey.fingerprint_hex_md5()
+        comment = pubkey.comment()
+        if comment:
+            fp = u'%s %s' % (fp, comment)
+        fp = u'%s (%s)' % (fp, pubkey.keytype())
+        result = (pubkey.openssh(), fp)
+
+    if len(_ssh_key_cache) >= MAX_CACHED_SSH_KEYS:
+        _ssh_key_cache.clear()
+    _ssh_key_cache[key] = result
+    return result
+
+
 def convert_sshpubkey_post(ldap, dn, entry_attrs):
     if 'ipasshpubkey' in entry_attrs:
         pubkeys = entry_attrs['ipasshpubkey']
@@ -334,19 +373,11 @@ def convert_sshpubkey_post(ldap, dn, entry_attrs):
     newpubkeys = []
     fingerprints = []
     for pubkey in pubkeys:
-        try:
-            pubkey = SSHPublicKey(pubkey)
-        except ValueError, UnicodeDecodeError:
+        converted = convert_sshpubkey(pubkey)
+        if converted is None:
             continue
-
-        fp = pubkey.fingerprint_hex_md5()
-        comment = pubkey.comment()
-        if comment:
-            fp = u'%s %s' % (fp, comment)
-        fp = u'%s (%s)' % (fp, pubkey.keytype())
-
-        newpubkeys.append(pubkey.openssh())
-        fingerprints.append(fp)
+        newpubkeys.append(converted[0])
+        fingerprints.append(converted[1])
 
     if 'ipasshpubkey' in entry_attrs:
         entry_attrs['ipasshpubkey'] = newpubkeys or None
@@ -25,6 +25,7 @@ This base platform module exports default filesystem paths.
 class BasePathNamespace(object):
     BASH = "/bin/bash"
     BIN_FALSE = "/bin/false"
+    GZIP = "/bin/gzip"
     BIN_HOSTNAME = "/bin/hostname"
     LS = "/bin/ls"
     PKICREATE = "/bin/pkicreate"
@@ -176,6 +177,7 @@ class BasePathNamespace(object):
     ODS_SIGNER = "/usr/sbin/ods-signer"
     OPENSSL = "/usr/bin/openssl"
     PERL = "/usr/bin/perl"
+    PIGZ = "/usr/bin/pigz"
     PK12UTIL = "/usr/bin/pk12util"
     PKI_SETUP_PROXY = "/usr/bin/pki-setup-proxy"
     PKICREATE = "/usr/bin/pkicreate"
@@ -272,7 +274,9 @@ class BasePathNamespace(object):
     IPA_CLIENT_SYSRESTORE = "/var/lib/ipa-client/sysrestore"
     SYSRESTORE_INDEX = "/var/lib/ipa-client/sysrestore/sysrestore.index"
     IPA_BACKUP_DIR = "/var/lib/ipa/backup"
+    IPA_CERT_EXPIRY_INDEX = "/var/lib/ipa/certexpiry/index.json"
     IPA_DNSSEC_DIR = "/var/lib/ipa/dnssec"
+    IPA_MIGRATION_DIR = "/var/lib/ipa/migration"
     DNSSEC_TOKENS_DIR = "/var/lib/ipa/dnssec/tokens"
     DNSSEC_SOFTHSM_PIN = "/var/lib/ipa/dnssec/softhsm_pin"
     IPA_CA_CSR = "/var/lib/ipa/ca.csr"
@@ -18,15 +18,20 @@
 #
 
 import os
+import socket
+import time
 import httplib
 import xml.dom.minidom
 import ConfigParser
 from urllib import urlencode
 
 import nss.nss as nss
+from nss.error import NSPRError
 
 from ipalib import api, errors
 from ipalib.errors import NetworkError
+from ipalib.rpc import connection_pool, nss_init_lock
+from ipalib.request import record_duration
 from ipalib.text import _
 from ipapython import nsslib, ipautil
 from ipaplatform.paths import paths
@@ -239,11 +244,18 @@ def ca_status(ca_host=None, use_proxy=True):
 
 
 def https_request(host, port, url, secdir, password, nickname,
-        method='POST', headers=None, body=None, **kw):
+        method='POST', headers=None, body=None, pooled=False,
+        idempotent=None, **kw):
     """
     :param method: HTTP request method (defalut: 'POST')
     :param url: The path (not complete URL!) to post to.
     :param body: The request body (encodes kw if None)
+    :param pooled: Keep the connection open and reuse kept connections to
+                   the same server, see `ipalib.rpc.ConnectionPool`. Only
+                   long running processes which do not re-initialize NSS
+                   should use this.
+    :param idempotent: Whether the request may be sent again when a kept
+                       connection fails, see `_httplib_request()`.
     :param kw:  Keyword arguments to encode into POST body.
     :return:   (http_status, http_reason_phrase, http_headers, http_body)
                as (integer, unicode, dict, str)
@@ -252,9 +264,17 @@ def https_request(host, port, url, secdir, password, nickname,
     """
 
     def connection_factory(host, port):
-        conn = nsslib.NSSConnection(host, port, dbdir=secdir,
-                                    tls_version_min=api.env.tls_version_min,
-                                    tls_version_max=api.env.tls_version_max)
+        with nss_init_lock:
+            # Pooled connections share the NSS database, the others
+            # re-initialize NSS, which requires all connections to be closed
+            no_init = pooled and secdir == nsslib.current_dbdir
+            if not no_init:
+                connection_pool.clear()
+            conn = nsslib.NSSConnection(
+                host, port, dbdir=secdir, no_init=no_init,
+                tls_version_min=api.env.tls_version_min,
+                tls_version_max=api.env.tls_version_max,
+                resume_sessions=pooled)
         conn.set_debuglevel(0)
         conn.connect()
         conn.sock.set_client_auth_data_callback(
@@ -262,11 +282,17 @@ def https_request(host, port, url, secdir, password, nickname,
             nickname, password, nss.get_default_certdb())
         return conn
 
+    if pooled:
+        pool_key = ('dogtag', host, port, secdir, nickname)
+    else:
+        pool_key = None
+
     if body is None:
         body = urlencode(kw)
     return _httplib_request(
         'https', host, port, url, connection_factory, body,
-        method=method, headers=headers)
+        method=method, headers=headers, pool_key=pool_key,
+        idempotent=idempotent)
 
 
 def http_request(host, port, url, **kw):
@@ -299,12 +325,19 @@ def unauthenticated_https_request(host, port, url, **kw):
 
 def _httplib_request(
         protocol, host, port, path, connection_factory, request_body,
-        method='POST', headers=None):
+        method='POST', headers=None, pool_key=None, idempotent=None):
     """
     :param request_body: Request body
     :param connection_factory: Connection class to use. Will be called
         with the host and port arguments.
     :param method: HTTP request method (default: 'POST')
+    :param pool_key: If not None, take an idle connection stored under this
+        key from the connection pool and store the connection there after
+        the request if the server keeps it open.
+    :param idempotent: Whether the request may be sent again on a new
+        connection when the kept connection fails after the request was
+        sent. Requests which change anything must not be, the server may
+        have executed them. Defaults to True for GET requests only.
 
     Perform a HTTP(s) request.
     """
@@ -321,18 +354,46 @@ def _httplib_request(
     ):
         headers['content-type'] = 'application/x-www-form-urlencoded'
 
+    start = time.time()
+    sent = False
     try:
-        conn = connection_factory(host, port)
-        conn.request(method, uri, body=request_body, headers=headers)
-        res = conn.getresponse()
+        conn = None
+        if pool_key is not None:
+            conn = connection_pool.get(pool_key)
+        if conn is not None:
+            if idempotent is None:
+                idempotent = method == 'GET'
+            try:
+                conn.request(method, uri, body=request_body, headers=headers)
+                sent = True
+                res = conn.getresponse()
+            except (NSPRError, socket.error, httplib.BadStatusLine):
+                # The server closed the kept alive connection, the other
+                # idle connections are likely closed too.
+                conn.close()
+                connection_pool.clear(pool_key)
+                conn = None
+                # Retry on a new connection, unless the server may have
+                # executed the request
+                if sent and not idempotent:
+                    raise
+        if conn is None:
+            conn = connection_factory(host, port)
+            conn.request(method, uri, body=request_body, headers=headers)
+            res = conn.getresponse()
 
         http_status = res.status
         http_reason_phrase = unicode(res.reason, 'utf-8')
         http_headers = res.msg.dict
         http_body = res.read()
-        conn.close()
+        if pool_key is not None and not res.will_close:
+            connection_pool.put(pool_key, conn)
+        else:
+            conn.close()
     except Exception, e:
         raise NetworkError(uri=uri, error=str(e))
+    finally:
+        record_duration('ca', time.time() - start)
 
     root_logger.debug('request status %d',        http_status)
     root_logger.debug('request reason_phrase %r', http_reason_phrase)
@@ -39,6 +39,7 @@ import ldapurl
 
 from ipalib import errors, _
 from ipalib.constants import LDAP_GENERALIZED_TIME_FORMAT
+from ipalib.request import record_duration, is_traced, record_trace
 from ipapython import ipautil
 from ipapython.ipautil import (
     format_netloc, wait_for_open_socket, wait_for_open_ports, CIDict)
@@ -52,6 +53,13 @@ SASL_GSSAPI = ldap.sasl.sasl({}, 'GSSAPI')
 DEFAULT_TIMEOUT = 10
 _debug_log_ldap = False
 
+# Names of search scopes in LDAP operation trace records
+_scope_names = {
+    ldap.SCOPE_BASE: 'base',
+    ldap.SCOPE_ONELEVEL: 'onelevel',
+    ldap.SCOPE_SUBTREE: 'subtree',
+}
+
 _missing = object()
 
 # Autobind modes
@@ -918,10 +926,31 @@ class LDAPClient(object):
             self.log.debug('ldap.result: %s', ipa_result)
         return ipa_result
 
+    def _trace(self, operation, dn, **kwargs):
+        """
+        Return a trace record of an LDAP operation on ``dn`` if LDAP
+        operations are traced in the current request, None otherwise.
+
+        Pass the record to `error_handler()` to have the duration of the
+        operation added to it and the record added to the trace, see
+        `ipalib.request.enable_trace()`.
+        """
+        if not is_traced('ldap'):
+            return None
+        kwargs['operation'] = operation
+        kwargs['dn'] = unicode(dn)
+        return kwargs
+
     @contextlib.contextmanager
-    def error_handler(self, arg_desc=None):
+    def error_handler(self, arg_desc=None, trace=None):
         """Context manager that handles LDAPErrors
+
+        The time spent in the block is recorded as ``'ldap'`` time of the
+        current request, see `ipalib.request.record_duration()`. If ``trace``
+        is a record returned by `_trace()`, it is recorded with the time as
+        well.
         """
+        start = time.time()
         try:
             try:
                 yield
@@ -991,6 +1020,12 @@ class LDAPClient(object):
             self.log.debug(
                 'Unhandled LDAPError: %s: %s' % (type(e).__name__, str(e)))
             raise errors.DatabaseError(desc=desc, info=info)
+        finally:
+            duration = time.time() - start
+            record_duration('ldap', duration)
+            if trace is not None:
+                trace['duration'] = duration
+                record_trace('ldap', trace)
 
     @property
     def schema(self):
@@ -1052,10 +1087,11 @@ class LDAPClient(object):
         """
         Perform simple bind operation.
         """
-        with self.error_handler():
+        if bind_dn is None:
+            bind_dn = DN()
+        trace = self._trace('bind', bind_dn, mechanism='simple')
+        with self.error_handler(trace=trace):
             self._flush_schema()
-            if bind_dn is None:
-                bind_dn = DN()
             assert isinstance(bind_dn, DN)
             bind_dn = str(bind_dn)
             bind_password = self.encode(bind_password)
@@ -1067,7 +1103,8 @@ class LDAPClient(object):
         """
         Perform SASL bind operation using the SASL EXTERNAL mechanism.
         """
-        with self.error_handler():
+        trace = self._trace('bind', DN(), mechanism='EXTERNAL')
+        with self.error_handler(trace=trace):
             auth_tokens = ldap.sasl.external(user_name)
             self._flush_schema()
             self._conn.sasl_interactive_bind_s(
@@ -1077,7 +1114,8 @@ class LDAPClient(object):
         """
         Perform SASL bind operation using the SASL GSSAPI mechanism.
         """
-        with self.error_handler():
+        trace = self._trace('bind', DN(), mechanism='GSSAPI')
+        with self.error_handler(trace=trace):
             auth_tokens = ldap.sasl.sasl({}, 'GSSAPI')
             self._flush_schema()
             self._conn.sasl_interactive_bind_s(
@@ -1320,8 +1358,12 @@ class LDAPClient(object):
         if page_size == 0:
             paged_search = False
 
+        trace = self._trace('search', base_dn,
+                            scope=_scope_names.get(scope, scope),
+                            filter=filter, attrs=attrs_list)
+
         # pass arguments to python-ldap
-        with self.error_handler():
+        with self.error_handler(trace=trace):
             filter = self.encode(filter)
             attrs_list = self.encode(attrs_list)
 
@@ -1378,11 +1420,122 @@ class LDAPClient(object):
                 if not paged_search or not cookie:
                     break
 
+            if trace is not None:
+                trace['count'] = len(res)
+                trace['truncated'] = truncated
+
         if not res and not truncated:
             raise errors.EmptyResult(reason='no matching entry found')
 
         return (res, truncated)
 
+    def iter_entries(self, filter=None, attrs_list=None, base_dn=None,
+                     scope=ldap.SCOPE_SUBTREE, time_limit=None,
+                     search_refs=False, page_size=1000):
+        """
+        Iterate over the entries matching specified search parameters.
+
+        The entries are requested using the paged results control,
+        ``page_size`` entries at a time, and yielded page by page, so unlike
+        find_entries only a single page is held in memory. Servers which do
+        not support the control return all the entries in one page.
+
+        Keyword arguments:
+        attrs_list -- list of attributes to return, all if None (default None)
+        base_dn -- dn of the entry at which to start the search (default '')
+        scope -- search scope, see LDAP docs (default ldap2.SCOPE_SUBTREE)
+        time_limit -- time limit in seconds (default unlimited)
+        search_refs -- allow search references to be returned
+            (default skips these entries)
+        page_size -- number of entries requested at once (default 1000)
+
+        :raises: errors.NotFound if result set is empty
+                                 or base_dn doesn't exist
+                 errors.LimitsExceeded after the last returned entry if the
+                                 search hit a server limit
+        """
+        if base_dn is None:
+            base_dn = DN()
+        assert isinstance(base_dn, DN)
+        if not filter:
+            filter = '(objectClass=*)'
+
+        if time_limit is None or time_limit == 0:
+            time_limit = -1.0
+        if not isinstance(time_limit, float):
+            time_limit = float(time_limit)
+
+        if attrs_list:
+            attrs_list = [a.lower() for a in set(attrs_list)]
+
+        found = False
+        truncated = False
+        cookie = ''
+
+        with self.error_handler():
+            filter = self.encode(filter)
+            attrs_list = self.encode(attrs_list)
+
+        try:
+            while True:
+                page = []
+                trace = self._trace('search', base_dn,
+                                    scope=_scope_names.get(scope, scope),
+                                    filter=filter, attrs=attrs_list)
+                with self.error_handler(trace=trace):
+                    sctrls = [SimplePagedResultsControl(0, page_size, cookie)]
+                    try:
+                        id = self.conn.search_ext(
+                            str(base_dn), scope, filter, attrs_list,
+                            serverctrls=sctrls, timeout=time_limit)
+                        while True:
+                            result = self.conn.result3(id, 0)
+                            objtype, res_list, res_id, res_ctrls = result
+                            res_list = self._convert_result(res_list)
+                            if not res_list:
+                                break
+                            if (objtype == ldap.RES_SEARCH_ENTRY or
+                                    (search_refs and
+                                        objtype == ldap.RES_SEARCH_REFERENCE)):
+                                page.append(res_list[0])
+                    except (ldap.ADMINLIMIT_EXCEEDED, ldap.TIMELIMIT_EXCEEDED,
+                            ldap.SIZELIMIT_EXCEEDED):
+                        truncated = True
+                    else:
+                        # Get cookie for the next page
+                        for ctrl in res_ctrls:
+                            if isinstance(ctrl, SimplePagedResultsControl):
+                                cookie = ctrl.cookie
+                                break
+                        else:
+                            cookie = ''
+                    if trace is not None:
+                        trace['count'] = len(page)
+                        trace['truncated'] = truncated
+
+                for entry in page:
+                    found = True
+                    yield entry
+
+                if truncated or not cookie:
+                    break
+        finally:
+            # The search hit a limit, failed or the caller stopped
+            # iterating, cancel it
+            if cookie:
+                sctrls = [SimplePagedResultsControl(0, 0, cookie)]
+                try:
+                    self.conn.search_ext_s(
+                        str(base_dn), scope, filter, attrs_list,
+                        serverctrls=sctrls, timeout=time_limit)
+                except ldap.LDAPError, e:
+                    self.log.warning("Error cancelling paged search: %s", e)
+
+        if truncated:
+            raise errors.LimitsExceeded()
+        if not found:
+            raise errors.EmptyResult(reason='no matching entry found')
+
     def find_entry_by_attr(self, attr, value, object_class, attrs_list=None,
                            base_dn=None):
         """
@@ -1437,7 +1590,8 @@ class LDAPClient(object):
         # remove all [] values (python-ldap hates 'em)
         attrs = dict((k, v) for k, v in entry.raw.iteritems() if v)
 
-        with self.error_handler():
+        trace = self._trace('add', entry.dn, attrs=sorted(attrs))
+        with self.error_handler(trace=trace):
             attrs = self.encode(attrs)
             self.conn.add_s(str(entry.dn), attrs.items())
 
@@ -1469,7 +1623,8 @@ class LDAPClient(object):
         else:
             new_superior = str(DN(*new_dn[1:]))
 
-        with self.error_handler():
+        trace = self._trace('modrdn', dn, new_dn=unicode(new_dn))
+        with self.error_handler(trace=trace):
             self.conn.rename_s(str(dn), str(new_rdn), newsuperior=new_superior,
                                delold=int(del_old))
             time.sleep(.3)  # Give memberOf plugin a chance to work
@@ -1484,8 +1639,11 @@ class LDAPClient(object):
         if not modlist:
             raise errors.EmptyModlist()
 
+        trace = self._trace('modify', entry.dn,
+                            attrs=sorted(set(b for a, b, c in modlist)))
+
         # pass arguments to python-ldap
-        with self.error_handler():
+        with self.error_handler(trace=trace):
             modlist = [(a, self.encode(b), self.encode(c))
                        for a, b, c in modlist]
             self.conn.modify_s(str(entry.dn), modlist)
@@ -1499,7 +1657,8 @@ class LDAPClient(object):
         else:
             dn = entry_or_dn.dn
 
-        with self.error_handler():
+        trace = self._trace('delete', dn)
+        with self.error_handler(trace=trace):
             self.conn.delete_s(str(dn))
 
     def entry_exists(self, dn):
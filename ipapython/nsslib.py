@@ -175,7 +175,8 @@ class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
 
     def __init__(self, host, port=None, strict=None,
                  dbdir=None, family=socket.AF_UNSPEC, no_init=False,
-                 tls_version_min='tls1.1', tls_version_max='tls1.2'):
+                 tls_version_min='tls1.1', tls_version_max='tls1.2',
+                 resume_sessions=False):
         """
         :param host: the server to connect to
         :param port: the port to use (default is set in HTTPConnection)
@@ -186,6 +187,11 @@ class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
                         the request will fail.
         :param tls_min_version: mininum version of SSL/TLS supported
         :param tls_max_version: maximum version of SSL/TLS supported.
+        :param resume_sessions: keep the SSL session cache when the
+                                connection is closed, so that new
+                                connections can resume the TLS session.
+                                The caller is responsible for clearing the
+                                cache before NSS is shut down.
         """
         httplib.HTTPConnection.__init__(self, host, port, strict)
         NSSAddressFamilyFallback.__init__(self, family)
@@ -215,6 +221,7 @@ class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
         nss.set_password_callback(self.password_callback)
         self.tls_version_min = str(tls_version_min)
         self.tls_version_max = str(tls_version_max)
+        self.resume_sessions = resume_sessions
 
     def _create_socket(self):
         # TODO: remove the try block once python-nss is guaranteed to contain
@@ -271,7 +278,8 @@ class NSSConnection(httplib.HTTPConnection, NSSAddressFamilyFallback):
         if self.sock:
             self.sock.close()   # close it manually... there may be other refs
             self.sock = None
-            ssl.clear_session_cache()
+            if not self.resume_sessions:
+                ssl.clear_session_cache()
 
     def endheaders(self, message=None):
         """
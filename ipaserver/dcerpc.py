@@ -33,9 +33,13 @@ from ipapython.dn import DN
 from ipaserver.install import installutils
 from ipaserver.plugins import ldap2
 from ipalib.util import normalize_name
+from ipalib.request import context
 
 import os, string, struct, copy
+import atexit
 import uuid
+import threading
+import time
 from samba import param
 from samba import credentials
 from samba.dcerpc import security, lsa, drsblobs, nbt, netlogon
@@ -51,6 +55,7 @@ except ImportError:
 import ldap as _ldap
 from ipapython.ipaldap import IPAdmin
 from ipalib.session import krbccache_dir, krbccache_prefix
+from ipalib.krb_utils import KRB5_CCache
 from dns import resolver, rdatatype
 from dns.exception import DNSException
 import pysss_nss_idmap
@@ -131,6 +136,172 @@ class ExtendedDNControl(LDAPControl):
         return '0\x03\x02\x01\x01'
 
 
+# Failed lookups are cached for at most this many seconds
+NEGATIVE_CACHE_TTL = 60
+MAX_TRUST_CACHE_ENTRIES = 10000
+
+
+class TrustCache(object):
+    """
+    Cache of the trust configuration and of the trusted domain object
+    lookups, shared by all `DomainValidator` instances of the process.
+
+    Entries expire after trust_cache_ttl seconds, failed lookups after at
+    most NEGATIVE_CACHE_TTL seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        """
+        Return the value cached under ``key``, raise KeyError if there is
+        none or it expired.
+        """
+        with self._lock:
+            value, expiration = self._entries[key]
+            if expiration < time.time():
+                del self._entries[key]
+                raise KeyError(key)
+            return value
+
+    def set(self, key, value, negative=False, ttl=None):
+        if ttl is None or ttl > api.env.trust_cache_ttl:
+            ttl = api.env.trust_cache_ttl
+        if negative:
+            ttl = min(ttl, NEGATIVE_CACHE_TTL)
+        if ttl <= 0:
+            return
+
+        now = time.time()
+        with self._lock:
+            if len(self._entries) >= MAX_TRUST_CACHE_ENTRIES:
+                for k, (v, expiration) in self._entries.items():
+                    if expiration < now:
+                        del self._entries[k]
+                if len(self._entries) >= MAX_TRUST_CACHE_ENTRIES:
+                    self._entries.clear()
+            self._entries[key] = (value, now + ttl)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+trust_cache = TrustCache()
+
+
+# Idle connections kept per domain controller
+MAX_IDLE_DC_CONNECTIONS = 2
+# Tickets are renewed this many seconds before they expire
+TICKET_EXPIRATION_MARGIN = 60
+# Maximum number of SIDs looked up by a single AD DC search
+SID_SEARCH_SIZE = 50
+
+
+class DCConnectionPool(object):
+    """
+    Idle GSSAPI bound LDAP connections to the domain controllers of the
+    trusted domains, shared by all `DomainValidator` instances of the
+    process.
+
+    Each connection is stored with the expiration time of the ticket it
+    was bound with and is not reused after the ticket expires.
+    """
+
+    def __init__(self, maxidle=MAX_IDLE_DC_CONNECTIONS):
+        self.maxidle = maxidle
+        self.__idle = {}
+        self.__lock = threading.Lock()
+
+    def get(self, host):
+        """
+        Return an idle connection to ``host`` and its expiration time, or
+        (None, None).
+        """
+        now = time.time()
+        expired = []
+        result = (None, None)
+        with self.__lock:
+            conns = self.__idle.get(host, [])
+            while conns:
+                conn, expiration = conns.pop()
+                if expiration > now:
+                    result = (conn, expiration)
+                    break
+                expired.append(conn)
+        for conn in expired:
+            conn.close()
+        return result
+
+    def put(self, host, conn, expiration):
+        """
+        Store the idle connection ``conn`` to ``host`` for reuse.
+        """
+        with self.__lock:
+            conns = self.__idle.setdefault(host, [])
+            if len(conns) < self.maxidle:
+                conns.append((conn, expiration))
+                return
+        conn.close()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self.__lock:
+            conns = sum(self.__idle.values(), [])
+            self.__idle.clear()
+        for conn, expiration in conns:
+            conn.close()
+
+dc_connection_pool = DCConnectionPool()
+
+# (ccache path, principal, expiration) of the HTTP service credentials by
+# trusted domain, see DomainValidator.get_http_ccache
+_http_ccaches = {}
+_http_ccache_lock = threading.Lock()
+
+
+def _http_ccache_path(domain):
+    """
+    Return the path of the ccache with the HTTP service credentials for
+    the trusted domain `domain' owned by the current process.
+    """
+    domain_suffix = domain.lower().replace('.', '-')
+    ccache_name = "%sTD%s-%d" % (krbccache_prefix, domain_suffix, os.getpid())
+    return os.path.join(krbccache_dir, ccache_name)
+
+
+@atexit.register
+def _remove_http_ccaches():
+    """
+    Remove the ccaches cached by DomainValidator.get_http_ccache when the
+    process exits.
+    """
+    with _http_ccache_lock:
+        for domain, (ccache_name, principal, expiration) in \
+                _http_ccaches.items():
+            if ccache_name != _http_ccache_path(domain):
+                # Inherited from the parent process
+                continue
+            try:
+                os.unlink(ccache_name)
+            except OSError:
+                pass
+        _http_ccaches.clear()
+
+
+def invalidate_trust_cache():
+    """
+    Drop the cached trust configuration and lookups and close the idle
+    domain controller connections. Call this after adding or removing a
+    trust or a trusted domain.
+    """
+    trust_cache.clear()
+    dc_connection_pool.clear()
+
+
 class DomainValidator(object):
     ATTR_FLATNAME = 'ipantflatname'
     ATTR_SID = 'ipantsecurityidentifier'
@@ -150,13 +321,40 @@ class DomainValidator(object):
         self._creds = None
         self._parm = None
 
-    def is_configured(self):
+    def __cached_lookup(self, key, lookup, *args):
+        """
+        Return the result of ``lookup(*args)`` cached under ``key``.
+        errors.NotFound raised by the lookup is cached too.
+        """
+        try:
+            value = trust_cache.get(key)
+        except KeyError:
+            try:
+                value = lookup(*args)
+            except errors.NotFound, e:
+                trust_cache.set(key, e, negative=True)
+                raise
+            trust_cache.set(key, value)
+        if isinstance(value, errors.NotFound):
+            raise value
+        return value
+
+    def __get_local_domain(self):
         cn_trust_local = DN(('cn', self.api.env.domain), self.api.env.container_cifsdomains, self.api.env.basedn)
         try:
             entry_attrs = self.ldap.get_entry(cn_trust_local, [self.ATTR_FLATNAME, self.ATTR_SID])
-            self.flatname = entry_attrs[self.ATTR_FLATNAME][0]
-            self.sid = entry_attrs[self.ATTR_SID][0]
-            self.dn = entry_attrs.dn
+        except errors.NotFound, e:
+            raise errors.NotFound(reason=_('domain is not configured'))
+        return (entry_attrs[self.ATTR_FLATNAME][0],
+                entry_attrs[self.ATTR_SID][0],
+                entry_attrs.dn)
+
+    def is_configured(self):
+        # What is visible depends on the access rights of the bound user
+        key = ('local_domain', getattr(context, 'principal', None))
+        try:
+            self.flatname, self.sid, self.dn = self.__cached_lookup(
+                key, self.__get_local_domain)
             self.domain = self.api.env.domain
         except errors.NotFound, e:
             return False
@@ -166,7 +364,13 @@ class DomainValidator(object):
         """
         Returns case-insensitive dict of trusted domain tuples
         (flatname, sid, trust_auth_outgoing), keyed by domain name.
+
+        The result is cached and must not be modified.
         """
+        key = ('trusted_domains', getattr(context, 'principal', None))
+        return self.__cached_lookup(key, self.__get_trusted_domains)
+
+    def __get_trusted_domains(self):
         cn_trust = DN(('cn', 'ad'), self.api.env.container_trusts,
                       self.api.env.basedn)
 
@@ -328,6 +532,11 @@ class DomainValidator(object):
         return entries
 
     def get_trusted_domain_object_sid(self, object_name):
+        return self.__cached_lookup(('sid', object_name.lower()),
+                                    self.__get_trusted_domain_object_sid,
+                                    object_name)
+
+    def __get_trusted_domain_object_sid(self, object_name):
         result = pysss_nss_idmap.getsidbyname(object_name)
         if object_name in result and (pysss_nss_idmap.SID_KEY in result[object_name]):
             object_sid = result[object_name][pysss_nss_idmap.SID_KEY]
@@ -366,6 +575,13 @@ class DomainValidator(object):
         if not self.is_trusted_sid_valid(sid):
             raise errors.ValidationError(name='sid', error='SID is not valid')
 
+        object_name = self.__cached_lookup(
+            ('name', sid), self.__get_trusted_domain_object_from_sid, sid)
+        # Remember the reverse mapping as well
+        trust_cache.set(('sid', object_name.lower()), sid)
+        return object_name
+
+    def __get_trusted_domain_object_from_sid(self, sid):
         # Use pysss_nss_idmap to obtain the name
         result = pysss_nss_idmap.getnamebysid(sid).get(sid)
 
@@ -406,6 +622,80 @@ class DomainValidator(object):
 
         return unicode(object_name)
 
+    def get_trusted_domain_objects_from_sids(self, sids):
+        """
+        Return a dict of the names of the trusted domain users and groups
+        with the SIDs `sids', keyed by SID.
+
+        Unlike get_trusted_domain_object_from_sid(), SSSD is asked about all
+        the SIDs at once and the SIDs unknown to SSSD are looked up with one
+        AD DC search per SID_SEARCH_SIZE SIDs of a trusted domain. Invalid
+        SIDs and SIDs of objects which were not found are left out.
+        """
+        result = {}
+        missing = []
+        for sid in set(sids):
+            try:
+                object_name = trust_cache.get(('name', sid))
+            except KeyError:
+                if self.is_trusted_sid_valid(sid):
+                    missing.append(sid)
+                continue
+            if not isinstance(object_name, errors.NotFound):
+                result[sid] = object_name
+        if not missing:
+            return result
+
+        valid_types = (pysss_nss_idmap.ID_USER,
+                       pysss_nss_idmap.ID_GROUP,
+                       pysss_nss_idmap.ID_BOTH)
+
+        sssd_result = pysss_nss_idmap.getnamebysid(missing)
+        sids_by_domain = {}
+        for sid in missing:
+            info = sssd_result.get(sid)
+            if info and info.get(pysss_nss_idmap.TYPE_KEY) in valid_types:
+                result[sid] = info.get(pysss_nss_idmap.NAME_KEY)
+            else:
+                domain = self.get_domain_by_sid(sid)
+                sids_by_domain.setdefault(domain, []).append(sid)
+
+        # If unsuccessful, search AD DC LDAP
+        for domain, domain_sids in sids_by_domain.iteritems():
+            for i in xrange(0, len(domain_sids), SID_SEARCH_SIZE):
+                batch = domain_sids[i:i + SID_SEARCH_SIZE]
+                filter = (r'(&(|%s)(|(objectClass=user)(objectClass=group)))' %
+                          ''.join('(objectSid=%s)' % escape_filter_chars(
+                              security.dom_sid(sid).__ndr_pack__(), 2)
+                                  for sid in batch))
+                try:
+                    entries = self.get_trusted_domain_objects(
+                        domain=domain, filter=filter,
+                        attrs=['sAMAccountName', 'objectSid'])
+                except errors.NotFound:
+                    entries = []
+
+                found = {}
+                for entry in entries:
+                    sid = self.__sid_to_str(entry['objectSid'][0])
+                    found.setdefault(sid, []).append(entry)
+
+                for sid in batch:
+                    if sid not in found:
+                        trust_cache.set(('name', sid), errors.NotFound(
+                            reason=_('trusted domain object not found')),
+                            negative=True)
+                    elif len(found[sid]) == 1:
+                        result[sid] = unicode(
+                            "%s@%s" % (found[sid][0].single_value['sAMAccountName'].lower(),
+                                       domain.lower()))
+
+        for sid in missing:
+            if sid in result:
+                trust_cache.set(('name', sid), result[sid])
+                trust_cache.set(('sid', result[sid].lower()), sid)
+        return result
+
     def __get_trusted_domain_user_and_groups(self, object_name):
         """
         Returns a tuple with user SID and a list of SIDs of all groups he is
@@ -517,16 +807,14 @@ class DomainValidator(object):
 
         Applies session code defaults for ccache directory and naming prefix.
         Session code uses krbccache_prefix+<pid>, we use
-        krbccache_prefix+<TD>+<domain netbios name> so there is no clash.
+        krbccache_prefix+<TD>+<domain name>-<pid> so there is no clash with
+        the session ccaches nor with the ccaches of other processes.
 
         Returns tuple (ccache path, principal) where (None, None) signifes an
         error on ccache initialization
         """
 
-        domain_suffix = domain.replace('.', '-')
-
-        ccache_name = "%sTD%s" % (krbccache_prefix, domain_suffix)
-        ccache_path = os.path.join(krbccache_dir, ccache_name)
+        ccache_path = _http_ccache_path(domain)
 
         realm = api.env.realm
         hostname = api.env.host
@@ -580,44 +868,107 @@ class DomainValidator(object):
 
         return entries
 
+    def get_http_ccache(self, domain):
+        """
+        Return a tuple (ccache path, principal, expiration) of a ccache with
+        http service credentials for searching the trusted domain `domain'.
+
+        The ccache initialized by kinit_as_http() is reused by the whole
+        process until its ticket is about to expire and removed when the
+        process exits. (None, None, None) signifies an error on ccache
+        initialization.
+        """
+        with _http_ccache_lock:
+            cached = _http_ccaches.get(domain.lower())
+            if cached is not None:
+                (ccache_name, principal, expiration) = cached
+                if (expiration - TICKET_EXPIRATION_MARGIN > time.time() and
+                        ccache_name == _http_ccache_path(domain) and
+                        os.path.exists(ccache_name)):
+                    return cached
+
+            (ccache_name, principal) = self.kinit_as_http(domain)
+            if not ccache_name:
+                return (None, None, None)
+            try:
+                expiration = KRB5_CCache(ccache_name).endtime(
+                    api.env.host, api.env.realm)
+            except Exception, e:
+                root_logger.debug('Cannot read ticket expiration from %s: %s',
+                                  ccache_name, e)
+                expiration = 0
+            if expiration:
+                _http_ccaches[domain.lower()] = (ccache_name, principal,
+                                                 expiration)
+            else:
+                # Use the ticket for this search only
+                expiration = time.time() + TICKET_EXPIRATION_MARGIN + 1
+            return (ccache_name, principal, expiration)
+
+    def __connect_to_dc(self, info, host):
+        """
+        Return a tuple (connection, expiration) with a new connection to
+        the AD DC `host' bound with the http service credentials, or
+        (None, None) if the credentials cannot be obtained.
+        """
+        (ccache_name, principal, expiration) = self.get_http_ccache(
+            info['dns_domain'])
+        if not ccache_name:
+            return (None, None)
+
+        with installutils.private_ccache(path=ccache_name, remove=False):
+            conn = IPAdmin(host=host,
+                           port=389,  # query the AD DC
+                           no_schema=True,
+                           decode_attrs=False,
+                           sasl_nocanon=True)
+            # sasl_nocanon used to avoid hard requirement for PTR
+            # records pointing back to the same host name
+
+            conn.do_sasl_gssapi_bind()
+        return (conn, expiration - TICKET_EXPIRATION_MARGIN)
+
     def __search_in_dc(self, info, host, port, filter, attrs, scope,
                        basedn=None, quiet=False):
         """
         Actual search in AD LDAP server, using SASL GSSAPI authentication
         Returns LDAP result or None.
-        """
-
-        (ccache_name, principal) = self.kinit_as_http(info['dns_domain'])
 
-        if ccache_name:
-            with installutils.private_ccache(path=ccache_name):
-                entries = None
+        The connection is taken from dc_connection_pool if possible. A
+        failed search on a reused connection is repeated once on a new one.
+        """
+        if basedn is None:
+            # Use domain root base DN
+            basedn = ipautil.realm_to_suffix(info['dns_domain'])
+
+        (conn, expiration) = dc_connection_pool.get(host)
+        reused = conn is not None
+        while True:
+            entries = None
+            try:
+                if conn is None:
+                    (conn, expiration) = self.__connect_to_dc(info, host)
+                    if conn is None:
+                        return None
+                entries = conn.get_entries(basedn, scope, filter, attrs)
+            except Exception, e:
+                if not isinstance(e, errors.NotFound) and conn is not None:
+                    conn.close()
+                    conn = None
+                    if reused:
+                        # The DC may have closed the idle connection
+                        reused = False
+                        continue
+                msg = "Search on AD DC {host}:{port} failed with: {err}"\
+                      .format(host=host, port=str(port), err=str(e))
+                if quiet:
+                    root_logger.debug(msg)
+                else:
+                    root_logger.warning(msg)
 
-                try:
-                    conn = IPAdmin(host=host,
-                                   port=389,  # query the AD DC
-                                   no_schema=True,
-                                   decode_attrs=False,
-                                   sasl_nocanon=True)
-                    # sasl_nocanon used to avoid hard requirement for PTR
-                    # records pointing back to the same host name
-
-                    conn.do_sasl_gssapi_bind()
-
-                    if basedn is None:
-                        # Use domain root base DN
-                        basedn = ipautil.realm_to_suffix(info['dns_domain'])
-
-                    entries = conn.get_entries(basedn, scope, filter, attrs)
-                except Exception, e:
-                    msg = "Search on AD DC {host}:{port} failed with: {err}"\
-                          .format(host=host, port=str(port), err=str(e))
-                    if quiet:
-                        root_logger.debug(msg)
-                    else:
-                        root_logger.warning(msg)
-                finally:
-                    return entries
+            if conn is not None:
+                dc_connection_pool.put(host, conn, expiration)
+            return entries
 
     def __retrieve_trusted_domain_gc_list(self, domain):
         """
@@ -630,6 +981,14 @@ class DomainValidator(object):
         if domain in self._info:
             return self._info[domain]
 
+        try:
+            info = trust_cache.get(('gc_list', domain.lower()))
+        except KeyError:
+            pass
+        else:
+            self._info[domain] = info
+            return info
+
         if not self._creds:
             self._parm = param.LoadParm()
             self._parm.load(os.path.join(ipautil.SHARE_DIR,"smb.conf.empty"))
@@ -656,6 +1015,8 @@ class DomainValidator(object):
 
         info = dict()
         servers = []
+        # The list is cached for the TTL of the SRV records it comes from
+        ttl = None
 
         if result:
             info['name'] = unicode(result.domain_name)
@@ -671,6 +1032,8 @@ class DomainValidator(object):
                 answers = resolver.query(gc_name, rdatatype.SRV)
             except DNSException, e:
                 answers = []
+            else:
+                ttl = answers.rrset.ttl
 
             for answer in answers:
                 server = str(answer.target).rstrip(".")
@@ -683,6 +1046,8 @@ class DomainValidator(object):
             raise assess_dcerpc_exception(message=str(finddc_error))
 
         self._info[domain] = info
+        if info['gc']:
+            trust_cache.set(('gc_list', domain.lower()), info, ttl=ttl)
         return info
 
 def string_to_array(what):
@@ -1089,11 +1454,12 @@ def fetch_domains(api, mydomain, trustdomain, creds=None):
     td.info['dc'] = unicode(result.pdc_dns_name)
     if creds is None:
         domval = DomainValidator(api)
-        (ccache_name, principal) = domval.kinit_as_http(trustdomain)
+        (ccache_name, principal, expiration) = domval.get_http_ccache(
+            trustdomain)
         td.creds = credentials.Credentials()
         td.creds.set_kerberos_state(credentials.MUST_USE_KERBEROS)
         if ccache_name:
-            with installutils.private_ccache(path=ccache_name):
+            with installutils.private_ccache(path=ccache_name, remove=False):
                 td.creds.guess(td.parm)
                 td.creds.set_workstation(domain_validator.flatname)
                 domains = communicate(td)
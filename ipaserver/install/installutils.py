@@ -916,7 +916,7 @@ def load_pkcs12(cert_files, key_password, key_nickname, ca_cert_files,
     return out_file, out_password, ca_cert
 
 @contextmanager
-def private_ccache(path=None):
+def private_ccache(path=None, remove=True):
 
     if path is None:
         (desc, path) = tempfile.mkstemp(prefix='krbcc')
@@ -934,7 +934,7 @@ def private_ccache(path=None):
         else:
             os.environ.pop('KRB5CCNAME')
 
-        if os.path.exists(path):
+        if remove and os.path.exists(path):
             os.remove(path)
 
 
@@ -20,9 +20,12 @@
 import os
 import sys
 import shutil
+import subprocess
 import tempfile
+import threading
 import time
 import pwd
+import ldif
 from optparse import OptionGroup
 from ConfigParser import SafeConfigParser
 from ipaplatform.paths import paths
@@ -65,10 +68,12 @@ EOF
 
 
 
-def encrypt_file(filename, keyring, remove_original=True):
-    source = filename
-    dest = filename + '.gpg'
+def gpg_encrypt_args(dest, keyring):
+    """
+    Return the gpg command encrypting its input into dest.
 
+    The input is read from stdin unless a file name is appended.
+    """
     args = [paths.GPG,
             '--batch',
             '--default-recipient-self',
@@ -82,6 +87,15 @@ def encrypt_file(filename, keyring, remove_original=True):
         args.append(keyring + '.sec')
 
     args.append('-e')
+
+    return args
+
+
+def encrypt_file(filename, keyring, remove_original=True):
+    source = filename
+    dest = filename + '.gpg'
+
+    args = gpg_encrypt_args(dest, keyring)
     args.append(source)
 
     (stdout, stderr, rc) = run(args, raiseonerr=False)
@@ -94,6 +108,82 @@ def encrypt_file(filename, keyring, remove_original=True):
     return dest
 
 
+def compressor_args(level=6, threads=0):
+    """
+    Return the command compressing stdin to stdout in gzip format.
+
+    pigz is used when available so the compression runs on several CPUs,
+    its output is readable by gzip so restore does not need it. threads
+    set to 0 lets pigz use all online CPUs, 1 forces plain gzip.
+    """
+    if threads != 1 and os.path.exists(paths.PIGZ):
+        args = [paths.PIGZ, '-%d' % level]
+        if threads:
+            args.extend(['-p', str(threads)])
+    else:
+        args = [paths.GZIP, '-%d' % level]
+    args.append('-c')
+
+    return args
+
+
+def run_pipeline(stages, log, output=None, cwd=None):
+    """
+    Run a list of commands with the stdout of each connected to the stdin
+    of the next one.
+
+    :param stages: list of (name, args) tuples
+    :param log: logger used to report per-stage timing
+    :param output: file the last command writes to, when None the last
+        command is expected to write its output by itself
+    :param cwd: working directory of the commands
+
+    Raises ScriptError if any of the commands fails.
+    """
+    start = time.time()
+    procs = []
+    out_fd = None
+    if output is not None:
+        out_fd = open(output, 'wb')
+
+    try:
+        stdin = None
+        for i, (name, args) in enumerate(stages):
+            if i == len(stages) - 1:
+                stdout = out_fd
+            else:
+                stdout = subprocess.PIPE
+            err = tempfile.TemporaryFile()
+            log.debug('Starting %s: %s', name, ' '.join(args))
+            p = subprocess.Popen(args, stdin=stdin, stdout=stdout, stderr=err,
+                                 cwd=cwd, close_fds=True)
+            if stdin is not None:
+                # Let the previous stage get SIGPIPE if this one exits
+                stdin.close()
+            stdin = p.stdout
+            procs.append((name, p, err))
+
+        failures = []
+        for name, p, err in procs:
+            rc = p.wait()
+            log.info('%s finished in %.2f seconds', name, time.time() - start)
+            if rc != 0:
+                err.seek(0)
+                failures.append('%s returned non-zero %d: %s' %
+                              (name, rc, err.read().strip()))
+            err.close()
+    finally:
+        for name, p, err in procs:
+            if p.poll() is None:
+                p.kill()
+                p.wait()
+        if out_fd is not None:
+            out_fd.close()
+
+    if failures:
+        raise admintool.ScriptError(', '.join(failures))
+
+
 class Backup(admintool.AdminTool):
     command_name = 'ipa-backup'
     log_file_name = paths.IPABACKUP_LOG
@@ -218,6 +308,16 @@ class Backup(admintool.AdminTool):
             default=False, help="Include log files in backup")
         parser.add_option("--online", dest="online", action="store_true",
             default=False, help="Perform the LDAP backups online, for data only.")
+        parser.add_option("--incremental", dest="incremental",
+            action="store_true", default=False,
+            help="Back up only the entries changed since the previous "
+                 "backup, implies --data and --online")
+        parser.add_option("--compress-level", dest="compress_level",
+            type="int", default=6,
+            help="Compression level of the backup, 1 (fastest) to 9 (best)")
+        parser.add_option("--compress-threads", dest="compress_threads",
+            type="int", default=0,
+            help="Number of compression threads, 0 to use all CPUs")
 
 
     def setup_logging(self, log_file_mode='a'):
@@ -235,6 +335,10 @@ class Backup(admintool.AdminTool):
                     options.gpg_keyring)
             options.gpg = True
 
+        if options.incremental:
+            options.data_only = True
+            options.online = True
+
         if options.online and not options.data_only:
             self.option_parser.error("You cannot specify --online "
                 "without --data")
@@ -248,6 +352,14 @@ class Backup(admintool.AdminTool):
             self.option_parser.error("You cannot specify --data "
                 "with --logs")
 
+        if not 1 <= options.compress_level <= 9:
+            self.option_parser.error("--compress-level must be between "
+                "1 and 9")
+
+        if options.compress_threads < 0:
+            self.option_parser.error("--compress-threads must not be "
+                "negative")
+
 
     def run(self):
         options = self.options
@@ -269,6 +381,8 @@ class Backup(admintool.AdminTool):
         os.chown(self.dir, pent.pw_uid, pent.pw_gid)
 
         self.header = os.path.join(self.top_dir, 'header')
+        self.compressor = compressor_args(options.compress_level,
+                                          options.compress_threads)
 
         cwd = os.getcwd()
         try:
@@ -281,7 +395,12 @@ class Backup(admintool.AdminTool):
 
             self.get_connection()
 
-            self.create_header(options.data_only)
+            parent = None
+            if options.incremental:
+                parent = self.find_last_backup()
+                self.log.info('Backing up changes since %s', parent[0])
+
+            self.create_header(options.data_only, parent)
             if options.data_only:
                 if not options.online:
                     self.log.info('Stopping Directory Server')
@@ -290,17 +409,14 @@ class Backup(admintool.AdminTool):
                 self.log.info('Stopping IPA services')
                 run(['ipactl', 'stop'])
 
-            for instance in [
-                installutils.realm_to_serverid(api.env.realm), 'PKI-IPA'
-            ]:
-                if os.path.exists(paths.VAR_LIB_SLAPD_INSTANCE_DIR_TEMPLATE % instance):
-                    if os.path.exists(paths.SLAPD_INSTANCE_DB_DIR_TEMPLATE % (instance, 'ipaca')):
-                        self.db2ldif(instance, 'ipaca', online=options.online)
-                    self.db2ldif(instance, 'userRoot', online=options.online)
-                    self.db2bak(instance, online=options.online)
+            if options.incremental:
+                self.export_changes(parent[1])
+            else:
+                self.export_databases(online=options.online)
             if not options.data_only:
                 self.file_backup(options)
-            self.finalize_backup(options.data_only, options.gpg, options.gpg_keyring)
+            self.finalize_backup(options.data_only, options.gpg,
+                                 options.gpg_keyring, options.incremental)
 
             if options.data_only:
                 if not options.online:
@@ -374,6 +490,156 @@ class Backup(admintool.AdminTool):
         return self._conn
 
 
+    def export_databases(self, online=True):
+        '''
+        Export the backends of all instances to LDIF and create their BAK
+        backups.
+
+        The exports run concurrently. The offline tools lock the database
+        environment of an instance so offline jobs of one instance are
+        serialized, jobs of different instances still run in parallel.
+        '''
+        jobs = []
+        for instance in [
+            installutils.realm_to_serverid(api.env.realm), 'PKI-IPA'
+        ]:
+            if not os.path.exists(
+                    paths.VAR_LIB_SLAPD_INSTANCE_DIR_TEMPLATE % instance):
+                continue
+            lock = None if online else threading.Lock()
+            if os.path.exists(paths.SLAPD_INSTANCE_DB_DIR_TEMPLATE %
+                              (instance, 'ipaca')):
+                jobs.append(('%s %s LDIF export' % (instance, 'ipaca'), lock,
+                             self.db2ldif, (instance, 'ipaca', online)))
+            jobs.append(('%s %s LDIF export' % (instance, 'userRoot'), lock,
+                         self.db2ldif, (instance, 'userRoot', online)))
+            jobs.append(('%s BAK backup' % instance, lock,
+                         self.db2bak, (instance, online)))
+
+        failures = []
+
+        def run_job(name, lock, func, args):
+            try:
+                if lock is not None:
+                    lock.acquire()
+                try:
+                    job_start = time.time()
+                    func(*args)
+                    self.log.info('%s finished in %.2f seconds',
+                                  name, time.time() - job_start)
+                finally:
+                    if lock is not None:
+                        lock.release()
+            except Exception:
+                failures.append(sys.exc_info())
+
+        start = time.time()
+        threads = [threading.Thread(target=run_job, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if failures:
+            raise failures[0][0], failures[0][1], failures[0][2]
+
+        self.log.info('Database export finished in %.2f seconds',
+                      time.time() - start)
+
+
+    def get_last_usn(self):
+        '''
+        Return the highest entryUSN assigned by the Directory Server.
+        '''
+        conn = self.get_connection()
+        entry = conn.get_entry(DN(), ['lastusn'])
+        usns = [int(value)
+                for name, values in entry.raw.iteritems()
+                if name.lower().split(';')[0] == 'lastusn'
+                for value in values]
+        if not usns:
+            raise admintool.ScriptError('Unable to read the last USN, '
+                'is the entryUSN plugin enabled?')
+        return max(usns)
+
+
+    def find_last_backup(self):
+        '''
+        Find the most recent backup of this host which recorded a USN.
+
+        Returns a (name, usn) tuple.
+        '''
+        latest = None
+        for name in os.listdir(paths.IPA_BACKUP_DIR):
+            config = SafeConfigParser()
+            if not config.read(os.path.join(paths.IPA_BACKUP_DIR, name,
+                                            'header')):
+                continue
+            if (not config.has_option('ipa', 'usn') or
+                    config.get('ipa', 'host') != api.env.host):
+                continue
+            backup_time = config.get('ipa', 'time')
+            if latest is None or backup_time > latest[0]:
+                latest = (backup_time, name, int(config.get('ipa', 'usn')))
+
+        if latest is None:
+            raise admintool.ScriptError('No previous backup to base an '
+                'incremental backup on, make a full or data backup first')
+
+        return latest[1:]
+
+
+    def export_changes(self, usn):
+        '''
+        Export the entries changed after the given USN to LDIF and record
+        the DNs of the entries deleted since then.
+
+        Only the backends of the main instance are exported, the changes
+        are read over ldapi while the server is running.
+        '''
+        conn = self.get_connection()
+        instance = installutils.realm_to_serverid(api.env.realm)
+        usn_filter = '(entryusn>=%d)' % (usn + 1)
+
+        for backend, suffix in (('userRoot', api.env.basedn),
+                                ('ipaca', DN(('o', 'ipaca')))):
+            if not os.path.exists(paths.SLAPD_INSTANCE_DB_DIR_TEMPLATE %
+                                  (instance, backend)):
+                continue
+            self.log.info('Backing up changes of %s in %s' %
+                          (backend, instance))
+            start = time.time()
+
+            try:
+                entries = conn.get_entries(suffix, filter=usn_filter,
+                                           attrs_list=['*'])
+            except errors.NotFound:
+                entries = []
+            ldifname = '%s-%s.ldif' % (instance, backend)
+            with open(os.path.join(self.dir, ldifname), 'wb') as f:
+                writer = ldif.LDIFWriter(f)
+                for entry in entries:
+                    writer.unparse(str(entry.dn), dict(entry.raw))
+
+            try:
+                tombstones = conn.get_entries(
+                    suffix,
+                    filter='(&(objectclass=nsTombstone)%s)' % usn_filter,
+                    attrs_list=['nscpentrydn'])
+            except errors.NotFound:
+                tombstones = []
+            deleted = [t.single_value['nscpentrydn'] for t in tombstones
+                       if t.get('nscpentrydn')]
+            delname = '%s-%s.deleted' % (instance, backend)
+            with open(os.path.join(self.dir, delname), 'w') as f:
+                for dn in deleted:
+                    f.write('%s\n' % dn)
+
+            self.log.info('%d changed and %d deleted entries of %s backed '
+                          'up in %.2f seconds', len(entries), len(deleted),
+                          backend, time.time() - start)
+
+
     def db2ldif(self, instance, backend, online=True):
         '''
         Create a LDIF backup of the data in this instance.
@@ -386,7 +652,9 @@ class Backup(admintool.AdminTool):
         self.log.info('Backing up %s in %s to LDIF' % (backend, instance))
 
         now = time.localtime()
-        cn = time.strftime('export_%Y_%m_%d_%H_%M_%S')
+        # The instance and backend keep concurrent task names unique
+        cn = time.strftime('export_%s_%s_%%Y_%%m_%%d_%%H_%%M_%%S' %
+                           (instance, backend))
         dn = DN(('cn', cn), ('cn', 'export'), ('cn', 'tasks'), ('cn', 'config'))
 
         ldifname = '%s-%s.ldif' % (instance, backend)
@@ -437,7 +705,7 @@ class Backup(admintool.AdminTool):
         '''
         self.log.info('Backing up %s' % instance)
         now = time.localtime()
-        cn = time.strftime('backup_%Y_%m_%d_%H_%M_%S')
+        cn = time.strftime('backup_%s_%%Y_%%m_%%d_%%H_%%M_%%S' % instance)
         dn = DN(('cn', cn), ('cn', 'backup'), ('cn', 'tasks'), ('cn', 'config'))
 
         bakdir = os.path.join(paths.SLAPD_INSTANCE_BACKUP_DIR_TEMPLATE % (instance, instance))
@@ -482,8 +750,8 @@ class Backup(admintool.AdminTool):
                 '--exclude=/var/lib/ipa/backup',
                 '--xattrs',
                 '--selinux',
-                '-czf',
-                os.path.join(self.dir, 'files.tar')
+                '-cf',
+                '-'
                ]
 
         args.extend(verify_directories(self.dirs))
@@ -492,19 +760,25 @@ class Backup(admintool.AdminTool):
         if options.logs:
             args.extend(verify_directories(self.logs))
 
-        (stdout, stderr, rc) = run(args, raiseonerr=False)
-        if rc != 0:
-            raise admintool.ScriptError('tar returned non-zero %d: %s' % (rc, stdout))
+        run_pipeline([('tar', args), ('compression', self.compressor)],
+                     self.log, output=os.path.join(self.dir, 'files.tar'))
 
 
-    def create_header(self, data_only):
+    def create_header(self, data_only, parent=None):
         '''
         Create the backup file header that contains the meta data about
         this particular backup.
+
+        parent is the (name, usn) tuple of the backup an incremental backup
+        is based on.
         '''
         config = SafeConfigParser()
         config.add_section("ipa")
-        if data_only:
+        if parent is not None:
+            config.set('ipa', 'type', 'INCREMENTAL')
+            config.set('ipa', 'parent', parent[0])
+            config.set('ipa', 'parent_usn', str(parent[1]))
+        elif data_only:
             config.set('ipa', 'type', 'DATA')
         else:
             config.set('ipa', 'type', 'FULL')
@@ -528,11 +802,23 @@ class Backup(admintool.AdminTool):
             services_cns = [s.single_value['cn'] for s in services]
 
         config.set('ipa', 'services', ','.join(services_cns))
+
+        # The USN is read before the export so changes made while the
+        # backup runs are included in the next incremental backup
+        try:
+            config.set('ipa', 'usn', str(self.get_last_usn()))
+        except Exception, e:
+            if parent is not None:
+                raise
+            self.log.warning("Unable to read the last USN, incremental "
+                "backups cannot be based on this backup: %s" % e)
+
         with open(self.header, 'w') as fd:
             config.write(fd)
 
 
-    def finalize_backup(self, data_only=False, encrypt=False, keyring=None):
+    def finalize_backup(self, data_only=False, encrypt=False, keyring=None,
+                        incremental=False):
         '''
         Create the final location of the backup files and move the files
         we've backed up there, optionally encrypting them.
@@ -541,11 +827,15 @@ class Backup(admintool.AdminTool):
         contains the tarball of the files, a directory that contains
         the db2bak output and an LDIF.
 
-        These, along with the header, are moved into a new subdirectory
-        in /var/lib/ipa/backup.
+        These are archived by a single tar | compress | gpg pipeline
+        straight into a new subdirectory in /var/lib/ipa/backup, the
+        header is moved next to the archive.
         '''
 
-        if data_only:
+        if incremental:
+            backup_dir = os.path.join(paths.IPA_BACKUP_DIR, time.strftime('ipa-incr-%Y-%m-%d-%H-%M-%S'))
+            filename = os.path.join(backup_dir, "ipa-incr.tar")
+        elif data_only:
             backup_dir = os.path.join(paths.IPA_BACKUP_DIR, time.strftime('ipa-data-%Y-%m-%d-%H-%M-%S'))
             filename = os.path.join(backup_dir, "ipa-data.tar")
         else:
@@ -554,22 +844,22 @@ class Backup(admintool.AdminTool):
 
         os.mkdir(backup_dir, 0700)
 
-        cwd = os.getcwd()
-        os.chdir(self.dir)
         args = ['tar',
                 '--xattrs',
                 '--selinux',
-                '-czf',
-                filename,
+                '-cf',
+                '-',
                 '.'
                ]
-        (stdout, stderr, rc) = run(args, raiseonerr=False)
-        if rc != 0:
-            raise admintool.ScriptError('tar returned non-zero %d: %s' % (rc, stdout))
+        stages = [('tar', args), ('compression', self.compressor)]
 
         if encrypt:
-            self.log.info('Encrypting %s' % filename)
-            filename = encrypt_file(filename, keyring)
+            filename = filename + '.gpg'
+            self.log.info('Encrypting to %s' % filename)
+            stages.append(('encryption', gpg_encrypt_args(filename, keyring)))
+            run_pipeline(stages, self.log, cwd=self.dir)
+        else:
+            run_pipeline(stages, self.log, output=filename, cwd=self.dir)
 
         shutil.move(self.header, backup_dir)
 
@@ -120,6 +120,49 @@ class RemoveRUVParser(ldif.LDIFParser):
         self.writer.unparse(dn, entry)
 
 
+def replay_changes(conn, ldiffile, delfile):
+    '''
+    Apply the changes of an incremental backup using the connection conn.
+
+    Deleted entries listed in delfile are removed first, children first, so
+    that entries deleted and re-created since the parent backup are not lost.
+    Then the entries in ldiffile are re-added, or their attributes replaced
+    when they already exist, parents first. Missing files are skipped.
+    '''
+    if os.path.exists(delfile):
+        with open(delfile) as f:
+            deleted = [DN(line.strip()) for line in f if line.strip()]
+        deleted.sort(key=len, reverse=True)
+        for dn in deleted:
+            try:
+                conn.delete_entry(dn)
+            except errors.NotFound:
+                pass
+
+    if os.path.exists(ldiffile):
+        with open(ldiffile, 'rb') as f:
+            records = ldif.LDIFRecordList(f)
+            records.parse()
+        records = [(DN(dn), attrs) for dn, attrs in records.all_records]
+        records.sort(key=lambda r: len(r[0]))
+        for dn, attrs in records:
+            entry = conn.make_entry(dn)
+            entry.raw.update(attrs)
+            try:
+                conn.add_entry(entry)
+            except errors.DuplicateEntry:
+                names = set(name.lower() for name in attrs)
+                entry = conn.get_entry(dn, ['*'])
+                for name in entry.keys():
+                    if name.lower() not in names:
+                        entry.raw[name] = []
+                entry.raw.update(attrs)
+                try:
+                    conn.update_entry(entry)
+                except errors.EmptyModlist:
+                    pass
+
+
 class Restore(admintool.AdminTool):
     command_name = 'ipa-restore'
     log_file_name = paths.IPARESTORE_LOG
@@ -131,6 +174,7 @@ class Restore(admintool.AdminTool):
     def __init__(self, options, args):
         super(Restore, self).__init__(options, args)
         self._conn = None
+        self.incrementals = []
 
     @classmethod
     def add_options(cls, parser):
@@ -212,6 +256,8 @@ class Restore(admintool.AdminTool):
 
         try:
             self.read_header()
+            if self.backup_type == 'INCREMENTAL':
+                self.find_incremental_chain()
         except IOError as e:
             raise admintool.ScriptError("Cannot read backup metadata: %s" % e)
 
@@ -398,6 +444,13 @@ class Restore(admintool.AdminTool):
                 sssd.restart()
                 http = httpinstance.HTTPInstance()
                 http.remove_httpd_ccache()
+
+            if self.incrementals:
+                # The services were restarted, do not reuse the connection
+                self._conn = None
+                for backup_dir in self.incrementals:
+                    self.incremental_restore(backup_dir, databases,
+                                             options.gpg_keyring)
         finally:
             try:
                 os.chdir(cwd)
@@ -672,33 +725,87 @@ class Restore(admintool.AdminTool):
         self.backup_ipa_version = config.get('ipa', 'ipa_version')
         self.backup_version = config.get('ipa', 'version')
         self.backup_services = config.get('ipa', 'services').split(',')
+        if config.has_option('ipa', 'parent'):
+            self.backup_parent = config.get('ipa', 'parent')
+        else:
+            self.backup_parent = None
+
 
+    def find_incremental_chain(self):
+        '''
+        Follow the parents of an incremental backup up to the full or data
+        backup it is based on.
 
-    def extract_backup(self, keyring=None):
+        The base backup becomes the one to restore, the incremental
+        backups are stored oldest first to be replayed on top of it. The
+        parents are looked up in the directory of the given backup.
+        '''
+        chain = []
+        while self.backup_type == 'INCREMENTAL':
+            chain.insert(0, self.backup_dir)
+            top_dir = os.path.dirname(os.path.abspath(self.backup_dir))
+            self.backup_dir = os.path.join(top_dir, self.backup_parent)
+            self.header = os.path.join(self.backup_dir, 'header')
+            self.read_header()
+
+        self.log.info("Restoring %s followed by %d incremental backup(s)",
+                      self.backup_dir, len(chain))
+        self.incrementals = chain
+
+
+    def incremental_restore(self, backup_dir, databases, keyring=None):
+        '''
+        Replay an incremental backup on the running Directory Server.
+        '''
+        self.log.info("Restoring incremental backup %s", backup_dir)
+
+        incr_dir = tempfile.mkdtemp(dir=self.top_dir)
+        self.extract_backup(keyring, backup_dir=backup_dir,
+                            backup_type='INCREMENTAL', dest=incr_dir)
+
+        conn = self.get_connection()
+        for instance, backend in databases:
+            ldiffile = os.path.join(incr_dir, '%s-%s.ldif' % (instance, backend))
+            delfile = os.path.join(incr_dir, '%s-%s.deleted' % (instance, backend))
+            replay_changes(conn, ldiffile, delfile)
+
+
+    def extract_backup(self, keyring=None, backup_dir=None, backup_type=None,
+                       dest=None):
         '''
         Extract the contents of the tarball backup into a temporary location,
         decrypting if necessary.
+
+        By default the backup being restored is extracted into self.dir.
         '''
+        if backup_dir is None:
+            backup_dir = self.backup_dir
+        if backup_type is None:
+            backup_type = self.backup_type
+        if dest is None:
+            dest = self.dir
 
         encrypt = False
         filename = None
-        if self.backup_type == 'FULL':
-            filename = os.path.join(self.backup_dir, 'ipa-full.tar')
+        if backup_type == 'FULL':
+            filename = os.path.join(backup_dir, 'ipa-full.tar')
+        elif backup_type == 'INCREMENTAL':
+            filename = os.path.join(backup_dir, 'ipa-incr.tar')
         else:
-            filename = os.path.join(self.backup_dir, 'ipa-data.tar')
+            filename = os.path.join(backup_dir, 'ipa-data.tar')
         if not os.path.exists(filename):
             if not os.path.exists(filename + '.gpg'):
-                raise admintool.ScriptError('Unable to find backup file in %s' % self.backup_dir)
+                raise admintool.ScriptError('Unable to find backup file in %s' % backup_dir)
             else:
                 filename = filename + '.gpg'
                 encrypt = True
 
         if encrypt:
             self.log.info('Decrypting %s' % filename)
-            filename = decrypt_file(self.dir, filename, keyring)
+            filename = decrypt_file(dest, filename, keyring)
 
         cwd = os.getcwd()
-        os.chdir(self.dir)
+        os.chdir(dest)
 
         args = ['tar',
                 '--xattrs',
@@ -711,7 +818,7 @@ class Restore(admintool.AdminTool):
 
         pent = pwd.getpwnam(DS_USER)
         os.chown(self.top_dir, pent.pw_uid, pent.pw_gid)
-        recursive_chown(self.dir, pent.pw_uid, pent.pw_gid)
+        recursive_chown(dest, pent.pw_uid, pent.pw_gid)
 
         if encrypt:
             # We can remove the decoded tarball
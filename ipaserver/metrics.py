@@ -0,0 +1,146 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Command execution statistics and audit log.
+
+`WSGIExecutioner.wsgi_execute()` in `ipaserver.rpcserver` records every
+executed command in `command_stats` and, if the ``audit_log`` environment
+variable is set, in the audit log. The time spent in LDAP and CA operations
+is collected with `ipalib.request.record_duration()`.
+
+The statistics are kept in memory and are specific to the server process
+which executed the commands.
+"""
+
+import collections
+import json
+import threading
+
+# Number of most recent command durations percentiles are computed from
+SAMPLE_SIZE = 1000
+
+# Durations recorded separately from the total command duration
+DURATIONS = ('ldap', 'ca', 'marshal')
+
+
+def percentile(values, percent):
+    """
+    Return the nearest-rank ``percent`` percentile of the sorted ``values``.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    """
+    if not values:
+        return None
+    index = max(0, int(round(len(values) * percent / 100.0)) - 1)
+    return values[min(index, len(values) - 1)]
+
+
+class CommandStats(object):
+    """
+    Per-command execution counts and durations.
+    """
+
+    def __init__(self, sample_size=SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+    def record(self, name, duration, durations, error=None):
+        """
+        Record an execution of the command ``name``.
+
+        :param duration: total duration in seconds
+        :param durations: ``dict`` with durations of `DURATIONS` in seconds
+        :param error: name of the error class or None
+        """
+        with self.__lock:
+            stats = self.__stats.get(name)
+            if stats is None:
+                stats = self.__stats[name] = dict(
+                    count=0,
+                    errors=0,
+                    sample=collections.deque(maxlen=self.sample_size),
+                    durations=dict.fromkeys(DURATIONS, 0.0),
+                )
+            stats['count'] += 1
+            if error is not None:
+                stats['errors'] += 1
+            stats['sample'].append(duration)
+            for key in DURATIONS:
+                stats['durations'][key] += durations.get(key, 0.0)
+
+    def summary(self):
+        """
+        Return a ``list`` of ``dict``s with statistics of every command.
+
+        Durations are in milliseconds.
+        """
+        with self.__lock:
+            stats = [(name, s['count'], s['errors'], list(s['sample']),
+                      dict(s['durations']))
+                     for name, s in self.__stats.iteritems()]
+
+        result = []
+        for name, count, errors, sample, durations in sorted(stats):
+            sample.sort()
+            entry = dict(
+                command=name,
+                count=count,
+                errors=errors,
+                p50=percentile(sample, 50) * 1000,
+                p95=percentile(sample, 95) * 1000,
+                p99=percentile(sample, 99) * 1000,
+            )
+            for key in DURATIONS:
+                entry[key] = durations[key] * 1000 / count
+            result.append(entry)
+        return result
+
+    def clear(self):
+        with self.__lock:
+            self.__stats.clear()
+
+
+class AuditLog(object):
+    """
+    Append-only log file with a JSON record on each line.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__lock = threading.Lock()
+        self.__file = None
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.filename, 'a', 1)
+            self.__file.write(line)
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+
+_audit_logs = {}
+_audit_logs_lock = threading.Lock()
+
+
+def get_audit_log(filename):
+    """
+    Return the `AuditLog` writing to ``filename``, shared by all executioners.
+    """
+    with _audit_logs_lock:
+        audit_log = _audit_logs.get(filename)
+        if audit_log is None:
+            audit_log = _audit_logs[filename] = AuditLog(filename)
+        return audit_log
+
+
+command_stats = CommandStats()
@@ -243,6 +243,7 @@ import json
 from lxml import etree
 import os
 import tempfile
+import threading
 import time
 import urllib2
 
@@ -252,6 +253,7 @@ import pki.crypto as cryptoutil
 from pki.kra import KRAClient
 
 from ipalib import Backend
+from ipalib.request import record_duration
 from ipapython.dn import DN
 import ipapython.cookie
 import ipapython.dogtag
@@ -1241,10 +1243,11 @@ def host_has_service(host, ldap2, service='CA'):
     return False
 
 
-def select_any_master(ldap2, service='CA'):
+def select_any_master(ldap2, service='CA', exclude=()):
     """
     :param ldap2: connection to the local database
     :param service: The service for which we're looking for a master.
+    :param exclude: Hosts which should not be selected.
     :return:   host as str
 
     Select any host which is a master for a specified service.
@@ -1258,6 +1261,7 @@ def select_any_master(ldap2, service='CA'):
     query_filter = ldap2.make_filter(filter_attrs, rules='&')
     try:
         ent, trunc = ldap2.find_entries(filter=query_filter, base_dn=base_dn)
+        ent = [e for e in ent if e.dn[1].value not in exclude]
         if len(ent):
             entry = random.choice(ent)
             return entry.dn[1].value
@@ -1265,6 +1269,71 @@ def select_any_master(ldap2, service='CA'):
         pass
     return None
 
+
+# How long the selected CA host is used before it is selected again
+CA_HOST_TTL = 300
+# How long a CA host which failed to respond is not selected
+CA_HOST_RETRY_INTERVAL = 60
+
+
+class CAHostSelector(object):
+    """
+    Select the CA host used by the RA backends and remember the choice.
+
+    The configured CA host is preferred, then the local host and then any
+    other CA master. The selection is kept for CA_HOST_TTL seconds, so that
+    the masters are not looked up in LDAP for every request. Hosts reported
+    by `failed()` are not selected for CA_HOST_RETRY_INTERVAL seconds.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__host = None
+        self.__expires = 0
+        self.__failed = {}
+
+    def get(self, ldap2):
+        now = time.time()
+        with self.__lock:
+            if self.__host is not None and now < self.__expires:
+                return self.__host
+            self.__failed = dict(
+                (host, when) for (host, when) in self.__failed.iteritems()
+                if now < when + CA_HOST_RETRY_INTERVAL)
+            failed = set(self.__failed)
+
+        host = self.__select(ldap2, failed)
+
+        with self.__lock:
+            self.__host = host
+            self.__expires = now + CA_HOST_TTL
+        return host
+
+    def __select(self, ldap2, failed):
+        hosts = [api.env.ca_host]
+        if api.env.host != api.env.ca_host:
+            hosts.append(api.env.host)
+        for host in hosts:
+            if host not in failed and host_has_service(host, ldap2, "CA"):
+                return host
+        host = select_any_master(ldap2, exclude=failed)
+        if host:
+            return host
+        else:
+            return api.env.ca_host
+
+    def failed(self, host):
+        """
+        Report that ``host`` did not respond.
+        """
+        with self.__lock:
+            self.__failed[host] = time.time()
+            if self.__host == host:
+                self.__host = None
+
+
+ca_host_selector = CAHostSelector()
+
 #-------------------------------------------------------------------------------
 
 from ipalib import api, errors, SkipPluginModule
@@ -1274,7 +1343,6 @@ if api.env.ra_plugin != 'dogtag':
 import os, random
 from ipaserver.plugins import rabase
 from ipalib.constants import TYPE_ERROR
-from ipalib.util import cachedproperty
 from ipapython import dogtag
 from ipalib import _
 from ipaplatform.paths import paths
@@ -1285,6 +1353,8 @@ class ra(rabase.rabase):
     Request Authority backend plugin.
     """
     DEFAULT_PROFILE = dogtag.DEFAULT_PROFILE
+    # Maximum number of certificates requested from the CA at once by find()
+    FIND_PAGE_SIZE = 1000
 
     def __init__(self):
         if api.env.in_tree:
@@ -1326,7 +1396,7 @@ class ra(rabase.rabase):
         self.error('%s.%s(): %s', self.fullname, func_name, err_msg)
         raise errors.CertificateOperationError(error=err_msg)
 
-    @cachedproperty
+    @property
     def ca_host(self):
         """
         :return:   host
@@ -1334,39 +1404,72 @@ class ra(rabase.rabase):
 
         Select our CA host.
         """
-        ldap2 = self.api.Backend.ldap2
-        if host_has_service(api.env.ca_host, ldap2, "CA"):
-            return api.env.ca_host
-        if api.env.host != api.env.ca_host:
-            if host_has_service(api.env.host, ldap2, "CA"):
-                return api.env.host
-        host = select_any_master(ldap2)
-        if host:
-            return host
-        else:
-            return api.env.ca_host
+        return ca_host_selector.get(self.api.Backend.ldap2)
 
-    def _request(self, url, port, **kw):
+    def _request(self, url, port, idempotent=False, ca_host=None, **kw):
         """
         :param url: The URL to post to.
+        :param idempotent: Whether the request may be sent again, see
+                           `_failover()`.
+        :param ca_host: The CA host to use, see `_failover()`.
         :param kw: Keyword arguments to encode into POST body.
         :return:   (http_status, http_reason_phrase, http_headers, http_body)
                    as (integer, unicode, dict, str)
 
         Perform an HTTP request.
         """
-        return dogtag.http_request(self.ca_host, port, url, **kw)
+        return self._failover(
+            idempotent, ca_host, dogtag.http_request, port, url, **kw)
 
-    def _sslget(self, url, port, **kw):
+    def _sslget(self, url, port, idempotent=False, ca_host=None, **kw):
         """
         :param url: The URL to post to.
+        :param idempotent: Whether the request may be sent again, see
+                           `_failover()`.
+        :param ca_host: The CA host to use, see `_failover()`.
         :param kw:  Keyword arguments to encode into POST body.
         :return:   (http_status, http_reason_phrase, http_headers, http_body)
                    as (integer, unicode, dict, str)
 
         Perform an HTTPS request
         """
-        return dogtag.https_request(self.ca_host, port, url, self.sec_dir, self.password, self.ipa_certificate_nickname, **kw)
+        return self._failover(
+            idempotent, ca_host, dogtag.https_request, port, url,
+            self.sec_dir, self.password, self.ipa_certificate_nickname,
+            pooled=True, idempotent=idempotent, **kw)
+
+    def _failover(self, idempotent, host, request, port, url, *args, **kw):
+        """
+        Perform the request on our CA host. If the host does not respond,
+        retry once on another CA host if the request is idempotent.
+
+        Requests which change anything are not sent again, the host may
+        have executed them before failing. The following requests are sent
+        to another CA host though.
+
+        If ``host`` is not None, the request is performed on it without
+        selecting a CA host, which needs an LDAP connection.
+        """
+        if host is not None:
+            try:
+                return request(host, port, url, *args, **kw)
+            except errors.NetworkError:
+                ca_host_selector.failed(host)
+                raise
+
+        host = self.ca_host
+        try:
+            return request(host, port, url, *args, **kw)
+        except errors.NetworkError, e:
+            ca_host_selector.failed(host)
+            if not idempotent:
+                raise
+            other_host = self.ca_host
+            if other_host == host:
+                raise
+            self.warning("CA %s is not available (%s), using %s",
+                         host, e, other_host)
+        return request(other_host, port, url, *args, **kw)
 
     def get_parse_result_xml(self, xml_text, parse_func):
         '''
@@ -1425,6 +1528,7 @@ class ra(rabase.rabase):
         http_status, http_reason_phrase, http_headers, http_body = \
             self._request('/ca/ee/ca/checkRequest',
                           self.env.ca_port,
+                          idempotent=True,
                           requestId=request_id,
                           xml='true')
 
@@ -1454,7 +1558,7 @@ class ra(rabase.rabase):
 
         return cmd_result
 
-    def get_certificate(self, serial_number=None):
+    def get_certificate(self, serial_number=None, ca_host=None):
         """
         Retrieve an existing certificate.
 
@@ -1465,6 +1569,8 @@ class ra(rabase.rabase):
                               be prefixed with a hex radix prefix if the integral value
                               is represented as hexadecimal. If no radix prefix is
                               supplied the string will be interpreted as decimal.
+        :param ca_host: The CA host to send the request to (defaults to our
+                        CA host).
 
         The command returns a dict with these possible key/value pairs.
         Some key/value pairs may be absent.
@@ -1510,6 +1616,8 @@ class ra(rabase.rabase):
         http_status, http_reason_phrase, http_headers, http_body = \
             self._sslget('/ca/agent/ca/displayBySerial',
                          self.env.ca_agent_port,
+                         idempotent=True,
+                         ca_host=ca_host,
                          serialNumber=str(serial_number),
                          xml='true')
 
@@ -1543,11 +1651,14 @@ class ra(rabase.rabase):
         return cmd_result
 
 
-    def request_certificate(self, csr, profile_id, request_type='pkcs10'):
+    def request_certificate(self, csr, profile_id, request_type='pkcs10',
+                            ca_host=None):
         """
         :param csr: The certificate signing request.
         :param profile_id: The profile to use for the request.
         :param request_type: The request type (defaults to ``'pkcs10'``).
+        :param ca_host: The CA host to submit the request to (defaults to
+                        our CA host).
 
         Submit certificate signing request.
 
@@ -1578,6 +1689,7 @@ class ra(rabase.rabase):
         http_status, http_reason_phrase, http_headers, http_body = \
             self._sslget('/ca/eeca/ca/profileSubmitSSLClient',
                          self.env.ca_ee_port,
+                         ca_host=ca_host,
                          profileId=profile_id,
                          cert_request_type=request_type,
                          cert_request=csr,
@@ -1621,7 +1733,8 @@ class ra(rabase.rabase):
         return cmd_result
 
 
-    def revoke_certificate(self, serial_number, revocation_reason=0):
+    def revoke_certificate(self, serial_number, revocation_reason=0,
+                           ca_host=None):
         """
         :param serial_number: Certificate serial number. Must be a string value
                               because serial numbers may be of any magnitude and
@@ -1631,6 +1744,8 @@ class ra(rabase.rabase):
                               is represented as hexadecimal. If no radix prefix is
                               supplied the string will be interpreted as decimal.
         :param revocation_reason: Integer code of revocation reason.
+        :param ca_host: The CA host to send the request to (defaults to our
+                        CA host).
 
         Revoke a certificate.
 
@@ -1657,6 +1772,7 @@ class ra(rabase.rabase):
         http_status, http_reason_phrase, http_headers, http_body = \
             self._sslget('/ca/agent/ca/doRevoke',
                          self.env.ca_agent_port,
+                         ca_host=ca_host,
                          op='revoke',
                          revocationReason=revocation_reason,
                          revokeAll='(certRecordId=%s)' % str(serial_number),
@@ -1837,7 +1953,32 @@ class ra(rabase.rabase):
         payload = etree.tostring(doc, pretty_print=False, xml_declaration=True, encoding='UTF-8')
         self.debug('%s.find(): request: %s', self.fullname, payload)
 
-        url = 'http://%s/ca/rest/certs/search?size=%d' % (ipautil.format_netloc(self.ca_host, ipapython.dogtag.configured_constants().UNSECURE_PORT), options.get('sizelimit', 100))
+        # Request the certificates in pages, so that neither the CA nor we
+        # have to hold all of them in a single response
+        offset = options.get('offset', 0)
+        sizelimit = options.get('sizelimit', 100)
+        results = []
+        while len(results) < sizelimit:
+            size = min(self.FIND_PAGE_SIZE, sizelimit - len(results))
+            start = time.time()
+            try:
+                page = self._find_page(payload, offset + len(results), size)
+            finally:
+                record_duration('ca', time.time() - start)
+            results.extend(page)
+            if len(page) < size:
+                break
+
+        return results
+
+    def _find_page(self, payload, start, size):
+        """
+        Return at most ``size`` certificates matching the search request
+        ``payload``, skipping the first ``start`` of them.
+
+        The response is parsed while it is read.
+        """
+        url = 'http://%s/ca/rest/certs/search?start=%d&size=%d' % (ipautil.format_netloc(self.ca_host, ipapython.dogtag.configured_constants().UNSECURE_PORT), start, size)
 
         opener = urllib2.build_opener()
         opener.addheaders = [('Accept-Encoding', 'gzip, deflate'),
@@ -1857,33 +1998,34 @@ class ra(rabase.rabase):
             self.raise_certificate_operation_error('find',
                                                    detail=e.reason)
 
-        data = response.readlines()
-        self.debug('%s.find(): response: %s', self.fullname, data)
-        parser = etree.XMLParser()
+        results = []
+
         try:
-            doc = etree.fromstring(data[0], parser)
+            for event, cert in etree.iterparse(response, tag='CertDataInfo'):
+                response_request = {}
+                response_request['serial_number'] = int(cert.get('id'), 16) # parse as hex
+                response_request['serial_number_hex'] = u'0x%X' % response_request['serial_number']
+
+                dn = cert.find('SubjectDN')
+                if dn is not None:
+                    response_request['subject'] = unicode(dn.text)
+                status = cert.find('Status')
+                if status is not None:
+                    response_request['status'] = unicode(status.text)
+                results.append(response_request)
+
+                # Free the parsed certificates
+                cert.clear()
+                while cert.getprevious() is not None:
+                    del cert.getparent()[0]
         except etree.XMLSyntaxError, e:
             self.raise_certificate_operation_error('find',
                                                    detail=e.msg)
+        finally:
+            response.close()
 
-        # Grab all the certificates
-        certs = doc.xpath('//CertDataInfo')
-
-        results = []
-
-        for cert in certs:
-            response_request = {}
-            response_request['serial_number'] = int(cert.get('id'), 16) # parse as hex
-            response_request['serial_number_hex'] = u'0x%X' % response_request['serial_number']
-
-            dn = cert.xpath('SubjectDN')
-            if len(dn) == 1:
-                response_request['subject'] = unicode(dn[0].text)
-            status = cert.xpath('Status')
-            if len(status) == 1:
-                response_request['status'] = unicode(status[0].text)
-            results.append(response_request)
-
+        self.debug('%s.find(): %d certificates from %d', self.fullname,
+                   len(results), start)
         return results
 
 
@@ -1972,9 +2114,10 @@ class RestClient(Backend):
         self._read_password()
         super(RestClient, self).__init__()
 
-        # session cookie
+        # session cookie and the CA host it is valid on
         self.override_port = None
         self.cookie = None
+        self.session_host = None
 
     def _read_password(self):
         try:
@@ -1983,51 +2126,52 @@ class RestClient(Backend):
         except IOError:
             self.password = ''
 
-    @cachedproperty
+    @property
     def ca_host(self):
         """
         :return:   host
                    as str
 
-        Select our CA host.
+        Select our CA host. While logged into the REST API, this is the host
+        the session cookie was issued by.
         """
-        ldap2 = self.api.Backend.ldap2
-        if host_has_service(api.env.ca_host, ldap2, "CA"):
-            return api.env.ca_host
-        if api.env.host != api.env.ca_host:
-            if host_has_service(api.env.host, ldap2, "CA"):
-                return api.env.host
-        host = select_any_master(ldap2)
-        if host:
-            return host
-        else:
-            return api.env.ca_host
+        if self.session_host is not None:
+            return self.session_host
+        return ca_host_selector.get(self.api.Backend.ldap2)
 
     def __enter__(self):
         """Log into the REST API"""
         if self.cookie is not None:
             return
-        status, status_text, resp_headers, resp_body = dogtag.https_request(
-            self.ca_host, self.override_port or self.env.ca_agent_port,
-            '/ca/rest/account/login',
-            self.sec_dir, self.password, self.ipa_certificate_nickname,
-            method='GET'
-        )
-        cookies = ipapython.cookie.Cookie.parse(resp_headers.get('set-cookie', ''))
-        if status != 200 or len(cookies) == 0:
-            raise errors.RemoteRetrieveError(reason=_('Failed to authenticate to CA REST API'))
+        self.session_host = ca_host_selector.get(self.api.Backend.ldap2)
+        try:
+            status, status_text, resp_headers, resp_body = dogtag.https_request(
+                self.ca_host, self.override_port or self.env.ca_agent_port,
+                '/ca/rest/account/login',
+                self.sec_dir, self.password, self.ipa_certificate_nickname,
+                method='GET', pooled=True
+            )
+            cookies = ipapython.cookie.Cookie.parse(resp_headers.get('set-cookie', ''))
+            if status != 200 or len(cookies) == 0:
+                raise errors.RemoteRetrieveError(reason=_('Failed to authenticate to CA REST API'))
+        except:
+            self.session_host = None
+            raise
         self.cookie = str(cookies[0])
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         """Log out of the REST API"""
-        dogtag.https_request(
-            self.ca_host, self.override_port or self.env.ca_agent_port,
-            '/ca/rest/account/logout',
-            self.sec_dir, self.password, self.ipa_certificate_nickname,
-            method='GET'
-        )
-        self.cookie = None
+        try:
+            dogtag.https_request(
+                self.ca_host, self.override_port or self.env.ca_agent_port,
+                '/ca/rest/account/logout',
+                self.sec_dir, self.password, self.ipa_certificate_nickname,
+                method='GET', pooled=True
+            )
+        finally:
+            self.cookie = None
+            self.session_host = None
 
     def _ssldo(self, method, path, headers=None, body=None):
         """
@@ -2052,7 +2196,7 @@ class RestClient(Backend):
             self.ca_host, self.override_port or self.env.ca_agent_port,
             resource,
             self.sec_dir, self.password, self.ipa_certificate_nickname,
-            method=method, headers=headers, body=body
+            method=method, headers=headers, body=body, pooled=True
         )
         if status < 200 or status >= 300:
             explanation = self._parse_dogtag_error(resp_body) or ''
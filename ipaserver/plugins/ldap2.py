@@ -293,11 +293,8 @@ class ldap2(LDAPClient, CrudBackend):
 
         assert isinstance(dn, DN)
 
-        principal = getattr(context, 'principal')
-        entry = self.find_entry_by_attr("krbprincipalname", principal,
-            "krbPrincipalAux", base_dn=self.api.env.basedn)
-        sctrl = [GetEffectiveRightsControl(True, "dn: " + str(entry.dn))]
-        self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, sctrl)
+        self.conn.set_option(_ldap.OPT_SERVER_CONTROLS,
+                             self.__get_effective_rights_control())
         try:
             entry = self.get_entry(dn, attrs_list)
         finally:
@@ -305,6 +302,31 @@ class ldap2(LDAPClient, CrudBackend):
             self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
         return entry
 
+    def find_effective_rights(self, filter, attrs_list, base_dn):
+        """Returns the entries matching filter, together with the rights the
+           currently bound user has for them, see get_effective_rights().
+
+           All entries are checked with a single search.
+        """
+
+        assert isinstance(base_dn, DN)
+
+        self.conn.set_option(_ldap.OPT_SERVER_CONTROLS,
+                             self.__get_effective_rights_control())
+        try:
+            entries, truncated = self.find_entries(
+                filter, attrs_list, base_dn, size_limit=0)
+        finally:
+            # remove the control so subsequent operations don't include GER
+            self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
+        return entries
+
+    def __get_effective_rights_control(self):
+        principal = getattr(context, 'principal')
+        entry = self.find_entry_by_attr("krbprincipalname", principal,
+            "krbPrincipalAux", base_dn=self.api.env.basedn)
+        return [GetEffectiveRightsControl(True, "dn: " + str(entry.dn))]
+
     def can_write(self, dn, attr):
         """Returns True/False if the currently bound user has write permissions
            on the attribute. This only operates on a single attribute at a time.
@@ -59,25 +59,31 @@ class rabase(Backend):
         """
         raise errors.NotImplementedError(name='%s.check_request_status' % self.name)
 
-    def get_certificate(self, serial_number=None):
+    def get_certificate(self, serial_number=None, ca_host=None):
         """
         Retrieve an existing certificate.
 
         :param serial_number: certificate serial number
+        :param ca_host: The CA host to send the request to (defaults to
+                        the host selected by the backend).
         """
         raise errors.NotImplementedError(name='%s.get_certificate' % self.name)
 
-    def request_certificate(self, csr, profile_id, request_type='pkcs10'):
+    def request_certificate(self, csr, profile_id, request_type='pkcs10',
+                            ca_host=None):
         """
         Submit certificate signing request.
 
         :param csr: The certificate signing request.
         :param profile_id: Profile to use for this request.
         :param request_type: The request type (defaults to ``'pkcs10'``).
+        :param ca_host: The CA host to submit the request to (defaults to
+                        the host selected by the backend).
         """
         raise errors.NotImplementedError(name='%s.request_certificate' % self.name)
 
-    def revoke_certificate(self, serial_number, revocation_reason=0):
+    def revoke_certificate(self, serial_number, revocation_reason=0,
+                           ca_host=None):
         """
         Revoke a certificate.
 
@@ -100,6 +106,8 @@ class rabase(Backend):
 
         :param serial_number: Certificate serial number.
         :param revocation_reason: Integer code of revocation reason.
+        :param ca_host: The CA host to send the request to (defaults to the
+                        host selected by the backend).
         """
         raise errors.NotImplementedError(name='%s.revoke_certificate' % self.name)
 
@@ -27,6 +27,8 @@ from xml.sax.saxutils import escape
 from xmlrpclib import Fault
 import os
 import datetime
+import logging
+import time
 import urlparse
 import json
 import traceback
@@ -42,12 +44,15 @@ from ipalib.backend import Executioner
 from ipalib.errors import (PublicError, InternalError, CommandError, JSONError,
     CCacheError, RefererError, InvalidSessionPassword, NotFound, ACIError,
     ExecutionError, PasswordExpired)
-from ipalib.request import context, destroy_context
+from ipalib.request import (
+    context, destroy_context, get_durations, enable_trace, get_trace,
+    get_command_params)
 from ipalib.rpc import (xml_dumps, xml_loads,
     json_encode_binary, json_decode_binary)
 from ipalib.util import parse_time_duration, normalize_name
 from ipapython.dn import DN
 from ipaserver.plugins.ldap2 import ldap2
+from ipaserver.metrics import command_stats, get_audit_log
 from ipalib.session import (
     session_mgr, AuthManager, get_ipa_ccache_name,
     load_ccache_data, bind_ipa_ccache, release_ipa_ccache, fmt_time,
@@ -311,6 +316,13 @@ class WSGIExecutioner(Executioner):
         super(WSGIExecutioner, self)._on_finalize()
 
     def wsgi_execute(self, environ):
+        start = time.time()
+        context.durations = {}
+        context.__dict__.pop('command_params', None)
+        context.traces = {}
+        if self.api.env.ldap_trace:
+            enable_trace('ldap')
+        marshal_time = 0.0
         result = None
         error = None
         _id = None
@@ -339,7 +351,9 @@ class WSGIExecutioner(Executioner):
                 and environ['REQUEST_METHOD'] == 'POST'
             ):
                 data = read_input(environ)
+                marshal_start = time.time()
                 (name, args, options, _id) = self.unmarshal(data)
+                marshal_time = time.time() - marshal_start
             else:
                 (name, args, options, _id) = self.simple_unmarshal(environ)
             if name in self._system_commands:
@@ -361,15 +375,22 @@ class WSGIExecutioner(Executioner):
             os.environ['LANG'] = lang
 
         principal = getattr(context, 'principal', 'UNKNOWN')
-        if name and name in self.Command:
-            try:
-                params = self.Command[name].args_options_2_params(*args, **options)
-            except Exception, e:
-                self.info(
-                   'exception %s caught when converting options: %s', e.__class__.__name__, str(e)
-                )
-                # get at least some context of what is going on
-                params = options
+        if not self.log.isEnabledFor(logging.INFO):
+            # Don't bother with formatting the parameters
+            pass
+        elif name and name in self.Command:
+            # Use the parameters prepared by the command, they are only
+            # converted again if the command failed before preparing them
+            params = get_command_params(name)
+            if params is None:
+                try:
+                    params = self.Command[name].args_options_2_params(*args, **options)
+                except Exception, e:
+                    self.info(
+                       'exception %s caught when converting options: %s', e.__class__.__name__, str(e)
+                    )
+                    # get at least some context of what is going on
+                    params = options
             if error:
                 result_string = type(e).__name__
             else:
@@ -388,7 +409,48 @@ class WSGIExecutioner(Executioner):
                       type(e).__name__)
 
         version = options.get('version', VERSION_WITHOUT_CAPABILITIES)
-        return self.marshal(result, error, _id, version)
+        marshal_start = time.time()
+        response = self.marshal(result, error, _id, version)
+        end = time.time()
+
+        durations = get_durations()
+        durations['marshal'] = marshal_time + end - marshal_start
+        self.record_command(name, principal, start, end - start, durations,
+                            len(response), error)
+        return response
+
+    def record_command(self, name, principal, start, duration, durations,
+                       size, error):
+        """
+        Record the execution of a command in the command statistics and the
+        audit log.
+        """
+        if not name or name not in self.Command:
+            name = None
+        if error is not None:
+            error = type(error).__name__
+        command_stats.record(name or u'<unknown>', duration, durations,
+                             error)
+
+        if not self.api.env.audit_log:
+            return
+        record = dict(
+            time=start,
+            command=name,
+            principal=principal,
+            duration=duration,
+            size=size,
+            error=error,
+        )
+        record.update(durations)
+        trace = get_trace('ldap')
+        if trace is not None:
+            record['ldap_trace'] = trace
+        try:
+            get_audit_log(self.api.env.audit_log).write(record)
+        except EnvironmentError, e:
+            self.error('cannot write to audit log %s: %s',
+                       self.api.env.audit_log, e)
 
     def simple_unmarshal(self, environ):
         name = environ['PATH_INFO'].strip('/')
@@ -437,6 +499,10 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
     For information on the JSON-RPC spec, see:
 
         http://json-rpc.org/wiki/specification
+
+    If the request contains ``"ldap_trace": true``, the LDAP operations
+    performed by the command are returned in the ``ldap_trace`` member of
+    the response, provided the user is allowed to trace LDAP operations.
     """
 
     content_type = 'application/json'
@@ -468,8 +534,23 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
             version=unicode(VERSION),
         )
         response = json_encode_binary(response, version)
+        if getattr(context, 'ldap_trace_requested', False):
+            trace = get_trace('ldap')
+            if self.can_trace():
+                response['ldap_trace'] = trace
         return json.dumps(response, sort_keys=True, indent=4)
 
+    def can_trace(self):
+        """
+        Return True if the user is allowed to trace LDAP operations.
+        """
+        operationdn = DN(('cn', 'trace ldap operations'),
+                         self.api.env.container_virtual, self.api.env.basedn)
+        try:
+            return self.api.Backend.ldap2.can_write(operationdn, 'objectclass')
+        except PublicError:
+            return False
+
     def unmarshal(self, data):
         try:
             d = json.loads(data)
@@ -485,6 +566,9 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
         method = d['method']
         params = d['params']
         _id = d.get('id')
+        if d.get('ldap_trace'):
+            context.ldap_trace_requested = True
+            enable_trace('ldap')
         if not isinstance(params, (list, tuple)):
             raise JSONError(error=_('params must be a list'))
         if len(params) != 2:
@@ -22,8 +22,51 @@
 Test the `ipalib.aci` module.
 """
 
+import random
+import re
+import shlex
+
+from ipalib import aci
 from ipalib.aci import ACI
 
+
+class ShlexACI(ACI):
+    """ACI parsed with the original shlex based target parser"""
+    def _parse_target(self, aci):
+        lexer = shlex.shlex(aci.encode('utf-8'))
+        lexer.wordchars = lexer.wordchars + "."
+
+        var = False
+        op = "="
+        for token in lexer:
+            # We should have the form (a = b)(a = b)...
+            if token == "(":
+                var = lexer.next().strip()
+                operator = lexer.next()
+                if operator != "=" and operator != "!=":
+                    # Peek at the next char before giving up
+                    operator = operator + lexer.next()
+                    if operator != "=" and operator != "!=":
+                        raise SyntaxError("No operator in target, got '%s'" % operator)
+                op = operator
+                val = lexer.next().strip()
+                val = self._remove_quotes(val)
+                end = lexer.next()
+                if end != ")":
+                    raise SyntaxError('No end parenthesis in target, got %s' % end)
+
+            if var == 'targetattr':
+                # Make a string of the form attr || attr || ... into a list
+                t = re.split('[^a-zA-Z0-9;\*]+', val)
+                self.target[var] = {}
+                self.target[var]['operator'] = op
+                self.target[var]['expression'] = t
+            else:
+                self.target[var] = {}
+                self.target[var]['operator'] = op
+                self.target[var]['expression'] = val
+
+
 def check_aci_parsing(source, expected):
     a = ACI(source)
     print 'ACI was: ', a
@@ -157,3 +200,93 @@ def test_aci_parsing_8():
 def test_aci_parsing_9():
     check_aci_parsing('(targetfilter = "(|(objectClass=person)(objectClass=krbPrincipalAux)(objectClass=posixAccount)(objectClass=groupOfNames)(objectClass=posixGroup))")(targetattr != "aci || userPassword || krbPrincipalKey || sambaLMPassword || sambaNTPassword || passwordHistory")(version 3.0; acl "Account Admins can manage Users and Groups"; allow (add, delete, read, write) groupdn = "ldap:///cn=admins,cn=groups,cn=accounts,dc=greyoak,dc=com";)',
         '(targetattr != "aci || userPassword || krbPrincipalKey || sambaLMPassword || sambaNTPassword || passwordHistory")(targetfilter = "(|(objectClass=person)(objectClass=krbPrincipalAux)(objectClass=posixAccount)(objectClass=groupOfNames)(objectClass=posixGroup))")(version 3.0;acl "Account Admins can manage Users and Groups";allow (add,delete,read,write) groupdn = "ldap:///cn=admins,cn=groups,cn=accounts,dc=greyoak,dc=com";)')
+
+
+def test_parse_aci():
+    source = '(targetattr = "title")(version 3.0;acl "foobar";allow (write) userdn = "ldap:///self";)'
+    a = aci.parse_aci(source)
+    assert str(a) == source
+    assert aci.parse_aci(source) is a
+
+    bad = '(targetattr = "title")(version 2.0;acl "foobar";)'
+    for i in range(2):
+        try:
+            aci.parse_aci(bad)
+        except SyntaxError:
+            pass
+        else:
+            raise AssertionError('SyntaxError not raised')
+
+
+def test_aci_index():
+    location = 'dc=example,dc=com'
+    acistrs = [
+        '(targetattr = "title")(version 3.0;acl "permission:Foo";allow (write) userdn = "ldap:///self";)',
+        'garbage',
+        '(targetattr = "cn")(version 3.0;acl "permission:Bar";allow (write) userdn = "ldap:///all";)',
+    ]
+    aci.invalidate_aci_index()
+    index = aci.get_aci_index(location, acistrs)
+    assert [s for (s, a) in index.acis] == [acistrs[0], acistrs[2]]
+    assert [s for (s, e) in index.unparseable] == ['garbage']
+    assert index.find('permission:Foo') == [(acistrs[0], aci.parse_aci(acistrs[0]))]
+    assert index.find('permission:foo') == []
+    assert len(index.find('permission:foo', ignore_case=True)) == 1
+    assert index.find('permission:Baz') == []
+
+    assert aci.get_aci_index(location.upper(), list(acistrs)) is index
+    acistrs.pop()
+    new_index = aci.get_aci_index(location, acistrs)
+    assert new_index is not index
+    assert new_index.find('permission:Bar') == []
+
+    aci.invalidate_aci_index(location)
+    assert aci.get_aci_index(location, acistrs) is not new_index
+
+
+FUZZ_SOURCES = [
+    '(targetattr="title")(targetfilter="(memberOf=cn=bar,cn=groups,cn=accounts ,dc=example,dc=com)")(version 3.0;acl "foobar";allow (write) groupdn="ldap:///cn=foo,cn=groups,cn=accounts,dc=example,dc=com";)',
+    '(target="ldap:///uid=bjensen,dc=example,dc=com")(targetattr=*) (version 3.0;acl "aci1";allow (write) userdn="ldap:///self";)',
+    '(targetattr!=member)(targe="ldap:///cn=ipausers,cn=groups,cn=accounts,dc=example,dc=com")(version 3.0;acl "add_user_to_default_group";allow (write) groupdn="ldap:///cn=add_user_to_default_group,cn=taskgroups,dc=example,dc=com";)',
+    "(targetattr = 'cn || sn')(targetfilter = \"(objectclass=posixaccount)\")(version 3.0;acl \"permission:X\";allow (read) userdn = \"ldap:///all\";)",
+]
+FUZZ_CHARS = u'()"\'!=#* \t\n.;|_aZ9\xe9'
+
+
+def check_aci_equivalence(source):
+    try:
+        expected = ShlexACI(source)
+    except Exception:
+        try:
+            ACI(source)
+        except SyntaxError:
+            return
+        raise AssertionError('%r parsed, shlex failed' % source)
+    result = ACI(source)
+    assert result.__dict__ == expected.__dict__, source
+    for t in result.target:
+        assert (type(result.target[t]['expression']) is
+                type(expected.target[t]['expression']))
+
+
+def test_aci_parsing_fuzz():
+    """Compare the ACI parser with the shlex based one on mutated ACIs"""
+    rand = random.Random(0)
+    for i in range(2000):
+        source = list(rand.choice(FUZZ_SOURCES))
+        for j in range(rand.randint(1, 4)):
+            pos = rand.randrange(len(source))
+            op = rand.randint(0, 2)
+            if op == 0:
+                del source[pos]
+            elif op == 1:
+                source.insert(pos, rand.choice(FUZZ_CHARS))
+            else:
+                source[pos] = rand.choice(FUZZ_CHARS)
+        check_aci_equivalence(u''.join(source))
+
+    for source in FUZZ_SOURCES:
+        check_aci_equivalence(source)
+        check_aci_equivalence(source.replace('"', ''))
+        check_aci_equivalence(source.replace('(targetattr', '#x\n(targetattr'))
+        check_aci_equivalence(source.replace('=', ' # c\n='))
@@ -0,0 +1,119 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the certificate expiry index of the `ipalib.plugins.cert` module.
+"""
+
+import base64
+import datetime
+import os
+import shutil
+import tempfile
+
+from ipalib import api, errors
+from ipalib.plugins import cert
+from ipapython.dn import DN
+from ipatests.test_ipalib.test_x509 import goodcert
+
+
+class FakeEntry(dict):
+    def __init__(self, dn, timestamp, **attrs):
+        super(FakeEntry, self).__init__(attrs)
+        self.dn = dn
+        self.single_value = dict(modifytimestamp=timestamp)
+
+
+class FakeLDAP(object):
+    """
+    Connection returning all the entries below the searched base and
+    recording whether the certificates were requested.
+    """
+    MATCH_ANY = '|'
+    MATCH_ALL = '&'
+
+    def __init__(self, entries, truncated=False):
+        self.entries = entries
+        self.truncated = truncated
+        self.searches = []
+
+    def find_entries(self, filter, attrs_list, base_dn, **kwargs):
+        self.searches.append((base_dn, 'usercertificate' in attrs_list))
+        entries = [e for e in self.entries if e.dn.endswith(base_dn)]
+        if not entries:
+            raise errors.NotFound(reason='no such entry')
+        return entries, self.truncated
+
+    def make_filter_from_attr(self, attr, value, rules):
+        return ''
+
+    def combine_filters(self, filters, rules):
+        return ''
+
+
+class test_CertExpiryIndex(object):
+
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'index.json')
+        self.host_dn = DN(('fqdn', u'ipa.example.com'),
+                          api.env.container_host, api.env.basedn)
+        self.entry = FakeEntry(self.host_dn, datetime.datetime(2015, 1, 1),
+                               fqdn=[u'ipa.example.com'],
+                               usercertificate=[base64.b64decode(goodcert)])
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def fetched(self, ldap):
+        return [base_dn for (base_dn, fetch) in ldap.searches if fetch]
+
+    def test_find(self):
+        ldap = FakeLDAP([self.entry])
+        index = cert.CertExpiryIndex(self.filename)
+        result, truncated = index.find(ldap)
+        assert truncated is False
+        assert len(result) == 1
+        assert result[0]['principal'] == u'ipa.example.com'
+        assert result[0]['valid_not_after'] == u'Thu Jun 25 13:00:42 2015 UTC'
+        assert self.fetched(ldap) == [self.host_dn[1:]]
+
+        # The window is applied on the expiration time
+        result, truncated = index.find(ldap, datetime.datetime(2015, 6, 25),
+                                       datetime.datetime(2015, 6, 26))
+        assert len(result) == 1
+        result, truncated = index.find(ldap, datetime.datetime(2015, 6, 26))
+        assert result == []
+
+    def test_shared(self):
+        ldap = FakeLDAP([self.entry])
+        cert.CertExpiryIndex(self.filename).find(ldap)
+
+        # Another process uses the certificates indexed by the first one
+        ldap = FakeLDAP([self.entry])
+        index = cert.CertExpiryIndex(self.filename)
+        result, truncated = index.find(ldap)
+        assert len(result) == 1
+        assert self.fetched(ldap) == []
+
+        # and indexes them again once the entry was modified
+        self.entry.single_value['modifytimestamp'] = \
+            datetime.datetime(2015, 1, 2)
+        result, truncated = index.find(ldap)
+        assert len(result) == 1
+        assert self.fetched(ldap) == [self.host_dn[1:]]
+
+    def test_update(self):
+        ldap = FakeLDAP([self.entry])
+        cert.CertExpiryIndex(self.filename).update(ldap, self.host_dn)
+
+        ldap = FakeLDAP([self.entry])
+        result, truncated = cert.CertExpiryIndex(self.filename).find(ldap)
+        assert len(result) == 1
+        assert self.fetched(ldap) == []
+
+    def test_truncated(self):
+        ldap = FakeLDAP([self.entry], truncated=True)
+        result, truncated = cert.CertExpiryIndex(self.filename).find(ldap)
+        assert truncated is True
@@ -0,0 +1,98 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipalib.clicache` module.
+"""
+
+import json
+
+from ipatests.util import raises
+from ipalib import clicache, config, frontend, output, parameters, _
+
+
+def roundtrip(data):
+    return json.loads(json.dumps(data))
+
+
+def test_param():
+    """
+    Test the `ipalib.clicache.dump_param` and `load_param` functions.
+    """
+    for param in (
+        parameters.Str('uid', cli_name='login', label=_('User login'),
+                       maxlength=255, pattern='^[a-z]+$'),
+        parameters.Str('mail*', label=u'Email address'),
+        parameters.Int('uidnumber?', minvalue=1, default=42),
+        parameters.StrEnum('state', values=(u'enabled', u'disabled'),
+                           flags=['no_update']),
+        parameters.Flag('all', exclude='webui'),
+        parameters.Password('password', confirm=False),
+    ):
+        new = clicache.load_param(roundtrip(clicache.dump_param(param)))
+        assert type(new) is type(param)
+        assert new.name == param.name
+        for (key, kind, default) in param.kwargs:
+            if key in clicache.IGNORED_KWARGS:
+                continue
+            assert getattr(new, key) == getattr(param, key), key
+
+    e = raises(clicache.NotCacheable, clicache.dump_param,
+               parameters.Str('cn', default_from=lambda uid: uid))
+    assert 'cn' in str(e)
+
+    class MyStr(parameters.Str):
+        pass
+    raises(clicache.NotCacheable, clicache.dump_param, MyStr('cn'))
+
+
+def test_output():
+    """
+    Test the `ipalib.clicache.dump_output` and `load_output` functions.
+    """
+    for o in output.standard_entry + output.standard_list_of_entries:
+        new = clicache.load_output(roundtrip(clicache.dump_output(o)))
+        assert type(new) is type(o)
+        assert new.name == o.name
+        assert new.doc == unicode(o.doc)
+        assert list(new.flags) == list(o.flags)
+
+
+def test_command():
+    """
+    Test the `ipalib.clicache.dump_command` and `create_command` functions.
+    """
+    class example_show(frontend.Command):
+        """Display an example."""
+        takes_args = (parameters.Str('cn', label=u'Name'),)
+        takes_options = (parameters.Flag('all'),)
+        has_output = output.standard_entry
+        has_output_params = (parameters.Str('member', label=u'Members'),)
+
+    cmd = example_show()
+    cmd.env = config.Env(context='cli')
+    cmd.finalize()
+
+    cls = clicache.create_command(
+        'example_show', roundtrip(clicache.dump_command(cmd)))
+    new = cls()
+    new.env = config.Env(context='cli')
+    new.finalize()
+    assert new.name == 'example_show'
+    assert unicode(new.doc) == unicode(cmd.doc)
+    assert list(new.args) == list(cmd.args)
+    assert list(new.options) == list(cmd.options)
+    assert list(new.output) == list(cmd.output)
+    assert [type(o) for o in new.output()] == [type(o) for o in cmd.output()]
+    assert list(new.output_params) == list(cmd.output_params)
+    assert new.output_params.member.label == u'Members'
+
+    class example_del(example_show):
+        def output_for_cli(self, textui, output, *args, **options):
+            pass
+
+    cmd = example_del()
+    cmd.env = config.Env(context='cli')
+    cmd.finalize()
+    raises(clicache.NotCacheable, clicache.dump_command, cmd)
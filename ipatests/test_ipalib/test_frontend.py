@@ -453,6 +453,51 @@ class test_Command(ClassChecker):
         assert 'option2' in e['result']
         assert e['result']['option2'] == u'some value'
 
+    def test_call_plan(self):
+        """
+        Test the call plan created by `ipalib.frontend.Command._on_finalize`.
+        """
+        class my_cmd(self.cls):
+            takes_options = (
+                Str('option0', normalizer=lambda value: value.lower()),
+                Str('option1', default_from=lambda option0: option0),
+                Str('option2', default_from=lambda option1: option1),
+                Str('option3?'),
+            )
+
+            def run(self, *args, **options):
+                return dict(result=options)
+
+        (api, home) = create_test_api()
+        api.finalize()
+        o = my_cmd()
+        o.set_api(api)
+        o.finalize()
+        assert o._default_deps == dict(
+            option1=frozenset(['option0']),
+            option2=frozenset(['option0', 'option1']),
+        )
+        assert o._convert_params is not None
+        assert o._output_names == frozenset(['result'])
+        e = o(option0=u'Some Value')  # pylint: disable=not-callable
+        assert e['result']['option0'] == u'some value'
+        assert e['result']['option2'] == u'some value'
+
+        # Customized conversion must not be bypassed
+        class my_cmd2(my_cmd):
+            def convert(self, **kw):
+                kw = super(my_cmd2, self).convert(**kw)
+                kw['option3'] = u'converted'
+                return kw
+
+        o = my_cmd2()
+        o.set_api(api)
+        o.finalize()
+        assert o._convert_params is None
+        e = o(option0=u'Some Value')  # pylint: disable=not-callable
+        assert e['result']['option0'] == u'some value'
+        assert e['result']['option3'] == u'converted'
+
     def test_validate(self):
         """
         Test the `ipalib.frontend.Command.validate` method.
@@ -622,6 +667,28 @@ class test_Command(ClassChecker):
         assert o.run.im_func is self.cls.run.im_func
         assert ('forward', args, kw) == o.run(*args, **kw)
 
+    def test_internal(self):
+        """
+        Test the `ipalib.frontend.Command.internal` method.
+        """
+        class my_cmd(self.cls):
+            takes_args = (Str('name', normalizer=lambda value: value.lower()),)
+
+            def execute(self, *args, **kw):
+                return dict(args=args, version=kw['version'])
+
+        (api, home) = create_test_api(in_server=True)
+        api.finalize()
+        o = my_cmd()
+        o.set_api(api)
+        o.finalize()
+
+        # The output does not match has_output, only internal calls accept it
+        raises(ValueError, o, u'NAME')
+        out = o.internal(u'NAME')
+        assert out == dict(args=(u'name',), version=API_VERSION)
+        raises(errors.RequirementError, o.internal)
+
     def test_messages(self):
         """
         Test correct handling of messages
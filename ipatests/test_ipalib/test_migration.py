@@ -0,0 +1,158 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the migration checkpoint and the migration threads of the
+`ipalib.plugins.migration` module.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from ipaplatform.paths import paths
+from ipalib.plugins import migration
+from ipatests.util import raises
+
+
+class test_MigrationCheckpoint(object):
+    key = 'ldap://ds.example.com\nsubtree\nou=people,dc=example,dc=com'
+
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.migration_dir = paths.IPA_MIGRATION_DIR
+        paths.IPA_MIGRATION_DIR = self.tempdir
+
+    def teardown(self):
+        paths.IPA_MIGRATION_DIR = self.migration_dir
+        shutil.rmtree(self.tempdir)
+
+    def test_save_load(self):
+        checkpoint = migration.MigrationCheckpoint(self.key, False)
+        assert os.path.dirname(checkpoint.filename) == self.tempdir
+        assert ('user', u'tuser1') not in checkpoint
+        checkpoint.add('user', u'tuser1')
+        checkpoint.add('group', u'group one')
+        checkpoint.add('user', u'\u010dtuser2')
+        checkpoint.close()
+
+        # The same source uses the same file, another source another one
+        other = migration.MigrationCheckpoint(self.key + 'x', True)
+        assert other.filename != checkpoint.filename
+        assert other.migrated == set()
+        other.close(remove=True)
+
+        checkpoint = migration.MigrationCheckpoint(self.key, True)
+        assert checkpoint.migrated == set([
+            ('user', u'tuser1'),
+            ('group', u'group one'),
+            ('user', u'\u010dtuser2'),
+        ])
+        assert ('group', u'group one') in checkpoint
+        assert ('user', u'group one') not in checkpoint
+        checkpoint.close(remove=True)
+        assert not os.path.exists(checkpoint.filename)
+
+    def test_resume(self):
+        checkpoint = migration.MigrationCheckpoint(self.key, False)
+        checkpoint.add('user', u'tuser1')
+        checkpoint.close()
+
+        # A resumed migration keeps the entries migrated before
+        checkpoint = migration.MigrationCheckpoint(self.key, True)
+        checkpoint.add('user', u'tuser2')
+        checkpoint.close()
+
+        # The line being written when the migration was interrupted
+        with open(checkpoint.filename, 'a') as f:
+            f.write('user tuser3')
+
+        checkpoint = migration.MigrationCheckpoint(self.key, True)
+        assert checkpoint.migrated == set([
+            ('user', u'tuser1'),
+            ('user', u'tuser2'),
+        ])
+        checkpoint.close()
+
+        # Without --resume the migration starts over
+        checkpoint = migration.MigrationCheckpoint(self.key, False)
+        assert checkpoint.migrated == set()
+        checkpoint.close()
+        with open(checkpoint.filename) as f:
+            assert f.read() == ''
+
+
+class test_MigrationPool(object):
+
+    def setup(self):
+        self.lock = threading.Lock()
+        self.connected = []
+        self.migrated = []
+
+    def connect(self):
+        with self.lock:
+            self.connected.append(threading.current_thread().name)
+
+    def migrate(self, pkey, entry):
+        if entry is None:
+            raise ValueError(pkey)
+        with self.lock:
+            self.migrated.append((pkey, entry))
+
+    def test_migrate(self):
+        pool = migration._MigrationPool(self.migrate, self.connect, 4)
+        entries = [(u'tuser%d' % i, dict(uid=[u'tuser%d' % i]))
+                   for i in xrange(500)]
+        for pkey, entry in entries:
+            pool.submit(pkey, entry)
+        pool.close()
+
+        assert sorted(self.connected) == [
+            'migrate_ds-0', 'migrate_ds-1', 'migrate_ds-2', 'migrate_ds-3']
+        assert sorted(self.migrated) == sorted(entries)
+
+    def test_error(self):
+        pool = migration._MigrationPool(self.migrate, self.connect, 1)
+        pool.submit(u'tuser1', dict(uid=[u'tuser1']))
+        pool.submit(u'tuser2', None)
+        e = raises(ValueError, pool.close)
+        assert e.args == (u'tuser2',)
+        assert (u'tuser1', dict(uid=[u'tuser1'])) in self.migrated
+
+    def test_connect_error(self):
+        def connect():
+            raise ValueError('cannot connect')
+
+        pool = migration._MigrationPool(self.migrate, connect, 2)
+        # Submitting does not block even though nothing is migrated
+        for i in xrange(2 * migration.MIGRATION_QUEUE_DEPTH + 10):
+            try:
+                pool.submit(u'tuser%d' % i, dict(uid=[u'tuser%d' % i]))
+            except ValueError:
+                break
+        else:
+            raises(ValueError, pool.close)
+        assert self.migrated == []
+
+    def test_abort(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def migrate(pkey, entry):
+            started.set()
+            release.wait()
+            self.migrate(pkey, entry)
+
+        pool = migration._MigrationPool(migrate, self.connect, 1)
+        for i in xrange(3):
+            pool.submit(u'tuser%d' % i, dict(uid=[u'tuser%d' % i]))
+        started.wait()
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        pool.abort()
+        timer.join()
+
+        # Only the entry being migrated when aborting was migrated
+        assert self.migrated == [(u'tuser0', dict(uid=[u'tuser0']))]
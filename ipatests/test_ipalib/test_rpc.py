@@ -22,6 +22,7 @@ Test the `ipalib.rpc` module.
 """
 
 from xmlrpclib import Binary, Fault, dumps, loads
+import socket
 
 import nose
 from ipatests.util import raises, assert_equal, PluginTester, DummyClass
@@ -182,6 +183,182 @@ def test_xml_loads():
         assert type(e.faultString) is unicode
 
 
+def test_probe_servers():
+    """
+    Test the `ipalib.rpc.probe_servers` function.
+    """
+    listening = socket.socket()
+    listening.bind(('127.0.0.1', 0))
+    listening.listen(1)
+    closed = socket.socket()
+    closed.bind(('127.0.0.1', 0))
+    up = '127.0.0.1:%d' % listening.getsockname()[1]
+    down = '127.0.0.1:%d' % closed.getsockname()[1]
+    try:
+        rtts = rpc.probe_servers(['https://%s/ipa/xml' % down,
+                                  'https://%s/ipa/xml' % up], timeout=1)
+    finally:
+        listening.close()
+        closed.close()
+
+    assert sorted(rtts) == sorted([up, down])
+    assert rtts[up] is not None
+    assert rtts[down] is None
+
+
+def test_rank_urls():
+    """
+    Test the `ipalib.rpc.rank_urls` function.
+    """
+    urls = [
+        'https://a.example.com/ipa/xml',
+        'https://b.example.com/ipa/xml',
+        'https://c.example.com/ipa/xml',
+        'https://d.example.com/ipa/xml',
+    ]
+    rtts = {
+        'a.example.com': None,
+        'b.example.com': 0.5,
+        'c.example.com': 0.1,
+    }
+    assert rpc.rank_urls(urls, rtts) == [
+        'https://c.example.com/ipa/xml',
+        'https://b.example.com/ipa/xml',
+        'https://a.example.com/ipa/xml',
+        'https://d.example.com/ipa/xml',
+    ]
+
+
+def test_ConnectionPool():
+    """
+    Test the `ipalib.rpc.ConnectionPool` class.
+    """
+    class conn(object):
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    pool = rpc.ConnectionPool(maxidle=2)
+    assert pool.get('a') is None
+
+    c1, c2, c3 = conn(), conn(), conn()
+    pool.put('a', c1)
+    pool.put('a', c2)
+    pool.put('a', c3)
+    assert c3.closed
+    assert pool.get('b') is None
+    assert pool.get('a') is c2
+    assert pool.get('a') is c1
+    assert pool.get('a') is None
+    assert not (c1.closed or c2.closed)
+
+    pool.put('a', c1)
+    pool.put('b', c2)
+    pool.clear('a')
+    assert c1.closed and not c2.closed
+    assert pool.get('a') is None
+    pool.clear()
+    assert c2.closed
+    assert pool.get('b') is None
+
+    # Connections idle for too long are closed instead of reused
+    pool = rpc.ConnectionPool(maxidle=2, maxidletime=-1)
+    c1, c2 = conn(), conn()
+    pool.put('a', c1)
+    pool.put('a', c2)
+    assert pool.get('a') is None
+    assert c1.closed and c2.closed
+
+
+def test_SSLTransport_request_retry():
+    """
+    Test that `ipalib.rpc.SSLTransport.request` only retries requests which
+    were not sent.
+    """
+    class transport(rpc.SSLTransport):
+        def __init__(self, failures):
+            rpc.SSLTransport.__init__(self, 'json')
+            self.failures = list(failures)
+            self.calls = 0
+
+        def single_request(self, host, handler, request_body, verbose=0):
+            self.calls += 1
+            self._reused = self.calls == 1
+            failure = self.failures.pop(0)
+            if failure == 'send':
+                raise socket.error('connection reset')
+            if failure == 'response':
+                self._sent = True
+                raise socket.error('connection reset')
+            self._sent = True
+            return 'response'
+
+        def close(self):
+            pass
+
+    t = transport([None])
+    assert t.request('host', '/ipa/json', '{}') == 'response'
+    assert t.calls == 1
+
+    # The kept alive connection failed before the request was sent
+    t = transport(['send', None])
+    assert t.request('host', '/ipa/json', '{}') == 'response'
+    assert t.calls == 2
+
+    # The server may have executed the request
+    t = transport(['response', None])
+    raises(socket.error, t.request, 'host', '/ipa/json', '{}')
+    assert t.calls == 1
+
+
+def test_AsyncClient():
+    """
+    Test the `ipalib.rpc.AsyncClient` class.
+    """
+    connected = []
+
+    class fake_rpcclient(object):
+        def isconnected(self):
+            return getattr(context, 'test_conn', False)
+
+        def connect(self, **kw):
+            context.test_conn = True
+            connected.append(kw)
+
+        def disconnect(self):
+            del context.test_conn
+
+    def user_show(uid):
+        if uid == u'nobody':
+            raise errors.NotFound(reason=u'no such user')
+        return dict(result=dict(uid=uid))
+
+    class fake_api(object):
+        class env(object):
+            verbose = 0
+            fallback = True
+            delegate = False
+
+        class Backend(object):
+            rpcclient = fake_rpcclient()
+
+        Command = dict(user_show=user_show)
+
+    with rpc.AsyncClient(fake_api, workers=2) as client:
+        futures = [client.submit('user_show', u'user%d' % i)
+                   for i in xrange(10)]
+        missing = client.submit('user_show', u'nobody')
+        results = [f.result() for f in futures]
+        raises(errors.NotFound, missing.result)
+
+    assert results == [dict(result=dict(uid=u'user%d' % i))
+                       for i in xrange(10)]
+    assert all(f.done() for f in futures)
+    assert 1 <= len(connected) <= 2
+    raises(RuntimeError, client.submit, 'user_show', u'admin')
+
+
 class test_xmlclient(PluginTester):
     """
     Test the `ipalib.rpc.xmlclient` plugin.
@@ -45,6 +45,23 @@ def test_create_translation():
     assert context.__dict__[key] is t
 
 
+def test_get_translation():
+    f = text.get_translation
+    text.clear_translations()
+    t = f('foo', None, ['en_US'])
+    assert isinstance(t, text.CachedTranslation)
+    assert f('foo', None, ['en_US']) is t
+    assert f('foo', None, ['de_DE']) is not t
+    assert f('bar', None, ['en_US']) is not t
+    assert_equal(t.ugettext('Hello'), u'Hello')
+    assert_equal(t.ungettext('goose', 'geese', 1), u'goose')
+    assert_equal(t.ungettext('goose', 'geese', 2), u'geese')
+
+    for i in xrange(text.TRANSLATION_CACHE_SIZE):
+        f('foo%d' % i, None, ['en_US'])
+    assert f('foo', None, ['en_US']) is not t
+
+
 class test_TestLang(object):
     def setup(self):
         self.tmp_dir = None
@@ -24,3 +24,23 @@ Test the `ipalib.util` module.
 from ipalib import util
 
 
+
+
+def test_convert_sshpubkey():
+    """
+    Test the `ipalib.util.convert_sshpubkey` function.
+    """
+    pubkey = (
+        u'ssh-rsa AAAAB3NzaC1yc2EAAAADAQABAAABAQDGAX3xAeLeaJggwTqMjxNwa6XHBUAi'
+        u'kXPGMzEpVrlLDCZtv00djsFTBi38PkgxBJVkgRWMrcBsr/35lq7P6w8KGIwA8GI48Z0q'
+        u'BS2NBMJ2u9WQ2hjLN6GdMlo77O0uJY3251p12pCVIS/bHRSq8kHO2No8g7KA9fGGcagP'
+        u'fQH+ee3t7HUkpbQkFTmbPPN++r3V8oVUk5LxbryB3UIIVzNmcSIn3JrXynlvui4Mixvr'
+        u'tX6zx+O/bBo68o8/eZD26QrahVbA09fivrn/4h3TM019Eu/c2jOdckfU3cHUV/3Tno5d'
+        u'6JicibyaoDDK7S/yjdn5jhaz8MSEayQvFkZkiF0L public key test')
+    fp = (u'13:67:6B:BF:4E:A2:05:8E:AE:25:8B:A1:31:DE:6F:1B public key test '
+          u'(ssh-rsa)')
+
+    assert util.convert_sshpubkey(pubkey) == (pubkey, fp)
+    # The cached result is returned for the same key
+    assert util.convert_sshpubkey(pubkey) is util.convert_sshpubkey(pubkey)
+    assert util.convert_sshpubkey(u'ssh-rsa not-a-key') is None
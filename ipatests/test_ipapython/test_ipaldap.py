@@ -0,0 +1,214 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the paged searches and the operation traces of the
+`ipapython.ipaldap` module.
+"""
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+from ipalib import errors
+from ipalib.request import destroy_context, enable_trace, get_trace
+from ipapython import ipaldap
+from ipapython.dn import DN
+from ipatests.util import raises
+
+
+BASE_DN = DN(('cn', 'users'), ('cn', 'accounts'), ('dc', 'example'),
+             ('dc', 'com'))
+
+
+class FakeLDAPObject(object):
+    """
+    LDAP connection returning ``count`` entries in pages of the size
+    requested by the paged results control.
+
+    The cookie of a page is the index of its first entry. If ``paged`` is
+    False the control is ignored like by servers which do not support it.
+    Requesting the entry at index ``size_limit`` fails. Searches without
+    the control return all the entries.
+    """
+
+    def __init__(self, count, paged=True, size_limit=None):
+        self.dns = [DN(('uid', 'tuser%d' % i), BASE_DN)
+                    for i in xrange(count)]
+        self.paged = paged
+        self.size_limit = size_limit
+        self.searches = []
+        self.cancelled = []
+        self.results = []
+
+    def search_ext(self, base, scope, filterstr, attrlist=None,
+                   serverctrls=None, timeout=-1, sizelimit=0):
+        if serverctrls is None:
+            ctrl = SimplePagedResultsControl(0, 0, '')
+            paged = False
+        else:
+            ctrl, = serverctrls
+            paged = self.paged
+        start = int(ctrl.cookie or 0)
+        self.searches.append((start, ctrl.size))
+        if paged:
+            end = min(start + ctrl.size, len(self.dns))
+        else:
+            end = len(self.dns)
+
+        self.results = []
+        for i in xrange(start, end):
+            if i == self.size_limit:
+                self.results.append(ldap.SIZELIMIT_EXCEEDED(
+                    {'desc': 'Size limit exceeded'}))
+                return 1
+            self.results.append((ldap.RES_SEARCH_ENTRY,
+                                 [(str(self.dns[i]), {'uid': ['tuser%d' % i]})],
+                                 1, []))
+
+        ctrls = []
+        if paged:
+            cookie = str(end) if end < len(self.dns) else ''
+            ctrls.append(SimplePagedResultsControl(0, 0, cookie))
+        self.results.append((ldap.RES_SEARCH_RESULT, [], 1, ctrls))
+        return 1
+
+    def result3(self, msgid, all=1, timeout=None):
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def search_ext_s(self, base, scope, filterstr, attrlist=None,
+                     serverctrls=None, timeout=-1):
+        ctrl, = serverctrls
+        assert ctrl.size == 0
+        self.cancelled.append(ctrl.cookie)
+        return []
+
+    def delete_s(self, dn):
+        dn = DN(dn)
+        if dn not in self.dns:
+            raise ldap.NO_SUCH_OBJECT({'desc': 'No such object'})
+        self.dns.remove(dn)
+
+
+def connect(*args, **kwargs):
+    client = ipaldap.LDAPClient('ldap://ldap.example.com', no_schema=True)
+    client._conn = FakeLDAPObject(*args, **kwargs)
+    return client
+
+
+class test_iter_entries(object):
+
+    def iter_dns(self, client, page_size):
+        return [entry.dn for entry in client.iter_entries(
+            '(uid=*)', ['uid'], BASE_DN, page_size=page_size)]
+
+    def test_pages(self):
+        client = connect(5)
+        assert self.iter_dns(client, 2) == client.conn.dns
+        assert client.conn.searches == [(0, 2), (2, 2), (4, 2)]
+        assert client.conn.cancelled == []
+
+    def test_full_pages(self):
+        client = connect(4)
+        assert self.iter_dns(client, 2) == client.conn.dns
+        assert client.conn.searches == [(0, 2), (2, 2)]
+        assert client.conn.cancelled == []
+
+    def test_not_paged(self):
+        client = connect(5, paged=False)
+        assert self.iter_dns(client, 2) == client.conn.dns
+        assert client.conn.searches == [(0, 2)]
+
+    def test_stop(self):
+        client = connect(5)
+        entries = client.iter_entries('(uid=*)', ['uid'], BASE_DN,
+                                      page_size=2)
+        assert entries.next().dn == client.conn.dns[0]
+        assert client.conn.searches == [(0, 2)]
+
+        # The remaining pages are not requested and the search is cancelled
+        entries.close()
+        assert client.conn.searches == [(0, 2)]
+        assert client.conn.cancelled == ['2']
+
+    def test_size_limit(self):
+        client = connect(5, size_limit=3)
+        dns = []
+
+        def iterate():
+            for entry in client.iter_entries('(uid=*)', ['uid'], BASE_DN,
+                                             page_size=2):
+                dns.append(entry.dn)
+
+        raises(errors.LimitsExceeded, iterate)
+        # The entries returned before hitting the limit are yielded
+        assert dns == client.conn.dns[:3]
+        assert client.conn.searches == [(0, 2), (2, 2)]
+
+    def test_empty(self):
+        client = connect(0)
+        raises(errors.EmptyResult, self.iter_dns, client, 2)
+        assert client.conn.searches == [(0, 2)]
+
+
+class test_trace(object):
+
+    def setup(self):
+        destroy_context()
+        enable_trace('ldap')
+
+    def teardown(self):
+        destroy_context()
+
+    def get_trace(self):
+        """
+        Return the trace records with the durations checked and removed.
+        """
+        trace = get_trace('ldap')
+        for record in trace:
+            assert isinstance(record.pop('duration'), float)
+        return trace
+
+    def test_search(self):
+        client = connect(3)
+        entries, truncated = client.find_entries(
+            '(uid=*)', ['uid'], BASE_DN, ldap.SCOPE_ONELEVEL)
+        assert len(entries) == 3
+        assert self.get_trace() == [dict(
+            operation='search', dn=unicode(BASE_DN), scope='onelevel',
+            filter='(uid=*)', attrs=['uid'], count=3, truncated=False,
+        )]
+
+    def test_paged_search(self):
+        client = connect(3)
+        entries = list(client.iter_entries('(uid=*)', None, BASE_DN,
+                                           page_size=2))
+        assert len(entries) == 3
+        # One record per page
+        assert self.get_trace() == [
+            dict(operation='search', dn=unicode(BASE_DN), scope='subtree',
+                 filter='(uid=*)', attrs=None, count=2, truncated=False),
+            dict(operation='search', dn=unicode(BASE_DN), scope='subtree',
+                 filter='(uid=*)', attrs=None, count=1, truncated=False),
+        ]
+
+    def test_delete(self):
+        client = connect(1)
+        dn = client.conn.dns[0]
+        client.delete_entry(dn)
+        # Failed operations are traced as well
+        raises(errors.NotFound, client.delete_entry, dn)
+        assert self.get_trace() == [
+            dict(operation='delete', dn=unicode(dn)),
+            dict(operation='delete', dn=unicode(dn)),
+        ]
+
+    def test_not_traced(self):
+        destroy_context()
+        client = connect(1)
+        assert client._trace('delete', BASE_DN) is None
+        client.delete_entry(client.conn.dns[0])
+        assert get_trace('ldap') is None
@@ -0,0 +1,132 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Tests for the `ipaserver.install.ipa_restore` module.
+"""
+
+import os
+import shutil
+import tempfile
+
+from ipalib import errors
+from ipapython.dn import DN
+from ipaserver.install import ipa_restore
+
+
+class FakeEntry(object):
+    def __init__(self, dn, raw=None):
+        self.dn = dn
+        self.raw = dict(raw or {})
+
+    def keys(self):
+        return self.raw.keys()
+
+
+class FakeConnection(object):
+    """
+    Connection keeping the entries in a dict, children must be deleted
+    before their parents.
+    """
+
+    def __init__(self, entries):
+        self.entries = dict(entries)
+
+    def make_entry(self, dn):
+        return FakeEntry(dn)
+
+    def add_entry(self, entry):
+        if entry.dn in self.entries:
+            raise errors.DuplicateEntry()
+        self.entries[entry.dn] = dict(entry.raw)
+
+    def get_entry(self, dn, attrs_list=None):
+        if dn not in self.entries:
+            raise errors.NotFound(reason='no such entry')
+        return FakeEntry(dn, self.entries[dn])
+
+    def update_entry(self, entry):
+        attrs = dict((k, v) for k, v in entry.raw.iteritems() if v)
+        if attrs == self.entries[entry.dn]:
+            raise errors.EmptyModlist()
+        self.entries[entry.dn] = attrs
+
+    def delete_entry(self, dn):
+        if dn not in self.entries:
+            raise errors.NotFound(reason='no such entry')
+        for other in self.entries:
+            if other != dn and other.endswith(dn):
+                raise errors.NotAllowedOnNonLeaf()
+        del self.entries[dn]
+
+
+class test_replay_changes(object):
+    suffix = DN(('dc', 'example'), ('dc', 'com'))
+    users = DN(('cn', 'users'), suffix)
+
+    def setup(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.ldiffile = os.path.join(self.tempdir, 'userRoot.ldif')
+        self.delfile = os.path.join(self.tempdir, 'userRoot.deleted')
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write(self, filename, content):
+        with open(filename, 'w') as f:
+            f.write(content)
+
+    def user(self, uid):
+        return DN(('uid', uid), self.users)
+
+    def test_changes(self):
+        conn = FakeConnection({
+            self.users: {'cn': ['users']},
+            self.user('changed'): {'uid': ['changed'], 'sn': ['Old'],
+                                   'title': ['Old']},
+            self.user('deleted'): {'uid': ['deleted']},
+        })
+        self.write(self.ldiffile,
+                   'dn: %s\nuid: changed\nsn: New\n\n'
+                   'dn: %s\nuid: added\n\n' %
+                   (self.user('changed'), self.user('added')))
+        self.write(self.delfile, '%s\n' % self.user('deleted'))
+
+        ipa_restore.replay_changes(conn, self.ldiffile, self.delfile)
+
+        assert conn.entries == {
+            self.users: {'cn': ['users']},
+            self.user('changed'): {'uid': ['changed'], 'sn': ['New']},
+            self.user('added'): {'uid': ['added']},
+        }
+
+    def test_deleted_and_added(self):
+        # The entry was deleted and re-created since the parent backup, it
+        # is both in the deleted entries and the changed entries
+        conn = FakeConnection({
+            self.users: {'cn': ['users']},
+            self.user('readded'): {'uid': ['readded'], 'sn': ['Old'],
+                                   'title': ['Old']},
+        })
+        self.write(self.ldiffile,
+                   'dn: %s\nuid: readded\nsn: New\n\n' % self.user('readded'))
+        self.write(self.delfile, '%s\n' % self.user('readded'))
+
+        ipa_restore.replay_changes(conn, self.ldiffile, self.delfile)
+
+        assert conn.entries == {
+            self.users: {'cn': ['users']},
+            self.user('readded'): {'uid': ['readded'], 'sn': ['New']},
+        }
+
+    def test_deleted_subtree(self):
+        conn = FakeConnection({
+            self.users: {'cn': ['users']},
+            self.user('deleted'): {'uid': ['deleted']},
+        })
+        self.write(self.delfile, '%s\n%s\n' % (self.users, self.user('deleted')))
+
+        ipa_restore.replay_changes(conn, self.ldiffile, self.delfile)
+
+        assert conn.entries == {}
@@ -0,0 +1,72 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipaserver.metrics` module.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+from ipaserver import metrics
+
+
+def test_percentile():
+    values = range(1, 101)
+    assert metrics.percentile(values, 50) == 50
+    assert metrics.percentile(values, 95) == 95
+    assert metrics.percentile(values, 99) == 99
+    assert metrics.percentile([7], 99) == 7
+    assert metrics.percentile([], 50) is None
+
+
+def test_command_stats():
+    stats = metrics.CommandStats(sample_size=10)
+    for i in xrange(20):
+        stats.record(u'user_show', (i + 1) / 1000.0, dict(ldap=0.001))
+    stats.record(u'user_show', 1.0, {}, error='NotFound')
+    stats.record(u'group_show', 0.002, dict(ldap=0.001, marshal=0.001))
+
+    summary = stats.summary()
+    assert [s['command'] for s in summary] == [u'group_show', u'user_show']
+
+    group_show, user_show = summary
+    assert group_show['count'] == 1
+    assert group_show['errors'] == 0
+    assert group_show['p50'] == 2.0
+    assert group_show['marshal'] == 1.0
+    assert group_show['ca'] == 0.0
+
+    assert user_show['count'] == 21
+    assert user_show['errors'] == 1
+    # Only the 10 most recent durations are sampled
+    assert user_show['p50'] == 16.0
+    assert user_show['p99'] == 1000.0
+    assert round(user_show['ldap'], 6) == round(20.0 / 21, 6)
+
+    stats.clear()
+    assert stats.summary() == []
+
+
+def test_audit_log():
+    tempdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tempdir, 'audit.log')
+        audit_log = metrics.get_audit_log(filename)
+        assert metrics.get_audit_log(filename) is audit_log
+
+        audit_log.write(dict(command=u'user_show', error=None))
+        audit_log.write(dict(command=u'group_show', error=u'NotFound'))
+        audit_log.close()
+
+        with open(filename) as f:
+            records = [json.loads(line) for line in f]
+        assert records == [
+            dict(command=u'user_show', error=None),
+            dict(command=u'group_show', error=u'NotFound'),
+        ]
+    finally:
+        shutil.rmtree(tempdir)
@@ -26,6 +26,9 @@ import json
 from ipatests.util import create_test_api, assert_equal, raises, PluginTester
 from ipatests.data import unicode_str
 from ipalib import errors, Command
+from ipalib.request import (
+    context, destroy_context, enable_trace, is_traced, record_trace,
+    get_trace, set_command_params, get_command_params)
 from ipaserver import rpcserver
 
 
@@ -123,6 +126,23 @@ def test_params_2_args_options():
     assert f([args, options]) == (args, options)
 
 
+
+def test_command_params():
+    """
+    Test the params of the executed command reused for the request log line.
+    """
+    destroy_context()
+    try:
+        assert get_command_params(u'user_show') is None
+        set_command_params(u'user_show', dict(uid=u'jdoe'))
+        # The command executed by the request is kept
+        set_command_params(u'group_show', dict(cn=u'admins'))
+        assert get_command_params(u'user_show') == dict(uid=u'jdoe')
+        assert get_command_params(u'group_show') is None
+    finally:
+        destroy_context()
+    assert get_command_params(u'user_show') is None
+
 class test_session(object):
     klass = rpcserver.wsgi_dispatch
 
@@ -245,3 +265,46 @@ class test_jsonserver(PluginTester):
         options = dict(givenname=u'John', sn='Doe')
         d = dict(method=u'user_add', params=(args, options), id=18)
         assert o.unmarshal(json.dumps(d)) == (u'user_add', args, options, 18)
+
+        # Test requesting LDAP operation tracing:
+        destroy_context()
+        try:
+            assert not is_traced('ldap')
+            d = dict(method=u'user_show', params=(args, {}), id=18,
+                     ldap_trace=True)
+            assert o.unmarshal(json.dumps(d)) == (u'user_show', args, {}, 18)
+            assert is_traced('ldap')
+            record_trace('ldap', dict(operation='search'))
+            assert get_trace('ldap') == [dict(operation='search')]
+        finally:
+            destroy_context()
+        assert get_trace('ldap') is None
+
+    def test_marshal_ldap_trace(self):
+        """
+        Test the LDAP trace in the `ipaserver.rpcserver.jsonserver.marshal`
+        response.
+        """
+        (o, api, home) = self.instance('Backend', in_server=True)
+        record = dict(operation=u'search', dn=u'cn=test', count=1)
+
+        def marshal(can_trace):
+            object.__setattr__(o, 'can_trace', lambda: can_trace)
+            return json.loads(o.marshal(dict(value=u'test'), None, 18))
+
+        destroy_context()
+        try:
+            # Tracing not requested
+            enable_trace('ldap')
+            record_trace('ldap', record)
+            assert 'ldap_trace' not in marshal(True)
+
+            # Tracing requested by a user not allowed to trace
+            context.ldap_trace_requested = True
+            assert 'ldap_trace' not in marshal(False)
+
+            response = marshal(True)
+            assert response['ldap_trace'] == [record]
+            assert response['result'] == dict(value=u'test')
+        finally:
+            destroy_context()
@@ -124,3 +124,17 @@ class test_update(object):
             request = pkcs10.load_certificate_request(csr)
         except TypeError, typeerr:
             assert(str(typeerr) == 'Incorrect padding')
+
+    def test_certification_request(self):
+        """
+        Test the decoded CSR object
+        """
+        csr = self.read_file("test1.csr")
+        request = pkcs10.CertificationRequest(csr)
+
+        assert request.subject.common_name == 'test.example.com'
+        assert request.extensions == ('2.5.29.17',)
+        assert request.subjectaltname == (
+            (pkcs10.SAN_DNSNAME, 'testlow.example.com'),)
+        assert request.principal_names == ()
+        assert request.friendlyname is None
@@ -23,6 +23,7 @@ Test the `ipalib/plugins/automember.py` module.
 
 from ipalib import api, errors
 from ipapython.dn import DN
+from ipatests.util import Fuzzy
 from ipatests.test_xmlrpc import objectclasses
 from xmlrpc_test import Declarative, fuzzy_digits, fuzzy_uuid, \
     fuzzy_automember_dn, fuzzy_automember_message
@@ -60,6 +61,7 @@ group_include_regex = u'mscott'
 hostgroup_include_regex = u'^web[1-9]'
 hostgroup_include_regex2 = u'^www[1-9]'
 hostgroup_include_regex3 = u'webserver[1-9]'
+hostgroup_unused_regex = u'^app[1-9]'
 hostgroup_exclude_regex = u'^web5'
 hostgroup_exclude_regex2 = u'^www5'
 hostgroup_exclude_regex3 = u'^webserver5'
@@ -262,6 +264,89 @@ class test_automember(Declarative):
             ),
         ),
 
+        dict(
+            desc='Rebuild membership for hostgroups incrementally',
+            command=('automember_rebuild', [],
+                     dict(type=u'hostgroup', incremental=True)),
+            expected=dict(
+                value=None,
+                summary=fuzzy_automember_message,
+                result=dict(
+                    modified_since=Fuzzy('^\d{14}Z$'),
+                ),
+            ),
+        ),
+
+        dict(
+            desc='Add automember condition matching no host: %r' % hostgroup1,
+            command=(
+                'automember_add_condition', [hostgroup1], dict(
+                    key=u'fqdn', type=u'hostgroup',
+                    automemberinclusiveregex=[hostgroup_unused_regex],
+                )
+            ),
+            expected=dict(
+                value=hostgroup1,
+                summary=u'Added condition(s) to "%s"' % hostgroup1,
+                completed=1,
+                failed=dict(
+                    failed=dict(
+                        automemberinclusiveregex=tuple(),
+                        automemberexclusiveregex=tuple(),
+                    )
+                ),
+                result=dict(
+                    cn=[hostgroup1],
+                    description=[u'Test desc'],
+                    automemberinclusiveregex=[
+                        u'fqdn=%s' % hostgroup_include_regex,
+                        u'fqdn=%s' % hostgroup_unused_regex,
+                    ],
+                    automembertargetgroup=[hostgroup1_dn],
+                ),
+            ),
+        ),
+
+        dict(
+            desc='Rebuild all hostgroup members after the rules changed',
+            command=('automember_rebuild', [],
+                     dict(type=u'hostgroup', incremental=True)),
+            expected=dict(
+                value=None,
+                summary=fuzzy_automember_message,
+                result=dict(),
+            ),
+        ),
+
+        dict(
+            desc='Remove automember condition: %r' % hostgroup1,
+            command=(
+                'automember_remove_condition', [hostgroup1], dict(
+                    key=u'fqdn', type=u'hostgroup',
+                    automemberinclusiveregex=[hostgroup_unused_regex],
+                )
+            ),
+            expected=dict(
+                value=hostgroup1,
+                summary=u'Removed condition(s) from "%s"' % hostgroup1,
+                completed=1,
+                failed=dict(
+                    failed=dict(
+                        automemberinclusiveregex=tuple(),
+                        automemberexclusiveregex=tuple(),
+                    )
+                ),
+                result=dict(
+                    cn=[hostgroup1],
+                    description=[u'Test desc'],
+                    automemberinclusiveregex=[
+                        u'fqdn=%s' % hostgroup_include_regex,
+                    ],
+                    automembertargetgroup=[hostgroup1_dn],
+                ),
+            ),
+        ),
+
         dict(
             desc='Retrieve hostgroup: %r' % hostgroup1,
             command=('hostgroup_show', [hostgroup1], dict()),
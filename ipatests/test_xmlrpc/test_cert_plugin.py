@@ -188,7 +188,58 @@ class test_cert(XMLRPC_test):
         # And it should match the new one
         assert base64.b64encode(res['usercertificate'][0]) == newcert
 
-    def test_0007_cleanup(self):
+    def test_0007_cert_request_batch(self):
+        """
+        Issue several certificates with a single cert_request_batch
+        """
+        global batchcerts
+
+        csrs = [unicode(self.generateCSR(str(self.subject))) for i in range(2)]
+        requests = [dict(csr=csr, principal=self.service_princ) for csr in csrs]
+        requests.append(dict(
+            csr=csrs[0],
+            principal=u'test/notfound.%s@%s' % (api.env.domain, api.env.realm)))
+        res = api.Command['cert_request_batch'](requests)
+        assert res['count'] == 3
+        assert res['results'][0]['error'] is None
+        assert res['results'][1]['error'] is None
+        assert res['results'][2]['error_name'] == u'NotFound'
+        batchcerts = [r['result'] for r in res['results'][:2]]
+
+        # Both certificates are stored in the service entry
+        res = api.Command['service_show'](self.service_princ)['result']
+        stored = [base64.b64encode(c) for c in res['usercertificate']]
+        for c in batchcerts:
+            assert c['certificate'] in stored
+
+    def test_0008_cert_revoke_batch(self):
+        """
+        Revoke the certificates issued by cert_request_batch
+        """
+        global batchcerts
+
+        serials = [unicode(c['serial_number']) for c in batchcerts]
+        res = api.Command['cert_revoke_batch'](serials, revocation_reason=4)
+        assert res['count'] == 2
+        for r in res['results']:
+            assert r['error'] is None
+            assert r['result']['revoked'] is True
+
+    def test_0009_cert_expiry_find(self):
+        """
+        Search for the certificates of the service by expiration date
+        """
+        res = api.Command['cert_expiry_find'](
+            validnotafter_from=u'2000-01-01', validnotafter_to=u'2100-01-01',
+            sizelimit=0)
+        principals = [r['principal'] for r in res['result']]
+        assert self.service_princ in principals
+        assert res['truncated'] is False
+
+        res = api.Command['cert_expiry_find'](validnotafter_to=u'2000-01-01')
+        assert res['count'] == 0
+
+    def test_0010_cleanup(self):
         """
         Clean up cert test data
         """
@@ -451,3 +502,30 @@ class test_cert_find(XMLRPC_test):
         Search using invalid date format
         """
         res = api.Command['cert_find'](issuedon_from=u'xyz')
+
+    def test_0032_find_truncated(self):
+        """
+        Search with a sizelimit lower than the number of matches
+        """
+        res = api.Command['cert_find'](sizelimit=5)
+        assert res['count'] == 5 and res['truncated'] is True
+
+    def test_0033_find_not_truncated(self):
+        """
+        Search with a sizelimit higher than the number of matches
+        """
+        res = api.Command['cert_find'](subject=u'Certificate Authority',
+                                       sizelimit=5)
+        assert res['count'] == 1 and res['truncated'] is False
+
+    def test_0034_find_offset(self):
+        """
+        Search for all certificates in pages
+        """
+        res = api.Command['cert_find'](sizelimit=10)
+        serials = [cert['serial_number'] for cert in res['result']]
+        pages = []
+        for offset in (0, 5):
+            res = api.Command['cert_find'](sizelimit=5, offset=offset)
+            pages.extend(cert['serial_number'] for cert in res['result'])
+        assert pages == serials
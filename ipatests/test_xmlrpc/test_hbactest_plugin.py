@@ -198,6 +198,52 @@ class test_hbactest(XMLRPC_test):
             nodetail=True
         )
 
+    def test_fa_hbactest_bulk(self):
+        """
+        Test running 'ipa hbactest-bulk' with several users
+        """
+        ret = api.Command['hbactest_bulk'](
+            user=[self.test_user, u'hbacrule_test_nonexistent_user'],
+            targethost=[self.test_host],
+            service=[self.test_service],
+            rules=self.rule_names
+        )
+        assert ret['count'] == 2
+        assert ret['value'] == False
+        assert ret['error'] == None
+        result = ret['result'][0]
+        assert result['user'] == self.test_user
+        assert result['value'] == True
+        for i in [0,1,2,3]:
+            assert self.rule_names[i] in result['matched']
+        result = ret['result'][1]
+        assert result['value'] == False
+        assert result['matched'] == []
+
+    def test_fb_hbactest_rules_changed(self):
+        """
+        Test that 'ipa hbactest' notices changes of the cached IPA rules
+        """
+        ret = api.Command['hbactest'](
+            user=self.test_user,
+            targethost=self.test_host,
+            service=self.test_service,
+            enabled=True
+        )
+        assert self.rule_names[0] in ret['matched']
+
+        api.Command['hbacrule_disable'](self.rule_names[0])
+        try:
+            ret = api.Command['hbactest'](
+                user=self.test_user,
+                targethost=self.test_host,
+                service=self.test_service,
+                enabled=True
+            )
+            assert self.rule_names[0] not in (ret['matched'] or [])
+        finally:
+            api.Command['hbacrule_enable'](self.rule_names[0])
+
     def test_g_hbactest_clear_testing_data(self):
         """
         Clear data for HBAC test plugin testing.
@@ -0,0 +1,152 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `stageuser_activate_bulk` command of the
+`ipalib/plugins/stageuser.py` module.
+"""
+
+from ipalib import errors
+from ipatests.util import Fuzzy
+from ipatests.test_xmlrpc.test_user_plugin import get_user_result
+from xmlrpc_test import Declarative
+
+
+manager1 = u'tmanager1'
+user1 = u'tuser1'
+user2 = u'tuser2'
+user_does_not_exist = u'does_not_exist'
+
+
+def has_manager(manager):
+    def test(result):
+        return result.get('manager') == [manager]
+    return test
+
+
+class test_stageuser_activate_bulk(Declarative):
+
+    cleanup_commands = [
+        ('user_del', [manager1, user1, user2], {'continue': True}),
+        ('stageuser_del', [manager1, user1, user2], {'continue': True}),
+    ]
+
+    tests = [
+
+        dict(
+            desc='Try to activate stage users without selecting any',
+            command=('stageuser_activate_bulk', [], {}),
+            expected=errors.RequirementError(name='uid'),
+        ),
+
+        dict(
+            desc='Create active user %r' % manager1,
+            command=('user_add', [manager1],
+                     dict(givenname=u'Test', sn=u'Manager1')),
+            expected=dict(
+                value=manager1,
+                summary=u'Added user "%s"' % manager1,
+                result=get_user_result(manager1, u'Test', u'Manager1', 'add'),
+            ),
+        ),
+
+        dict(
+            desc='Create stage user %r with manager %r' % (user1, manager1),
+            command=('stageuser_add', [user1],
+                     dict(givenname=u'Test', sn=u'User1', manager=manager1)),
+            expected=dict(
+                value=user1,
+                summary=u'Added stage user "%s"' % user1,
+                result=Fuzzy(type=dict),
+            ),
+        ),
+
+        dict(
+            desc='Delete active user %r' % manager1,
+            command=('user_del', [manager1], {}),
+            expected=dict(
+                value=[manager1],
+                summary=u'Deleted user "%s"' % manager1,
+                result=dict(failed=[]),
+            ),
+        ),
+
+        dict(
+            desc='Create stage user %r' % manager1,
+            command=('stageuser_add', [manager1],
+                     dict(givenname=u'Test', sn=u'Manager1')),
+            expected=dict(
+                value=manager1,
+                summary=u'Added stage user "%s"' % manager1,
+                result=Fuzzy(type=dict),
+            ),
+        ),
+
+        dict(
+            desc='Create stage user %r' % user2,
+            command=('stageuser_add', [user2],
+                     dict(givenname=u'Test', sn=u'User2')),
+            expected=dict(
+                value=user2,
+                summary=u'Added stage user "%s"' % user2,
+                result=Fuzzy(type=dict),
+            ),
+        ),
+
+        dict(
+            desc='Activate %r and its manager %r together' % (user1, manager1),
+            command=('stageuser_activate_bulk', [[user1, manager1]],
+                     dict(workers=2)),
+            expected=dict(
+                value=True,
+                summary=u'2 of 2 stage users activated',
+                count=2,
+                result=[
+                    dict(uid=user1, value=True),
+                    dict(uid=manager1, value=True),
+                ],
+            ),
+        ),
+
+        dict(
+            desc='Check the manager of activated user %r is kept' % user1,
+            command=('user_show', [user1], {}),
+            expected=dict(
+                value=user1,
+                summary=None,
+                result=Fuzzy(type=dict, test=has_manager(manager1)),
+            ),
+        ),
+
+        dict(
+            desc='Activate %r, a non-existent and an activated user' % user2,
+            command=('stageuser_activate_bulk',
+                     [[user2, user_does_not_exist, user1]], {}),
+            expected=dict(
+                value=False,
+                summary=u'1 of 3 stage users activated',
+                count=1,
+                result=[
+                    dict(uid=user2, value=True),
+                    dict(uid=user_does_not_exist, value=False,
+                         error=u'%s: stage user not found' %
+                         user_does_not_exist),
+                    dict(uid=user1, value=False,
+                         error=u'%s: stage user not found' % user1),
+                ],
+            ),
+        ),
+
+        dict(
+            desc='Activate the stage users matching a filter',
+            command=('stageuser_activate_bulk', [],
+                     dict(filter=u'uid=%s' % user_does_not_exist)),
+            expected=dict(
+                value=True,
+                summary=u'0 of 0 stage users activated',
+                count=0,
+                result=[],
+            ),
+        ),
+    ]
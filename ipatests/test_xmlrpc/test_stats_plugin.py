@@ -0,0 +1,57 @@
+#
+# Copyright (C) 2015  FreeIPA Contributors see COPYING for license
+#
+
+"""
+Test the `ipalib/plugins/stats.py` module.
+"""
+
+from ipalib import errors, _
+from ipatests.util import Fuzzy
+from xmlrpc_test import Declarative
+
+
+def has_command_entries(result):
+    for entry in result:
+        if set(entry) != set(['command', 'count', 'errors', 'p50', 'p95',
+                              'p99', 'ldap', 'ca', 'marshal']):
+            return False
+        if entry['count'] < 1 or entry['errors'] > entry['count']:
+            return False
+    return True
+
+
+class test_command_stats(Declarative):
+
+    tests = [
+        dict(
+            desc='Ping the server',
+            command=('ping', [], {}),
+            expected=dict(
+                summary=Fuzzy('IPA server version .*. API version .*')),
+        ),
+
+        dict(
+            desc='Show command statistics',
+            command=('command_stats', [], {}),
+            expected=dict(
+                count=Fuzzy(type=int),
+                truncated=False,
+                summary=Fuzzy(r'\d+ commands? executed'),
+                result=Fuzzy(type=list, test=has_command_entries),
+            ),
+        ),
+
+        dict(
+            desc='Try to show command statistics with an argument',
+            command=('command_stats', ['bad_arg'], {}),
+            expected=errors.ZeroArgumentError(name='command_stats'),
+        ),
+
+        dict(
+            desc='Try to show command statistics with an option',
+            command=('command_stats', [], dict(bad_arg=True)),
+            expected=errors.OptionError(_('Unknown option: %(option)s'),
+                                        option='bad_arg'),
+        ),
+    ]